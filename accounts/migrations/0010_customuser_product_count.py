@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# The users created before this migration get the number of products they already have
+def count_products(apps, schema_editor):
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    Product = apps.get_model('products', 'Product')
+    total = (
+        Product.objects.filter(user=OuterRef('pk'))
+        .order_by()
+        .values('user')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    CustomUser.objects.update(product_count=Coalesce(Subquery(total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_customuser_groups_customuser_is_superuser_and_more'),
+        ('products', '0005_product_visibility_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='product count'),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
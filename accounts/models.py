@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 # for internalization support in future
 from django.utils.translation import gettext_lazy as _
 from django.utils.timezone import now
@@ -42,6 +44,54 @@ class CustomUserManager(BaseUserManager):
 
         return self.create_user(email, username, password, **extra_fields)
 
+    # This function changes the product_count of the users, deltas is a dict of {user id: number of products added}
+    # (negative for the removed ones). The change is done by the db with F("product_count") + delta, so two requests
+    # that add a product of the same user at the same time both get counted. The users with the same delta are
+    # updated with a single query, so a batch of products costs one or two queries.
+    # A count that drifted (refer: reconcile_product_counts) can be lower than the products removed, it stops at 0
+    # instead of breaking the write of the products with the CHECK of the PositiveIntegerField.
+    def adjust_product_counts(self, deltas):
+        users_by_delta = {}
+        for user_id, delta in deltas.items():
+            if user_id is not None and delta:
+                users_by_delta.setdefault(delta, []).append(user_id)
+        for delta, user_ids in users_by_delta.items():
+            count = F("product_count") + delta
+            if delta < 0:
+                count = Greatest(count, 0)
+            self.filter(pk__in=user_ids).update(product_count=count)
+
+    # This function sets the product_count of the users whose count is not the real number of their products
+    # (something wrote the products without going through the code that keeps the counts, like raw SQL)
+    # returns the list of (user id, stored count, real count) of the users that were fixed
+    # The count is shown with the owner of every product, so the cached responses of the fixed owners are made stale
+    def reconcile_product_counts(self, dry_run=False):
+        from api.cache import response_cache
+        from products.models import Product
+
+        # the order_by() clears any default ordering so that the GROUP BY happens only on the user column
+        real_count = Coalesce(
+            Subquery(
+                Product.objects.filter(user=OuterRef("pk"))
+                .order_by()
+                .values("user")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+        drifted = list(
+            self.annotate(real_count=real_count)
+            .exclude(product_count=F("real_count"))
+            .order_by("pk")
+            .values_list("pk", "product_count", "real_count")
+        )
+        if drifted and not dry_run:
+            # the count is computed again by the UPDATE itself, so a product written in between is not lost
+            self.filter(pk__in=[pk for pk, _, _ in drifted]).update(product_count=real_count)
+            response_cache.invalidate_owners(*[pk for pk, _, _ in drifted])
+        return drifted
+
 
 class CustomUser(AbstractBaseUser, PermissionsMixin):
     '''
@@ -66,6 +116,10 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
                    )
     )
     date_joined = models.DateTimeField(_("date joined"), default=now)
+    # The number of products of the user, it is shown with every product he owns (refer: api/serializers.UserPublicSerialzer)
+    # so it is stored instead of counted for every product rendered. It is kept up to date by the signals of the products
+    # (refer: products/signals.py) and the bulk endpoints, the reconcile_product_counts command fixes any drift.
+    product_count = models.PositiveIntegerField(_("product count"), default=0, editable=False)
 
     # Here we call the manager class and link it with the model
     objects = CustomUserManager()
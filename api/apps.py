@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Importing these modules registers their signal receivers and system checks
+        from . import checks, middleware, signals  # noqa: F401
@@ -0,0 +1,66 @@
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.pagination import LimitOffsetPagination
+
+from .renderers import ORJSONRenderer
+
+# These are the helpers of the async views (refer: products/views.py and search/views.py)
+# DRF views are synchronous, so under ASGI every DRF request runs in a thread that is blocked while the db works.
+# The async views do the same work as their DRF versions but they await the db with the async ORM (acount, aget, async for),
+# and they return exactly the same json as the DRF views.
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    # The same renderer as the DRF views so that the output is byte for byte the same (refer: REST_FRAMEWORK in the settings)
+    return HttpResponse(
+        ORJSONRenderer().render(data), content_type="application/json", status=status_code
+    )
+
+
+def error_response(exc):
+    '''
+    Converts an APIException into the same response the DRF exception handler returns
+    '''
+    status_code = exc.status_code
+    # The SessionAuthentication is the first authentication class and it has no WWW-Authenticate header,
+    # so DRF turns the 401 responses into 403 ones, the async views do the same
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        status_code = status.HTTP_403_FORBIDDEN
+    # the errors of a ValidationError are returned as they are, like {"fields": ["Unknown fields: ..."]}
+    if isinstance(exc.detail, (list, dict)):
+        return json_response(exc.detail, status_code=status_code)
+    return json_response({"detail": exc.detail}, status_code=status_code)
+
+
+def method_not_allowed(request):
+    return error_response(exceptions.MethodNotAllowed(request.method))
+
+
+def permission_denied(user):
+    if not user.is_authenticated:
+        return error_response(exceptions.NotAuthenticated())
+    return error_response(exceptions.PermissionDenied())
+
+
+# This is an async version of the LimitOffsetPagination which is the default pagination of the api
+class AsyncLimitOffsetPagination(LimitOffsetPagination):
+    async def apaginate_queryset(self, queryset, request):
+        # the LimitOffsetPagination reads request.query_params which only exists on the DRF requests
+        request.query_params = request.GET
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return [obj async for obj in queryset]
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [obj async for obj in queryset[self.offset : self.offset + self.limit]]
+
+    def get_paginated_data(self, data):
+        return {
+            "count": self.count,
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
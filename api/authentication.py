@@ -1,7 +1,181 @@
+import copy
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .cache import LRUCache, bump_version, get_version
+
+
+# This is a cache of token key -> (user, token) so that the token authentication does not have to run the
+# Token.objects.select_related('user').get(key=...) query on every request
+# The entries live in a LRU cache inside the process, and if TOKEN_AUTH_CACHE_ALIAS is set they are also stored
+# in that django cache so that the other processes can share them.
+# Every token has a version in the shared cache of TOKEN_AUTH_VERSION_CACHE_ALIAS (like the versions of the
+# permission cache), it is bumped as soon as the token is deleted/rotated or the user is changed (refer: api/signals.py)
+# and an entry is only used while its version is the current one, so a change made by any process is seen by all
+# of them on their next request. The TOKEN_AUTH_CACHE_TTL bounds the life of the entries of the tokens nobody changes.
+# The version is read before the db, an entry loaded while the token was being changed is stored with the old version.
+class TokenUserCache:
+    key_prefix = "token-auth"
+
+    def __init__(self):
+        self.local = LRUCache(
+            max_size=getattr(settings, "TOKEN_AUTH_CACHE_MAX_SIZE", 10000),
+            ttl=getattr(settings, "TOKEN_AUTH_CACHE_TTL", 60),
+        )
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "TOKEN_AUTH_CACHE_ALIAS", None)
+        return caches[alias] if alias else None
+
+    @property
+    def versions(self):
+        return caches[getattr(settings, "TOKEN_AUTH_VERSION_CACHE_ALIAS", "default")]
+
+    def _version_key(self, key):
+        return f"{self.key_prefix}:version:{key}"
+
+    def _shared_key(self, key, version):
+        return f"{self.key_prefix}:{key}:{version}"
+
+    def get_version(self, key):
+        return get_version(self.versions, self._version_key(key))
+
+    def get(self, key, version):
+        '''
+        Returns the (user, token) of the token key if it is cached with the given version (refer: get_version), else None
+        '''
+        entry = self.local.get(key)
+        if entry is not None and entry[0] != version:
+            # the token or its user was changed, maybe by another process
+            self.local.delete(key)
+            entry = None
+        if entry is None and self.shared is not None:
+            shared = self.shared.get(self._shared_key(key, version))
+            if shared is not None:
+                entry = (version, *shared)
+                self.local.set(key, entry)
+        self._count("hits" if entry is not None else "misses")
+        return entry[1:] if entry is not None else None
+
+    def set(self, key, user, token, version):
+        self.local.set(key, (version, user, token))
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key, version), (user, token), self.local.ttl)
+
+    def invalidate(self, *keys):
+        for key in keys:
+            bump_version(self.versions, self._version_key(key))
+            self.local.delete(key)
+
+    def clear(self):
+        self.local.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["size"] = len(self.local)
+        stats["evictions"] = self.local.get_stats()["evictions"]
+        return stats
+
+
+token_user_cache = TokenUserCache()
+
 
 # This class is written to customize the token authentication class
 # We can manually add any fields if needed like expiresAt inorder to expire the token after certain time
 # refer: from rest_framework.authtoken.models.Token class source code
 class BearerTokenAuthentication(TokenAuthentication):
     keyword = 'Bearer'
+
+    # This is the function of the TokenAuthentication that looks up the token in the db,
+    # we first look for the token in the token_user_cache and only go to the db if it is not there
+    def authenticate_credentials(self, key):
+        # The JWTs are also sent with the Bearer keyword, they always contain dots unlike our tokens,
+        # returning None lets the next authentication class (JWTAuthentication) handle them
+        if "." in key:
+            return None
+        version = token_user_cache.get_version(key)
+        entry = token_user_cache.get(key, version)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            token_user_cache.set(key, user, token, version)
+            entry = (user, token)
+        user, token = entry
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        # Every request gets its own copy of the user so that nothing a request stores on the user object
+        # (like the permission cache of django) leaks into the other requests
+        return copy.copy(user), token
+
+
+# This is the async version of the DEFAULT_AUTHENTICATION_CLASSES used by the async views (refer: products/views.py and search/views.py)
+# It tries the same three authentications in the same order, but the db is queried with the async ORM:
+#   * SessionAuthentication  -> request.auser()
+#   * BearerTokenAuthentication -> the token_user_cache, or Token.objects.aget() on a miss
+#   * JWTAuthentication -> the JWT is validated in memory and the user is loaded with aget()
+# Returns the user (AnonymousUser if no credentials were sent) and raises AuthenticationFailed for bad credentials
+async def aauthenticate(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+
+    header = request.headers.get("Authorization", "").split()
+    if not header or header[0].lower() != BearerTokenAuthentication.keyword.lower():
+        return user
+    if len(header) != 2:
+        raise exceptions.AuthenticationFailed(_("Invalid token header."))
+    key = header[1]
+    if "." in key:
+        return await aauthenticate_jwt(key)
+    return await aauthenticate_token(key)
+
+
+async def aauthenticate_token(key):
+    version = token_user_cache.get_version(key)
+    entry = token_user_cache.get(key, version)
+    if entry is None:
+        try:
+            token = await Token.objects.select_related("user").aget(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        entry = (token.user, token)
+        token_user_cache.set(key, token.user, token, version)
+    user, token = entry
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+    return copy.copy(user)
+
+
+async def aauthenticate_jwt(raw_token):
+    # validating the JWT only checks its signature and its claims, it does not touch the db
+    validated_token = JWTAuthentication().get_validated_token(raw_token.encode())
+    try:
+        user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise exceptions.AuthenticationFailed(_("Token contained no recognizable user identification"))
+    User = get_user_model()
+    try:
+        user = await User.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_("User not found"))
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed(_("User is inactive"))
+    return user
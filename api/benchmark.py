@@ -0,0 +1,712 @@
+import asyncio
+import json
+import math
+import platform
+import random
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.db import OperationalError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import renderers
+from .renderers import ORJSONRenderer
+
+from products.models import Product
+from products.serializers import CompiledProductSerializer, ProductSerializer
+
+# This module is the benchmark suite of the api (refer: the benchmark management command)
+# It seeds a dataset, replays a workload over the real urls and reports for every endpoint:
+# the throughput (requests per second), the p50/p95/p99 latency in milliseconds and the average number of SQL queries.
+# The workload can be run in process (with the django test client, the SQL queries are counted)
+# or over HTTP against a running server (the SQL queries cannot be counted from outside).
+# The concurrency benchmark sends concurrent requests to the ASGI application and compares the sync DRF views
+# with their async versions while every SQL query is slowed down to simulate a remote database.
+
+ENDPOINTS = [
+    "list",
+    "detail",
+    "search",
+    "create",
+    "update",
+    "delete",
+    "token_auth",
+    "jwt_auth",
+]
+
+# endpoint -> (path of the sync DRF view, path of the async view)
+CONCURRENCY_ENDPOINTS = {
+    "list": ("/api/products/?offset={offset}", "/api/products/async/?offset={offset}"),
+    "detail": ("/api/products/{pk}/", "/api/products/async/{pk}/"),
+    "search": ("/api/products/search/?query={word}", "/api/products/search/async/?query={word}"),
+}
+
+SEARCH_WORDS = ["laptop", "phone", "camera", "watch", "tablet", "speaker", "monitor", "keyboard"]
+
+
+def seed(products=1000, users=10, seed_value=0):
+    '''
+    Creates the superuser who runs the workload, the owners of the products and the products themselves
+    returns the superuser
+    '''
+    User = get_user_model()
+    rng = random.Random(seed_value)
+    admin = User.objects.create_superuser(
+        email="benchmark@example.com", username="benchmark", password="benchmark-password"
+    )
+    owners = [admin]
+    for i in range(users - 1):
+        owner = User(email=f"owner{i}@example.com", username=f"owner{i}", is_staff=True, is_active=True)
+        # hashing a password is slow on purpose, the owners never log in so they dont need one
+        owner.set_unusable_password()
+        owners.append(owner)
+    User.objects.bulk_create(owners[1:])
+    owners = list(User.objects.all())
+
+    batch = []
+    for i in range(products):
+        word = rng.choice(SEARCH_WORDS)
+        batch.append(
+            Product(
+                title=f"{word} {i}",
+                content=f"A {word} for the benchmark number {i}",
+                price=rng.randint(100, 100000) / 100,
+                public=rng.random() < 0.8,
+                user=rng.choice(owners),
+            )
+        )
+    Product.objects.bulk_create(batch, batch_size=1000)
+    # bulk_create does not keep the product counts of the owners
+    User.objects.reconcile_product_counts()
+    return admin
+
+
+# Sends the requests of the workload to the django test client, in the same process
+class InProcessTransport:
+    counts_queries = True
+
+    def __init__(self):
+        self.client = APIClient()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        with CaptureQueriesContext(connection) as ctx:
+            if data is None:
+                response = getattr(self.client, method)(path, **headers)
+            else:
+                response = getattr(self.client, method)(path, data, format="json", **headers)
+        return response.status_code, response_json(response), len(ctx.captured_queries)
+
+
+# Sends the requests of the workload to a running server
+class HttpTransport:
+    counts_queries = False
+
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.session.request(
+            method.upper(), self.base_url + path, json=data, headers=headers
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body, None
+
+
+def response_json(response):
+    try:
+        return response.json()
+    except (ValueError, TypeError):
+        return None
+
+
+class Workload:
+    '''
+    Replays the requests of every endpoint in a round robin, so that all of them see the same state of the db
+    '''
+
+    def __init__(self, transport, token, jwt, product_ids, seed_value=0):
+        self.transport = transport
+        self.token = token
+        self.jwt = jwt
+        self.product_ids = list(product_ids)
+        self.rng = random.Random(seed_value)
+        # the products created by the workload, they are the ones that are updated and deleted
+        self.created = []
+
+    def step(self, endpoint):
+        token = self.token
+        if endpoint == "list":
+            offset = self.rng.randrange(0, max(len(self.product_ids) - 10, 1))
+            return "get", f"/api/products/?offset={offset}", None, token
+        if endpoint == "detail":
+            return "get", f"/api/products/{self.rng.choice(self.product_ids)}/", None, token
+        if endpoint == "search":
+            return "get", f"/api/products/search/?query={self.rng.choice(SEARCH_WORDS)}", None, token
+        if endpoint == "create":
+            data = {"title": f"benchmark product {time.time_ns()}", "price": "9.99"}
+            return "post", "/api/products/", data, token
+        if endpoint == "update":
+            pk = self.created[-1] if self.created else self.rng.choice(self.product_ids)
+            data = {"title": f"updated product {time.time_ns()}", "content": "updated"}
+            return "put", f"/api/products/{pk}/update/", data, token
+        if endpoint == "delete":
+            if not self.created:
+                return None
+            return "delete", f"/api/products/{self.created.pop(0)}/delete/", None, token
+        if endpoint == "token_auth":
+            return "get", "/api/", None, token
+        if endpoint == "jwt_auth":
+            return "get", "/api/", None, self.jwt
+        raise ValueError(f"Unknown endpoint {endpoint}")
+
+    def run(self, endpoints=ENDPOINTS, iterations=100, warmup=5):
+        samples = {endpoint: {"latencies": [], "queries": [], "errors": 0} for endpoint in endpoints}
+        for iteration in range(warmup + iterations):
+            for endpoint in endpoints:
+                step = self.step(endpoint)
+                if step is None:
+                    continue
+                method, path, data, token = step
+                start = time.perf_counter()
+                status_code, body, queries = self.transport.request(method, path, data, token)
+                elapsed = time.perf_counter() - start
+                if endpoint == "create" and status_code == 201 and body:
+                    self.created.append(body["id"])
+                if iteration < warmup:
+                    continue
+                sample = samples[endpoint]
+                sample["latencies"].append(elapsed)
+                if queries is not None:
+                    sample["queries"].append(queries)
+                if status_code >= 400:
+                    sample["errors"] += 1
+        return {endpoint: summarize(sample) for endpoint, sample in samples.items()}
+
+
+def percentile(values, percent):
+    '''
+    Nearest rank percentile of an already sorted list
+    '''
+    if not values:
+        return None
+    index = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+def summarize(sample):
+    latencies = sorted(sample["latencies"])
+    total = sum(latencies)
+    queries = sample["queries"]
+    return {
+        "requests": len(latencies),
+        "errors": sample["errors"],
+        "throughput": len(latencies) / total if total else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "queries": sum(queries) / len(queries) if queries else None,
+    }
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def get_metadata(**options):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "options": options,
+    }
+
+
+def run_in_process(products=1000, users=10, iterations=100, warmup=5, endpoints=ENDPOINTS, seed_value=0):
+    '''
+    Seeds the current database and runs the workload with the django test client
+    The caller must make sure that the current database is a throwaway one (refer: the benchmark command)
+    '''
+    for cache in caches.all():
+        cache.clear()
+    admin = seed(products=products, users=users, seed_value=seed_value)
+    token = Token.objects.create(user=admin).key
+    jwt = str(RefreshToken.for_user(admin).access_token)
+    product_ids = Product.objects.values_list("pk", flat=True)
+    workload = Workload(InProcessTransport(), token, jwt, product_ids, seed_value=seed_value)
+    return workload.run(endpoints=endpoints, iterations=iterations, warmup=warmup)
+
+
+def run_over_http(base_url, email, password, iterations=100, warmup=5, endpoints=ENDPOINTS, seed_value=0):
+    '''
+    Runs the workload against a running server, the products that already exist there are used
+    '''
+    transport = HttpTransport(base_url)
+    status_code, body, _ = transport.request("post", "/api/auth/", {"username": email, "password": password})
+    if status_code != 200:
+        raise ValueError(f"Could not obtain a token: {body}")
+    token = body["token"]
+    status_code, body, _ = transport.request("post", "/api/auth/token/", {"email": email, "password": password})
+    if status_code != 200:
+        raise ValueError(f"Could not obtain a JWT: {body}")
+    jwt = body["access"]
+
+    product_ids = []
+    path = "/api/products/?limit=100"
+    while path and len(product_ids) < 1000:
+        status_code, body, _ = transport.request("get", path, token=token)
+        if status_code != 200:
+            raise ValueError(f"Could not list the products: {body}")
+        product_ids += [row["id"] for row in body["results"]]
+        path = None
+        if body["next"]:
+            # the next link is absolute, only its path and query string are sent to the transport
+            next_url = urlsplit(body["next"])
+            path = f"{next_url.path}?{next_url.query}"
+    if not product_ids:
+        raise ValueError("The server has no products to benchmark")
+    workload = Workload(transport, token, jwt, product_ids, seed_value=seed_value)
+    return workload.run(endpoints=endpoints, iterations=iterations, warmup=warmup)
+
+
+@contextmanager
+def slow_database(delay):
+    '''
+    Adds delay seconds to every SQL query, like the round trip to a database on another machine
+    The sleep happens in the thread that runs the query, so it blocks that thread like a real network wait
+    '''
+    wrapped = []
+
+    def slow_execute(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(slow_execute)
+        wrapped.append(connection)
+
+    # the requests run their queries in other threads, every thread opens its own connection
+    connection_created.connect(install, weak=False, dispatch_uid="benchmark-slow-database")
+    if connection.connection is not None:
+        install(None, connection)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(dispatch_uid="benchmark-slow-database")
+        for conn in wrapped:
+            if slow_execute in conn.execute_wrappers:
+                conn.execute_wrappers.remove(slow_execute)
+
+
+async def asgi_get(app, path, headers):
+    '''
+    Sends a GET request to the ASGI application like an ASGI server would and returns the status code
+    '''
+    url = urlsplit(path)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"testserver")]
+        + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 0),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    disconnected = asyncio.Event()
+    response = {}
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # the client never disconnects, django cancels this wait when the response is sent
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return response.get("status", 500)
+
+
+async def run_concurrent(app, paths, headers, concurrency):
+    '''
+    Sends all the paths with at most concurrency requests in flight
+    the throughput is the number of requests divided by the wall clock time of the whole run
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(path):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            status_code = await asgi_get(app, path, headers)
+            latencies.append(time.perf_counter() - start)
+            if status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(path) for path in paths))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "queries": None,
+    }
+
+
+def run_concurrency(
+    products=1000,
+    users=10,
+    requests=200,
+    concurrency=(1, 10, 50),
+    db_delay=0.005,
+    endpoints=tuple(CONCURRENCY_ENDPOINTS),
+    seed_value=0,
+):
+    '''
+    Seeds the current database and sends concurrent requests to the sync and async versions of the endpoints
+    through the ASGI application, with db_delay seconds added to every SQL query
+    returns the metrics by "<endpoint>_<sync|async>_c<concurrency>"
+    The caller must make sure that the current database is a throwaway one (refer: the benchmark command)
+    '''
+    for cache in caches.all():
+        cache.clear()
+    admin = seed(products=products, users=users, seed_value=seed_value)
+    headers = {"Authorization": f"Bearer {Token.objects.create(user=admin).key}"}
+    product_ids = list(Product.objects.values_list("pk", flat=True))
+    rng = random.Random(seed_value)
+    app = get_asgi_application()
+
+    results = {}
+    # the response cache of the DRF views is turned off, otherwise the sync views would not touch the db at all
+    with override_settings(RESPONSE_CACHE_TIMEOUT=0), slow_database(db_delay):
+        for endpoint in endpoints:
+            for mode, template in zip(("sync", "async"), CONCURRENCY_ENDPOINTS[endpoint]):
+                paths = [
+                    template.format(
+                        offset=rng.randrange(0, max(len(product_ids) - 10, 1)),
+                        pk=rng.choice(product_ids),
+                        word=rng.choice(SEARCH_WORDS),
+                    )
+                    for _ in range(requests)
+                ]
+                for level in concurrency:
+                    results[f"{endpoint}_{mode}_c{level}"] = asyncio.run(
+                        run_concurrent(app, paths, headers, level)
+                    )
+    return results
+
+
+def run_serializers(products=1000, users=10, repeat=10, seed_value=0):
+    '''
+    Seeds the current database and renders all the products to json with the ProductSerializer
+    and with the CompiledProductSerializer, the rows are loaded once so only the serialization is measured
+    returns the metrics by "serializer_<drf|compiled>", the throughput is in rows per second
+    The caller must make sure that the current database is a throwaway one (refer: the benchmark command)
+    '''
+    seed(products=products, users=users, seed_value=seed_value)
+    request = Request(APIRequestFactory().get("/api/products/"))
+    qs = Product.objects.with_owner().order_by("pk")
+    instances = list(qs)
+    compiled = CompiledProductSerializer(request)
+    rows = list(compiled.get_rows(qs))
+    renderer = JSONRenderer()
+
+    def render_drf():
+        return renderer.render(ProductSerializer(instances, many=True, context={"request": request}).data)
+
+    def render_compiled():
+        # the url templates are built per request, so they are part of the measured time
+        return renderer.render(CompiledProductSerializer(request).to_representation(rows))
+
+    if render_drf() != render_compiled():
+        raise ValueError("The compiled serializer does not render the same json as the ProductSerializer")
+
+    results = {}
+    for name, render in (("drf", render_drf), ("compiled", render_compiled)):
+        results[f"serializer_{name}"] = measure(render, repeat, items=len(rows))
+    return results
+
+
+def measure(func, repeat, items=1):
+    '''
+    Calls func repeat times and returns the metrics of the calls, the throughput is in items per second
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "requests": repeat,
+        "errors": 0,
+        "throughput": items * repeat / sum(timings),
+        "p50_ms": ms(percentile(timings, 50)),
+        "p95_ms": ms(percentile(timings, 95)),
+        "p99_ms": ms(percentile(timings, 99)),
+        "queries": None,
+    }
+
+
+@contextmanager
+def use_renderers(path, renderer_classes):
+    '''
+    Makes the view of the given path use these renderer classes, the views read the renderers of the settings
+    only once when they are defined so the settings cannot be overridden
+    '''
+    view_class = resolve(path).func.cls
+    old = view_class.renderer_classes
+    view_class.renderer_classes = renderer_classes
+    try:
+        yield
+    finally:
+        view_class.renderer_classes = old
+
+
+def run_renderers(products=1000, users=10, repeat=10, limit=100, seed_value=0):
+    '''
+    Seeds the current database and compares the renderers of the api on a page of limit products:
+      * renderer_<name>: only the rendering of the data of the page, in rows per second
+      * list_<name>: the whole GET /api/products/?limit=... request with that renderer, in requests per second
+    json is the JSONRenderer of DRF, orjson the ORJSONRenderer and msgpack the MessagePackRenderer (only if msgpack is installed)
+    The caller must make sure that the current database is a throwaway one (refer: the benchmark command)
+    '''
+    admin = seed(products=products, users=users, seed_value=seed_value)
+    path = "/api/products/"
+    request = Request(APIRequestFactory().get(path))
+    compiled = CompiledProductSerializer(request)
+    rows = compiled.to_representation(compiled.get_rows(Product.objects.with_owner().order_by("pk")[:limit]))
+    data = {"count": products, "next": None, "previous": None, "results": rows}
+
+    candidates = {"json": JSONRenderer, "orjson": ORJSONRenderer}
+    if renderers.msgpack is not None:
+        candidates["msgpack"] = renderers.MessagePackRenderer
+    if ORJSONRenderer().render(data) != JSONRenderer().render(data):
+        raise ValueError("The ORJSONRenderer does not render the same json as the JSONRenderer")
+
+    results = {}
+    for name, renderer_class in candidates.items():
+        renderer = renderer_class()
+        results[f"renderer_{name}"] = measure(lambda: renderer.render(data), repeat, items=len(rows))
+
+    client = APIClient()
+    client.force_authenticate(admin)
+    url = f"{path}?limit={limit}"
+    # every request renders the page, the responses are not cached
+    with override_settings(RESPONSE_CACHE_TIMEOUT=0):
+        for name, renderer_class in candidates.items():
+
+            def get():
+                response = client.get(url, HTTP_ACCEPT=renderer_class.media_type)
+                if response.status_code != 200:
+                    raise ValueError(f"{url} returned {response.status_code} with the {name} renderer")
+
+            with use_renderers(path, [renderer_class]):
+                results[f"list_{name}"] = measure(get, repeat)
+    return results
+
+
+@contextmanager
+def profile_database(profile, directory):
+    '''
+    Adds a database alias that uses the given DATABASE_PROFILES entry on a new SQLite file in directory,
+    with the tables of the users and the products, and yields the alias
+    '''
+    alias = f"benchmark_{profile}"
+    config = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(directory, f"{alias}.sqlite3"),
+        **settings.DATABASE_PROFILES[profile],
+    }
+    # configure_settings() fills in the defaults of the missing keys, it needs a default database in the dict
+    connections.settings[alias] = connections.configure_settings(
+        {"default": connections.settings["default"], alias: config}
+    )[alias]
+    try:
+        with connections[alias].schema_editor() as editor:
+            editor.create_model(get_user_model())
+            editor.create_model(Product)
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def database_worker(alias, operations, write_ratio, product_ids, worker, samples, lock):
+    '''
+    Runs operations reads (a page of products) and writes (a read and an update in a transaction, or an insert)
+    every operation is handled like a request: the connection is closed before and after it if it is too old
+    (that is what django does on request_started and request_finished), so without CONN_MAX_AGE every operation reconnects
+    '''
+    rng = random.Random(worker)
+    db = connections[alias]
+    local = {"read": [], "write": [], "errors": 0}
+    for number in range(operations):
+        kind = "write" if rng.random() < write_ratio else "read"
+        start = time.perf_counter()
+        db.close_if_unusable_or_obsolete()
+        try:
+            if kind == "read":
+                offset = rng.randrange(0, max(len(product_ids) - 10, 1))
+                list(Product.objects.using(alias).order_by("-id").values("id", "title", "price")[offset : offset + 10])
+            elif number % 2:
+                with transaction.atomic(using=alias):
+                    pk = rng.choice(product_ids)
+                    price = Product.objects.using(alias).filter(pk=pk).values_list("price", flat=True).first()
+                    Product.objects.using(alias).filter(pk=pk).update(price=(price or 0) + 1)
+            else:
+                Product.objects.using(alias).create(
+                    title=f"worker {worker} product {number}", content="benchmark", price="1.00", user_id=1
+                )
+        except OperationalError:
+            # "database is locked" after waiting for the busy timeout
+            local["errors"] += 1
+        db.close_if_unusable_or_obsolete()
+        local[kind].append(time.perf_counter() - start)
+    db.close()
+    with lock:
+        samples["read"] += local["read"]
+        samples["write"] += local["write"]
+        samples["errors"] += local["errors"]
+
+
+def run_database(
+    profiles=("development", "production"),
+    workers=8,
+    operations=200,
+    write_ratio=0.2,
+    products=1000,
+    seed_value=0,
+):
+    '''
+    Runs workers threads of concurrent reads and writes on a new SQLite file with every database profile
+    returns the metrics by "<profile>_<read|write>", the throughput is the operations of that kind per second of wall clock
+    and the errors are the operations of both kinds that failed with "database is locked"
+    '''
+    results = {}
+    for profile in profiles:
+        with tempfile.TemporaryDirectory() as directory, profile_database(profile, directory) as alias:
+            rng = random.Random(seed_value)
+            User = get_user_model()
+            owner = User(email="owner@example.com", username="owner")
+            owner.set_unusable_password()
+            User.objects.using(alias).bulk_create([owner])
+            Product.objects.using(alias).bulk_create(
+                [
+                    Product(title=f"product {i}", content="benchmark", price=rng.randint(100, 10000) / 100, user_id=1)
+                    for i in range(products)
+                ],
+                batch_size=1000,
+            )
+            product_ids = list(Product.objects.using(alias).values_list("pk", flat=True))
+            connections[alias].close()
+
+            samples = {"read": [], "write": [], "errors": 0}
+            lock = threading.Lock()
+            threads = [
+                threading.Thread(
+                    target=database_worker,
+                    args=(alias, operations, write_ratio, product_ids, worker, samples, lock),
+                )
+                for worker in range(workers)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            for kind in ("read", "write"):
+                latencies = sorted(samples[kind])
+                results[f"{profile}_{kind}"] = {
+                    "requests": len(latencies),
+                    "errors": samples["errors"],
+                    "throughput": len(latencies) / elapsed if elapsed else None,
+                    "p50_ms": ms(percentile(latencies, 50)),
+                    "p95_ms": ms(percentile(latencies, 95)),
+                    "p99_ms": ms(percentile(latencies, 99)),
+                    "queries": None,
+                }
+    return results
+
+
+def compare(previous, current):
+    '''
+    Returns the relative change of the metrics of every endpoint between two saved results
+    positive numbers mean that the metric went up
+    '''
+    changes = {}
+    for endpoint, metrics in current["endpoints"].items():
+        old = previous.get("endpoints", {}).get(endpoint)
+        if not old:
+            continue
+        changes[endpoint] = {}
+        for name in ("throughput", "p50_ms", "p95_ms", "p99_ms", "queries"):
+            if old.get(name) and metrics.get(name) is not None:
+                changes[endpoint][name] = round((metrics[name] - old[name]) / old[name] * 100, 1)
+    return changes
+
+
+def save(results, path):
+    with open(path, "w") as output:
+        json.dump(results, output, indent=2)
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
@@ -0,0 +1,224 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from cfehome.db_routers import get_pinning_seconds, get_replicas
+
+
+# The caches below use version numbers stored in the cache to invalidate a whole group of entries at once:
+# the version is a part of the keys of the entries, so bumping it makes all of them unreachable.
+# A version starts from the current time so that if its key is evicted from the cache
+# we never go back to a version that was already used before
+def get_version(cache, key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+# The local memory and dummy caches keep nothing that the other processes can see,
+# the state that every process must agree on (versions, pins) needs one of the other backends
+PER_PROCESS_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_shared_cache(alias):
+    return settings.CACHES.get(alias, {}).get("BACKEND") not in PER_PROCESS_BACKENDS
+
+
+# This is a cache for the responses of the read endpoints
+# Every user sees a different set of products (refer: UserQuerySetMixin) so the responses are cached per "scope":
+#   * "all"       -> superusers and the views that show the same data to everyone
+#   * "user:<id>" -> a normal user who only sees the products he owns
+#   * "anon"      -> an anonymous user
+# Every scope has a version number that is a part of the cache key, bumping the version of a scope
+# makes all the cached responses of that scope unreachable (they will just expire from the cache by themselves)
+class ResponseCache:
+    key_prefix = "response-cache"
+
+    def __init__(self, alias=None, timeout=None):
+        self._alias = alias
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def alias(self):
+        return self._alias or getattr(settings, "RESPONSE_CACHE_ALIAS", "default")
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def is_shared(self):
+        return is_shared_cache(self.alias)
+
+    @property
+    def timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return getattr(settings, "RESPONSE_CACHE_TIMEOUT", 300)
+
+    # Returns the scope of the user who hit the request
+    def get_scope(self, user, user_scoped=True):
+        if not user_scoped or user.is_superuser:
+            return "all"
+        if not user.is_authenticated:
+            return "anon"
+        return f"user:{user.pk}"
+
+    def _version_key(self, scope):
+        return f"{self.key_prefix}:version:{scope}"
+
+    def get_version(self, scope):
+        return get_version(self.cache, self._version_key(scope))
+
+    def get_key(self, request, scope):
+        location = f"{request.get_host()}{request.get_full_path()}"
+        digest = hashlib.md5(location.encode()).hexdigest()
+        return f"{self.key_prefix}:{scope}:{self.get_version(scope)}:{digest}"
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self._count("hits" if data is not None else "misses")
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, self.timeout)
+
+    # Makes all the cached responses of the given scopes stale
+    def invalidate(self, *scopes):
+        self._bump(scopes)
+        # a read that ran before the write was committed could have cached the old data under the new versions,
+        # so they are bumped once again after the commit (right away when there is no transaction)
+        transaction.on_commit(lambda: self._bump(scopes))
+        self._count("invalidations", len(scopes))
+
+    def _bump(self, scopes):
+        for scope in scopes:
+            bump_version(self.cache, self._version_key(scope))
+        if get_replicas():
+            # the replicas may not have the write yet, see was_recently_invalidated()
+            self.cache.set_many({self._recent_key(scope): True for scope in scopes}, get_pinning_seconds())
+        self._touch()
+
+    def _recent_key(self, scope):
+        return f"{self.key_prefix}:recent:{scope}"
+
+    def was_recently_invalidated(self, scope):
+        '''
+        Returns True if the scope was invalidated less than REPLICA_PINNING_SECONDS ago. A replica can be behind
+        the primary for that long, a response read from it could put the data from before the write back in the cache.
+        '''
+        return bool(get_replicas()) and bool(self.cache.get(self._recent_key(scope)))
+
+    # The time of the last write (in whole seconds) is kept next to the versions, it is the Last-Modified
+    # of the responses (refer: api/mixins.ConditionalGetMixin). It moves forward by at least one second on every
+    # write, so a write in the same second as the copy of a client still changes it.
+    def _touch(self):
+        key = f"{self.key_prefix}:modified"
+        previous = self.cache.get(key) or 0
+        self.cache.set(key, max(int(time.time()) + 1, previous + 1), None)
+
+    def get_last_modified(self):
+        '''
+        Returns the time of the last write as a timestamp, the first use is the start if there is none in the cache
+        '''
+        key = f"{self.key_prefix}:modified"
+        modified = self.cache.get(key)
+        if modified is None:
+            self.cache.add(key, int(time.time()) + 1, None)
+            modified = self.cache.get(key)
+        return modified
+
+    # Invalidates every scope that can see the products of the given owners
+    def invalidate_owners(self, *user_ids):
+        scopes = ["all", "anon"]
+        scopes += [f"user:{user_id}" for user_id in set(user_ids) if user_id is not None]
+        self.invalidate(*scopes)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+# This is a small in process LRU (least recently used) cache with an optional time to live for its entries
+# When the cache is full the entry that was used the longest time ago is removed to make room for the new one
+class LRUCache:
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                # the entry has expired
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._data))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
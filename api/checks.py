@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+from cfehome.db_routers import get_replicas
+from .cache import is_shared_cache
+
+
+# These are the system checks of the settings that the api relies on, they run with every management command
+# (runserver, migrate, check --deploy ...) and a failed one stops it from starting
+
+
+@register()
+def check_replica_caches(app_configs, **kwargs):
+    '''
+    The read replicas rely on a cache that every process sees: the pins of the users who just wrote
+    (refer: cfehome/db_routers.py) and the scopes of the response cache that were just invalidated (refer: api/mixins.py).
+    In a cache of a single process the other processes never see them and serve the data of a replica that is behind.
+    '''
+    if not get_replicas():
+        return []
+    errors = []
+    for setting, default, error_id in (
+        ("REPLICA_PINNING_CACHE_ALIAS", "default", "api.E001"),
+        ("RESPONSE_CACHE_ALIAS", "default", "api.E002"),
+    ):
+        alias = getattr(settings, setting, default)
+        if not is_shared_cache(alias):
+            errors.append(
+                Error(
+                    f"The cache {alias!r} of {setting} is not shared between the processes.",
+                    hint="Point it to a shared cache backend (redis, memcached, database, DJANGO_CACHE_DIR locally) "
+                    "or remove the DATABASE_REPLICAS.",
+                    id=error_id,
+                )
+            )
+    return errors
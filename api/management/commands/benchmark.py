@@ -0,0 +1,171 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api import benchmark
+
+
+# This command runs the benchmark suite of the api (refer: api/benchmark.py)
+# In process (default): a throwaway database is created like the test runner does, so the real db is never touched
+#   python manage.py benchmark --products 10000 --iterations 200 --output results.json
+# Over HTTP: the workload is sent to a running server with the credentials of a superuser
+#   python manage.py benchmark --url http://localhost:8000 --email admin@example.com --password ...
+# Concurrency: the sync DRF views and their async versions under ASGI, with every SQL query slowed down by --db-delay seconds
+#   python manage.py benchmark --asgi --concurrency 1 10 50 --db-delay 0.005 --requests 200
+# Serializers: the rows per second rendered by the ProductSerializer and by the CompiledProductSerializer
+#   python manage.py benchmark --serializers --products 10000
+# Renderers: the JSON renderer of DRF, the orjson renderer and MessagePack (if installed) on a page of the product list
+#   python manage.py benchmark --renderers --limit 100 --repeat 50
+# Database profiles: concurrent readers and writers on a new SQLite file with each profile of DATABASE_PROFILES
+#   python manage.py benchmark --database-profiles development production --workers 8 --operations 200
+# Compare the results with the ones saved by a previous commit:
+#   python manage.py benchmark --output new.json --compare old.json
+class Command(BaseCommand):
+    help = "Benchmarks the api endpoints and reports throughput, latency percentiles and SQL query counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--iterations", type=int, default=100)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--endpoints",
+            nargs="+",
+            choices=benchmark.ENDPOINTS,
+            default=benchmark.ENDPOINTS,
+        )
+        parser.add_argument(
+            "--asgi",
+            action="store_true",
+            help="Compare the sync and async views with concurrent requests through the ASGI application",
+        )
+        parser.add_argument(
+            "--serializers",
+            action="store_true",
+            help="Compare the rows per second of the ProductSerializer and the CompiledProductSerializer",
+        )
+        parser.add_argument(
+            "--renderers",
+            action="store_true",
+            help="Compare the JSON, orjson and MessagePack renderers on the product list",
+        )
+        parser.add_argument("--repeat", type=int, default=10, help="Renders of every serializer or renderer")
+        parser.add_argument("--limit", type=int, default=100, help="Products in the page of the renderers")
+        parser.add_argument(
+            "--database-profiles",
+            nargs="+",
+            choices=list(settings.DATABASE_PROFILES),
+            help="Compare the read/write throughput of these database profiles (refer: settings.DATABASE_PROFILES)",
+        )
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--operations", type=int, default=200, help="Operations per worker")
+        parser.add_argument("--write-ratio", type=float, default=0.2)
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+        parser.add_argument("--db-delay", type=float, default=0.005, help="Seconds added to every SQL query")
+        parser.add_argument("--url", help="Benchmark a running server instead of running in process")
+        parser.add_argument("--email")
+        parser.add_argument("--password")
+        parser.add_argument("--output", help="Save the results as json into this file")
+        parser.add_argument("--compare", help="A json file saved by an earlier run to compare with")
+
+    def handle(self, *args, **options):
+        run_options = {
+            "iterations": options["iterations"],
+            "warmup": options["warmup"],
+            "endpoints": options["endpoints"],
+            "seed_value": options["seed"],
+        }
+        if options["url"]:
+            if not options["email"] or not options["password"]:
+                raise CommandError("--email and --password are needed to benchmark a server")
+            try:
+                endpoints = benchmark.run_over_http(
+                    options["url"], options["email"], options["password"], **run_options
+                )
+            except ValueError as error:
+                raise CommandError(str(error))
+            mode = "http"
+        elif options["database_profiles"]:
+            run_options = {
+                "profiles": options["database_profiles"],
+                "workers": options["workers"],
+                "operations": options["operations"],
+                "write_ratio": options["write_ratio"],
+                "seed_value": options["seed"],
+            }
+            # every profile gets its own new database file, the configured databases are not touched
+            endpoints = benchmark.run_database(products=options["products"], **run_options)
+            mode = "database"
+        elif options["serializers"]:
+            run_options = {"repeat": options["repeat"], "seed_value": options["seed"]}
+            endpoints = self.run_in_test_db(benchmark.run_serializers, options, run_options)
+            mode = "serializers"
+        elif options["renderers"]:
+            run_options = {"repeat": options["repeat"], "limit": options["limit"], "seed_value": options["seed"]}
+            endpoints = self.run_in_test_db(benchmark.run_renderers, options, run_options)
+            mode = "renderers"
+        elif options["asgi"]:
+            run_options = {
+                "requests": options["requests"],
+                "concurrency": options["concurrency"],
+                "db_delay": options["db_delay"],
+                "seed_value": options["seed"],
+            }
+            endpoints = self.run_in_test_db(benchmark.run_concurrency, options, run_options)
+            mode = "asgi"
+        else:
+            endpoints = self.run_in_test_db(benchmark.run_in_process, options, run_options)
+            mode = "in-process"
+
+        results = {
+            "meta": benchmark.get_metadata(
+                mode=mode,
+                products=options["products"],
+                users=options["users"],
+                url=options["url"],
+                **run_options,
+            ),
+            "endpoints": endpoints,
+        }
+        self.print_results(endpoints)
+        if options["output"]:
+            benchmark.save(results, options["output"])
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
+        if options["compare"]:
+            changes = benchmark.compare(benchmark.load(options["compare"]), results)
+            self.stdout.write("Change from %s (%%):" % options["compare"])
+            self.stdout.write(json.dumps(changes, indent=2))
+
+    def run_in_test_db(self, run, options, run_options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            return run(
+                products=options["products"], users=options["users"], **run_options
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def print_results(self, endpoints):
+        header = f"{'endpoint':<20}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'errors':>8}"
+        self.stdout.write(header)
+        for endpoint, metrics in endpoints.items():
+            self.stdout.write(
+                f"{endpoint:<20}"
+                f"{format_number(metrics['throughput']):>10}"
+                f"{format_number(metrics['p50_ms']):>10}"
+                f"{format_number(metrics['p95_ms']):>10}"
+                f"{format_number(metrics['p99_ms']):>10}"
+                f"{format_number(metrics['queries']):>9}"
+                f"{metrics['errors']:>8}"
+            )
+
+
+def format_number(value):
+    return "-" if value is None else f"{value:.1f}"
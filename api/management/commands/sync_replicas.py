@@ -0,0 +1,32 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+# This command copies the primary SQLite database into its read replicas (refer: DATABASE_REPLICAS in the settings)
+# It stands in for the replication of a real database server when the replicas are tried locally,
+# the replicas are behind the primary until the next sync:
+#   DJANGO_DATABASE_REPLICAS=replica.sqlite3 python manage.py sync_replicas
+class Command(BaseCommand):
+    help = "Copies the default SQLite database into the read replicas"
+
+    def handle(self, *args, **options):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if not replicas:
+            raise CommandError("No replicas are configured, set DJANGO_DATABASE_REPLICAS")
+        primary = connections["default"]
+        if primary.vendor != "sqlite":
+            raise CommandError("Only SQLite databases can be copied, use the replication of your database server")
+        primary.ensure_connection()
+        for alias in replicas:
+            # the open connections of the replica would keep reading the old copy
+            connections[alias].close()
+            target = sqlite3.connect(connections[alias].settings_dict["NAME"])
+            try:
+                # the backup api copies a consistent snapshot even while the primary is being written
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f"Copied the default database into {alias}"))
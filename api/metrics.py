@@ -0,0 +1,112 @@
+import threading
+from collections import defaultdict
+
+# This module keeps the request metrics of this process (refer: api/middleware.py)
+# and renders them in the Prometheus text format (refer: https://prometheus.io/docs/instrumenting/exposition_formats/)
+
+# The upper bounds (in seconds) of the buckets of the latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.requests = defaultdict(int)  # (method, status) -> count
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewMetrics)
+
+    def observe(self, view, method, status, seconds, sql_queries, sql_seconds):
+        with self._lock:
+            metrics = self._views[view]
+            metrics.requests[(method, status)] += 1
+            metrics.latency_count += 1
+            metrics.latency_sum += seconds
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    metrics.bucket_counts[index] += 1
+                    break
+            metrics.sql_queries += sql_queries
+            metrics.sql_seconds += sql_seconds
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: {
+                    "requests": dict(metrics.requests),
+                    "bucket_counts": list(metrics.bucket_counts),
+                    "latency_count": metrics.latency_count,
+                    "latency_sum": metrics.latency_sum,
+                    "sql_queries": metrics.sql_queries,
+                    "sql_seconds": metrics.sql_seconds,
+                }
+                for view, metrics in self._views.items()
+            }
+
+    def render(self, extra_counters=None):
+        '''
+        Returns all the metrics in the Prometheus text format
+        extra_counters is a dict of name -> (help, value) of other counters to expose
+        '''
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP http_requests_total Number of requests by view, method and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for view, metrics in sorted(snapshot.items()):
+            for (method, status), count in sorted(metrics["requests"].items()):
+                lines.append(
+                    f'http_requests_total{{view="{escape(view)}",method="{method}",status="{status}"}} {count}'
+                )
+
+        lines += [
+            "# HELP http_request_duration_seconds Latency of the requests by view.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for view, metrics in sorted(snapshot.items()):
+            label = f'view="{escape(view)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics["bucket_counts"]):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(
+                f'http_request_duration_seconds_bucket{{{label},le="+Inf"}} {metrics["latency_count"]}'
+            )
+            lines.append(f'http_request_duration_seconds_sum{{{label}}} {metrics["latency_sum"]}')
+            lines.append(f'http_request_duration_seconds_count{{{label}}} {metrics["latency_count"]}')
+
+        lines += [
+            "# HELP http_request_sql_queries_total Number of SQL queries run by the requests of a view.",
+            "# TYPE http_request_sql_queries_total counter",
+        ]
+        for view, metrics in sorted(snapshot.items()):
+            lines.append(f'http_request_sql_queries_total{{view="{escape(view)}"}} {metrics["sql_queries"]}')
+
+        lines += [
+            "# HELP http_request_sql_seconds_total Time spent in SQL queries by the requests of a view.",
+            "# TYPE http_request_sql_seconds_total counter",
+        ]
+        for view, metrics in sorted(snapshot.items()):
+            lines.append(f'http_request_sql_seconds_total{{view="{escape(view)}"}} {metrics["sql_seconds"]}')
+
+        for name, (help_text, value) in sorted((extra_counters or {}).items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
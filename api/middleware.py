@@ -0,0 +1,147 @@
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from cfehome.db_routers import RoutingState, current_routing_state
+
+from .metrics import registry
+
+# The QueryRecorder of the request that is being handled, a context variable is used instead of a thread local
+# because under ASGI the queries of an async view run in other threads (sync_to_async copies the context to them)
+current_recorder = ContextVar("current_recorder", default=None)
+
+
+# This middleware records the number of requests, the latency and the SQL queries of every view (refer: api/metrics.py)
+# The queries are counted with a database execute wrapper, so it works without DEBUG = True
+# and costs only a couple of function calls per query.
+# Place it at the top of the MIDDLEWARE list so that the time of the other middlewares is also measured
+# It works for both WSGI and ASGI, so it does not force the async views to run in a thread
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, "METRICS_ENABLED", True):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.observe(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.observe(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    def observe(self, request, response, elapsed, recorder):
+        registry.observe(
+            get_view_name(request),
+            request.method,
+            response.status_code,
+            elapsed,
+            recorder.queries,
+            recorder.seconds,
+        )
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# This execute wrapper is installed once on every db connection, it adds the query to the recorder of the current request
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.seconds += time.perf_counter() - start
+        recorder.queries += 1
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# This middleware keeps the state of the database router for the request (refer: cfehome/db_routers.py)
+# It decides whether the reads of the request may go to the replicas, and after a request that wrote to the primary
+# it pins the user to the primary for a while so that his next requests see his own writes.
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.get_state(request)
+        token = current_routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing_state.reset(token)
+        if state.wrote:
+            state.pin_user()
+        return response
+
+    async def __acall__(self, request):
+        state = self.get_state(request)
+        token = current_routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing_state.reset(token)
+        if state.wrote:
+            state.pin_user()
+        return response
+
+    def get_state(self, request):
+        use_replicas = request.method in self.safe_methods and request.path.startswith(
+            tuple(getattr(settings, "REPLICA_READ_PATHS", ()))
+        )
+        return RoutingState(request, use_replicas)
+
+
+# The name of the url that handled the request like product-list, the route is used for the urls without a name
+def get_view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name if match.url_name else match.route
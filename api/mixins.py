@@ -1,4 +1,14 @@
-from rest_framework import permissions
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from cfehome.db_routers import use_primary
+from .cache import response_cache
 from .permissions import IsStaffEditorPermission
 
 
@@ -30,3 +40,173 @@ class UserQuerySetMixin:
         if user.is_superuser:
             return qs
         return qs.filter(user=user)
+
+
+# This is a custom mixin that answers the conditional GET requests of the list and retrieve actions
+# The ETag and Last-Modified headers are computed without any query: every product or owner write bumps the version
+# of the "all" scope of the response cache and moves its last modified time forward (refer: api/cache.ResponseCache),
+# so the ETag is built from that version, the user, the path and the renderer. A client that sends
+# If-None-Match/If-Modified-Since with the values of its copy gets a 304 without the rows being loaded or serialized,
+# and a page of the keyset pagination still costs a single query.
+# The versions must live in a cache shared by all the processes (RESPONSE_CACHE_ALIAS), otherwise a process
+# would not see the writes made by the others (web workers, run_jobs, management commands) and would answer 304
+# for a stale copy forever. So with a cache of a single process (like the default LocMemCache) no validators are sent.
+# place this mixin before the CachedResponseMixin so that a 304 does not even look at the cached response.
+class ConditionalGetMixin:
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, require_row=True, **kwargs)
+
+    def get_validators(self):
+        '''
+        Returns the ETag and the Last-Modified (a timestamp) of the response
+        '''
+        user = self.request.user
+        fingerprint = "|".join(
+            str(part)
+            for part in (
+                response_cache.get_version("all"),
+                user.pk if user.is_authenticated else "anon",
+                self.request.get_full_path(),
+                # the same url is rendered as json or as the browsable api
+                getattr(self.request, "accepted_media_type", ""),
+            )
+        )
+        etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+        return etag, response_cache.get_last_modified()
+
+    def get_conditional_response(self, handler, request, *args, require_row=False, **kwargs):
+        if not response_cache.is_shared:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        # If-None-Match: * only matches a row that exists, a missing one is left to the 404 of the view
+        if response is not None and require_row and request.headers.get("If-None-Match", "").strip() == "*":
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            lookup = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            if not self.filter_queryset(self.get_queryset()).filter(**lookup).exists():
+                response = None
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+# This is a custom mixin that caches the responses of the list and retrieve actions of a view (refer: api/cache.py)
+# The cache lookup happens after the authentication and permission checks, so a user can only ever get
+# a response that was built for the same scope as him.
+# Set cache_user_scoped = False on the views which show the same data to every user
+class CachedResponseMixin:
+    cache_user_scoped = True
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        scope = response_cache.get_scope(request.user, user_scoped=self.cache_user_scoped)
+        key = response_cache.get_key(request, scope)
+        data = response_cache.get(key)
+        if data is not None:
+            return Response(data, headers={"X-Cache": "HIT"})
+        # Right after a write the replicas may still have the old data, caching it would serve it to every user
+        # of the scope until the next write, so the response that fills the cache is read from the primary
+        if response_cache.timeout and response_cache.was_recently_invalidated(scope):
+            use_primary()
+        response = handler(request, *args, **kwargs)
+        # Only the successful responses are cached, errors are always computed again
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.set(key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+# This function reads the sparse fieldset the client asked for => ?fields=id,title,price or ?omit=content,owner
+# available is the list of the fields of the serializer, the selected fields are returned in the same order as them
+# or None if the client did not ask for a fieldset. The unknown field names are a 400 error.
+def get_selected_fields(query_params, available, fields_param="fields", omit_param="omit"):
+    requested = split_fields(query_params.get(fields_param))
+    omitted = split_fields(query_params.get(omit_param))
+    if not requested and not omitted:
+        return None
+    errors = {}
+    for param, names in ((fields_param, requested), (omit_param, omitted)):
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[param] = [f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(available)}."]
+    if errors:
+        raise ValidationError(errors)
+    selected = tuple(
+        name for name in available if (not requested or name in requested) and name not in omitted
+    )
+    if not selected:
+        raise ValidationError({fields_param: ["Select at least one field."]})
+    return selected
+
+
+def split_fields(value):
+    if not value:
+        return []
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+# This is a custom mixin that lets the clients of the GET requests choose the fields of the response
+# => ?fields=id,title,price or ?omit=content,owner (refer: get_selected_fields)
+# The fields are not only dropped from the output, the work behind them is skipped too: the serializer_class must have
+# a select_queryset(queryset, fields) classmethod that loads only the columns (and joins) the fields need,
+# and a fields argument that removes the other fields (refer: products/serializers.ProductSerializer).
+# The queryset of the view is given to select_queryset, so it must not already join what the fields may skip.
+# The writes always use all the fields, the fieldset only changes what a GET request returns.
+class SparseFieldsMixin:
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+
+    def get_selected_fields(self):
+        if not hasattr(self, "_selected_fields"):
+            self._selected_fields = None
+            if self.request.method in permissions.SAFE_METHODS:
+                self._selected_fields = get_selected_fields(
+                    self.request.query_params,
+                    self.get_serializer_class().Meta.fields,
+                    fields_param=self.fields_query_param,
+                    omit_param=self.omit_query_param,
+                )
+        return self._selected_fields
+
+    def get_queryset(self, *args, **kwargs):
+        qs = super().get_queryset(*args, **kwargs)
+        return self.get_serializer_class().select_queryset(qs, self.get_selected_fields())
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_selected_fields()
+        if fields is not None:
+            kwargs["fields"] = fields
+        return super().get_serializer(*args, **kwargs)
+
+
+# This is a custom mixin that renders the list action with the compiled serializer of the view
+# (refer: products/serializers.CompiledProductSerializer) instead of the serializer_class,
+# the queryset is paginated as values() rows so no model instance is created for the rows of the page.
+# The compiled serializers can be turned off with COMPILED_SERIALIZERS = False in the settings.
+# With the SparseFieldsMixin the compiled serializer gets the fieldset of the request too.
+# Place it after the CachedResponseMixin so that the cached responses are still used.
+class CompiledListMixin:
+    compiled_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.compiled_serializer_class is None or not getattr(settings, "COMPILED_SERIALIZERS", True):
+            return super().list(request, *args, **kwargs)
+        # the compiled serializer renders the same fieldset as the serializer_class
+        fields = self.get_selected_fields() if isinstance(self, SparseFieldsMixin) else None
+        serializer = self.compiled_serializer_class(request, fields=fields)
+        rows = serializer.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(rows))
@@ -0,0 +1,204 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# This is a keyset (also called seek or cursor) pagination
+# Unlike the LimitOffsetPagination it does not run a COUNT(*) query and it does not use OFFSET to skip rows,
+# instead it remembers the (ordering value, id) of the last row shown and asks the db for the rows that come after it
+# like => WHERE price > 10 OR (price = 10 AND id > 42) ORDER BY price, id LIMIT 11
+# so with an index on (price, id) every page costs the same no matter how deep the client has paged.
+class KeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    limit_query_param = "limit"
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    # The fields the client is allowed to order by, the id is always appended as the tie breaker
+    # Every field listed here must have an index together with the id (refer: Product.Meta.indexes)
+    ordering_fields = ("id", "price", "title")
+    ordering = "-id"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            self.current_ordering = self.get_ordering(request)
+            position, reverse = None, False
+        else:
+            self.current_ordering, position, reverse = cursor
+
+        field = self.current_ordering.lstrip("-")
+        if position is not None:
+            position = self.get_position(queryset, field, position)
+        descending = self.current_ordering.startswith("-")
+        # When going to the previous page we scan the rows in the opposite direction and flip them afterwards
+        scan_descending = descending != reverse
+        prefix = "-" if scan_descending else ""
+        order_by = [prefix + field] if field == "id" else [prefix + field, prefix + "id"]
+
+        queryset = queryset.order_by(*order_by)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(field, position, scan_descending))
+
+        # Fetch one extra row to know whether there is another page after this one
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.ordering)
+        if ordering.lstrip("-") not in self.ordering_fields:
+            return self.ordering
+        return ordering
+
+    def get_position(self, queryset, field, position):
+        '''
+        Converts the value of the cursor to the type of the ordering field, a cursor whose value does not fit it is invalid
+        '''
+        value, pk = position
+        model_field = queryset.model._meta.get_field(field)
+        try:
+            value = model_field.to_python(value)
+        except DjangoValidationError:
+            raise NotFound(self.invalid_cursor_message)
+        if value is None and not model_field.null:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    # Builds the WHERE condition that selects the rows coming after the given position
+    def get_position_filter(self, field, position, descending):
+        value, pk = position
+        operator = "lt" if descending else "gt"
+        if field == "id":
+            return Q(**{f"pk__{operator}": pk})
+        return Q(**{f"{field}__{operator}": value}) | Q(**{field: value, f"pk__{operator}": pk})
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    # The cursor is a base64 encoded json so that the clients treat it as an opaque value
+    def encode_cursor(self, row, reverse):
+        field = self.current_ordering.lstrip("-")
+        # the rows are model instances or the values() dicts of the compiled serializers (refer: api/mixins.CompiledListMixin)
+        if isinstance(row, dict):
+            value, pk = row[field], row["id"]
+        else:
+            value, pk = getattr(row, field), row.pk
+        if isinstance(value, Decimal):
+            value = str(value)
+        data = {"o": self.current_ordering, "v": value, "i": pk, "r": reverse}
+        cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.ordering_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            ordering = data["o"]
+            position = (data["v"], int(data["i"]))
+            reverse = bool(data["r"])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(ordering, str) or ordering.lstrip("-") not in self.ordering_fields:
+            raise NotFound(self.invalid_cursor_message)
+        # the value is one of the json scalars written by encode_cursor, its type is checked against the field later
+        # (refer: get_position)
+        if position[0] is not None and type(position[0]) not in (str, int, float):
+            raise NotFound(self.invalid_cursor_message)
+        return ordering, position, reverse
+
+
+# This pagination keeps the LimitOffsetPagination as the default so that the existing clients keep working
+# and switches to the KeysetPagination when the client asks for it with ?pagination=keyset (or sends a cursor)
+class SelectablePagination(BasePagination):
+    pagination_query_param = "pagination"
+    default_pagination_class = LimitOffsetPagination
+    keyset_pagination_class = KeysetPagination
+
+    def __init__(self):
+        self.paginator = self.default_pagination_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            request.query_params.get(self.pagination_query_param) == "keyset"
+            or self.keyset_pagination_class.cursor_query_param in request.query_params
+        ):
+            self.paginator = self.keyset_pagination_class()
+        return self.paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return self.paginator.get_schema_operation_parameters(view)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, "display_page_controls", False)
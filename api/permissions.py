@@ -1,5 +1,95 @@
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework import permissions
 
+from .cache import bump_version, get_version
+
+
+# This is a cache of the permissions of the users shared by all the requests
+# Without it user.has_perms() loads the user and group permissions of the user from the db on every new request.
+# The permissions of a user are stored under a key made of the user id, the version of that user and a global version:
+#   * the version of a user is bumped when his groups, his permissions or his flags (is_active, is_superuser) change
+#   * the global version is bumped when the permissions of a group change, since that affects all the users of the group
+# (refer: api/signals.py)
+class PermissionCache:
+    key_prefix = "perm-cache"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "PERMISSION_CACHE_ALIAS", "default")]
+
+    @property
+    def timeout(self):
+        return getattr(settings, "PERMISSION_CACHE_TIMEOUT", 3600)
+
+    def _user_version_key(self, user_id):
+        return f"{self.key_prefix}:version:user:{user_id}"
+
+    def _global_version_key(self):
+        return f"{self.key_prefix}:version:global"
+
+    def get_permissions(self, user):
+        key = "%s:%s:%s:%s" % (
+            self.key_prefix,
+            user.pk,
+            get_version(self.cache, self._user_version_key(user.pk)),
+            get_version(self.cache, self._global_version_key()),
+        )
+        perms = self.cache.get(key)
+        if perms is not None:
+            self._count("hits")
+            return perms
+        self._count("misses")
+        # get_all_permissions() goes through the authentication backends, so this is the same set that has_perms() checks
+        perms = frozenset(user.get_all_permissions())
+        self.cache.set(key, perms, self.timeout)
+        return perms
+
+    def has_perms(self, user, perm_list):
+        # An active superuser has all the permissions, django does not hit the db for them either
+        if user.is_active and user.is_superuser:
+            return True
+        if not user.is_active:
+            return False
+        return set(perm_list).issubset(self.get_permissions(user))
+
+    # The async version of has_perms, used by the async views
+    async def ahas_perms(self, user, perm_list):
+        if user.is_active and user.is_superuser:
+            return True
+        if not user.is_active:
+            return False
+        perms = await sync_to_async(self.get_permissions)(user)
+        return set(perm_list).issubset(perms)
+
+    def invalidate_user(self, *user_ids):
+        for user_id in user_ids:
+            bump_version(self.cache, self._user_version_key(user_id))
+
+    def invalidate_all(self):
+        bump_version(self.cache, self._global_version_key())
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+permission_cache = PermissionCache()
+
 
 # This is the code which can be used for setting custom permissions for both admin and staff users
 # such that we can restrict the access to certain requests based on the user type
@@ -44,6 +134,34 @@ class IsStaffEditorPermission(permissions.DjangoModelPermissions):
         'DELETE': ['%(app_label)s.delete_%(model_name)s'],
     }
 
+    # This is the has_permission of the DjangoModelPermissions, except that the permissions of the user
+    # are read from the permission_cache instead of calling request.user.has_perms()
+    def has_permission(self, request, view):
+        if not request.user or (
+            not request.user.is_authenticated and self.authenticated_users_only
+        ):
+            return False
+
+        # Workaround to ensure DjangoModelPermissions are not applied
+        # to the root view when using DefaultRouter.
+        if getattr(view, "_ignore_model_permissions", False):
+            return True
+
+        queryset = self._queryset(view)
+        perms = self.get_required_permissions(request.method, queryset.model)
+        if not request.user.is_authenticated:
+            return request.user.has_perms(perms)
+        return permission_cache.has_perms(request.user, perms)
+
     # Now the has_permission fn gives permission only to super users and not to staff users
     # def has_permission(self, request, view):
     #     return request.user.is_superuser
+
+
+# This is the async version of the StaffEditorPermissionMixin permissions (IsAdminUser + IsStaffEditorPermission)
+# used by the async views, the permissions are read from the same permission_cache
+async def ahas_staff_editor_permission(user, method, model):
+    if not (user and user.is_authenticated and user.is_staff):
+        return False
+    perms = IsStaffEditorPermission().get_required_permissions(method, model)
+    return await permission_cache.ahas_perms(user, perms)
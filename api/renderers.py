@@ -0,0 +1,84 @@
+import orjson
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+# msgpack is optional, the MessagePack renderer and parser are only added to the settings when it is installed
+# (refer: REST_FRAMEWORK in the settings) => pip install msgpack
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# This renderer returns the text of the metrics endpoint as it is (refer: api/metrics.py)
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = "text/plain"
+    format = "prometheus"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # the errors (like a 403) are dicts, they are written as comments
+        return "".join(f"# {key}: {value}\n" for key, value in data.items()).encode(self.charset)
+
+
+# This is the JSON renderer of the api, it writes the same bytes as the JSONRenderer of DRF but with orjson
+# which is several times faster than the json module of the standard library on the big list pages.
+# The values orjson does not know (Decimal, the lazy translated strings, ...) are converted by the encoder of DRF,
+# the datetimes are also given to it so that they keep the format of DRF ("...Z" instead of "...+00:00").
+# The urls of the serializers (Hyperlink) are str subclasses which orjson writes as plain strings.
+# The pretty printed responses (?format=json with indent, the browsable api) and anything orjson refuses
+# (like the integers bigger than 64 bits) are rendered by the JSONRenderer of DRF.
+class ORJSONRenderer(renderers.JSONRenderer):
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        # orjson always writes compact utf-8, the other styles are left to DRF
+        if indent is not None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encode_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # DRF escapes the line and paragraph separators so that the JSON is also valid javascript
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    return _encoder.default(obj)
+
+
+# This renderer writes the responses as MessagePack, a binary format that is smaller and faster to parse than JSON
+# The clients ask for it with Accept: application/msgpack (or ?format=msgpack)
+# The values that are not msgpack types are converted like in the JSON responses (refer: ORJSONRenderer)
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encode_default, use_bin_type=True, datetime=False)
+
+
+# This parser reads the request bodies sent as MessagePack => Content-Type: application/msgpack
+class MessagePackParser(parsers.BaseParser):
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
@@ -17,14 +17,24 @@ class UserPublicSerialzer(serializers.Serializer):
     # Defining the function to get the total_products data
     def get_total_products(self, obj):
         user = obj
-        user_products_count = user.product_set.count()
-        return user_products_count
+        # The count is stored on the user (refer: accounts.models.CustomUser.product_count)
+        # so the db is not hit once again for every user we serialize
+        return user.product_count
         # Now if you want to serialize the products data obtained then we do the thing written below
         # return UserProductInlineSerializer(
         #     user_products, many=True, context=self.context
         # ).data
 
 
+# This is the read only fast path of the UserPublicSerialzer used by the compiled serializers
+# (refer: products/serializers.CompiledProductSerializer), it returns the same data from the plain values of a row
+def user_public_data(user_id, username, total_products):
+    # A product without an owner is serialized as null, same as the nested serializer does
+    if user_id is None:
+        return None
+    return {"id": user_id, "username": username, "total_products": total_products}
+
+
 class UserProductInlineSerializer(serializers.Serializer):
     url = serializers.HyperlinkedIdentityField(
         view_name="product-detail", lookup_field="pk", read_only=True
@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_user_cache
+from .permissions import permission_cache
+
+User = get_user_model()
+
+
+# These are the signal receivers that remove the stale entries from the token_user_cache (refer: api/authentication.py)
+# and from the permission_cache (refer: api/permissions.py)
+
+
+# A deleted token must stop working right away, rotating a token also deletes the old one
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_user_cache.invalidate(instance.key)
+
+
+# If the user is changed (deactivated, made staff, ...) the cached copy of the user is stale
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # a login only updates the last_login of the user, which the authentication does not care about
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    keys = Token.objects.filter(user_id=instance.pk).values_list("key", flat=True)
+    token_user_cache.invalidate(*keys)
+    permission_cache.invalidate_user(instance.pk)
+
+
+# The groups or the permissions of a user have changed, this is sent for both the sides of the relation
+# user.groups.add(group) => instance is the user, group.user_set.add(user) => instance is the group and pk_set has the users
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        permission_cache.invalidate_user(instance.pk)
+    elif pk_set:
+        permission_cache.invalidate_user(*pk_set)
+    else:
+        # a group or a permission was removed from all of its users, we dont know which users they were
+        permission_cache.invalidate_all()
+
+
+# The permissions of a group affect all the users of that group so every entry of the cache is invalidated
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        permission_cache.invalidate_all()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    permission_cache.invalidate_all()
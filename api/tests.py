@@ -1,3 +1,416 @@
-from django.test import TestCase
+import datetime
+import os
+import tempfile
+import unittest
+import uuid
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.relations import Hyperlink
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from cfehome.db_routers import PrimaryReplicaRouter, get_pin_key
+from products.models import Product
+
+from . import benchmark
+from .authentication import TokenUserCache, token_user_cache
+from .cache import response_cache
+from .checks import check_replica_caches
+from .renderers import MessagePackParser, MessagePackRenderer, ORJSONRenderer, msgpack
+from .metrics import registry
+
+User = get_user_model()
+
 
 # Create your tests here.
+class BearerTokenCacheTests(TestCase):
+    def setUp(self):
+        token_user_cache.clear()
+        self.user = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token.key}")
+        self.url = reverse("cache-stats")
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        queries = [q for q in ctx.captured_queries if "authtoken_token" in q["sql"]]
+        return response, len(queries)
+
+    def test_token_lookup_is_cached(self):
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+        self.assertGreaterEqual(response.json()["token_auth"]["hits"], 1)
+
+    def test_deleted_token_is_rejected(self):
+        self.token_queries()
+        self.token.delete()
+        response, _ = self.token_queries()
+        # the SessionAuthentication comes first in the settings so the failed authentications are 403 and not 401
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["detail"], "Invalid token.")
+
+    def test_deactivated_user_is_rejected(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        response, _ = self.token_queries()
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["detail"], "User inactive or deleted.")
+
+    def test_demoted_user_is_reloaded(self):
+        self.token_queries()
+        self.user.is_staff = False
+        self.user.save()
+        response, _ = self.token_queries()
+        self.assertEqual(response.status_code, 403)
+
+    def test_change_in_another_process(self):
+        self.token_queries()
+        # the entries of this process are only used while the version in the shared cache has not changed
+        other_process = TokenUserCache()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        other_process.invalidate(self.token.key)
+        response, queries = self.token_queries()
+        self.assertEqual((response.status_code, queries), (403, 1))
+
+    def test_jwt_still_works(self):
+        response = self.client.post(
+            reverse("token_obtain_pair"),
+            {"email": "admin@example.com", "password": "pass12345"},
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class PermissionCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="staff@example.com", username="staff", password="pass12345", is_staff=True
+        )
+        self.view_perm = Permission.objects.get(codename="add_product")
+        self.user.user_permissions.add(self.view_perm)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("product-list")
+
+    def get(self):
+        # force_authenticate reuses the same user object, a real request loads a fresh one every time
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        queries = [q for q in ctx.captured_queries if "auth_permission" in q["sql"]]
+        return response.status_code, len(queries)
+
+    def test_permissions_are_cached(self):
+        self.assertEqual(self.get(), (200, 2))
+        self.assertEqual(self.get(), (200, 0))
+
+    def test_removed_permission(self):
+        self.get()
+        self.user.user_permissions.remove(self.view_perm)
+        self.assertEqual(self.get()[0], 403)
+
+    def test_group_permissions(self):
+        self.user.user_permissions.clear()
+        group = Group.objects.create(name="editors")
+        group.user_set.add(self.user)
+        self.assertEqual(self.get()[0], 403)
+        group.permissions.add(self.view_perm)
+        self.assertEqual(self.get()[0], 200)
+        group.permissions.remove(self.view_perm)
+        self.assertEqual(self.get()[0], 403)
+
+
+class BenchmarkTests(TestCase):
+    def test_in_process_run(self):
+        endpoints = benchmark.run_in_process(products=30, users=3, iterations=2, warmup=1)
+        self.assertEqual(list(endpoints), benchmark.ENDPOINTS)
+        for name, metrics in endpoints.items():
+            self.assertEqual(metrics["errors"], 0, name)
+            self.assertEqual(metrics["requests"], 2, name)
+            self.assertIsNotNone(metrics["queries"], name)
+
+    def test_serializers_run(self):
+        results = benchmark.run_serializers(products=20, users=2, repeat=2)
+        self.assertEqual(list(results), ["serializer_drf", "serializer_compiled"])
+        for metrics in results.values():
+            self.assertGreater(metrics["throughput"], 0)
+
+    def test_renderers_run(self):
+        results = benchmark.run_renderers(products=20, users=2, repeat=2, limit=5)
+        self.assertIn("renderer_orjson", results)
+        self.assertIn("list_orjson", results)
+        for metrics in results.values():
+            self.assertGreater(metrics["throughput"], 0)
+
+    def test_compare(self):
+        old = {"endpoints": {"list": {"throughput": 100.0, "p50_ms": 10.0, "queries": 2.0}}}
+        new = {"endpoints": {"list": {"throughput": 150.0, "p50_ms": 5.0, "queries": 2.0}}}
+        self.assertEqual(
+            benchmark.compare(old, new),
+            {"list": {"throughput": 50.0, "p50_ms": -50.0, "queries": 0.0}},
+        )
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+
+# The database benchmark creates its own databases with new aliases, the django test cases only allow the
+# databases that are configured in the settings, so this is a plain unittest test case
+class DatabaseProfileBenchmarkTests(unittest.TestCase):
+    def test_database_run(self):
+        results = benchmark.run_database(workers=2, operations=5, products=20)
+        self.assertEqual(
+            list(results),
+            ["development_read", "development_write", "production_read", "production_write"],
+        )
+        self.assertEqual(results["production_read"]["errors"], 0)
+
+    def test_production_profile_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with benchmark.profile_database("production", directory) as alias:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA busy_timeout")
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+                self.assertEqual(connections[alias].settings_dict["CONN_MAX_AGE"], 600)
+
+
+# The ASGI application runs the requests in other threads with their own db connections,
+# so the data must be committed for them to see it
+class ConcurrencyBenchmarkTests(TransactionTestCase):
+    def test_concurrency_run(self):
+        results = benchmark.run_concurrency(
+            products=30, users=3, requests=4, concurrency=(1, 2), db_delay=0
+        )
+        self.assertEqual(len(results), len(benchmark.CONCURRENCY_ENDPOINTS) * 2 * 2)
+        for name, metrics in results.items():
+            self.assertEqual(metrics["errors"], 0, name)
+            self.assertEqual(metrics["requests"], 4, name)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_requests_are_recorded(self):
+        self.client.get(reverse("product-list"))
+        self.client.get(reverse("product-list"))
+        metrics = registry.snapshot()["product-list"]
+        self.assertEqual(metrics["requests"], {("GET", 200): 2})
+        self.assertEqual(metrics["latency_count"], 2)
+        self.assertGreater(metrics["sql_queries"], 0)
+
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse("product-list"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="product-list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="product-list",le="+Inf"} 1', body)
+        self.assertIn("response_cache_misses_total", body)
+
+    def test_metrics_need_an_admin(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+
+# The test database is the primary and a new SQLite file is its replica, the replica is a copy made by the sync_replicas command
+# The replica is added to the databases before the test case validates its databases
+class ReplicaRoutingTests(TransactionTestCase):
+    alias = "replica_test"
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings[cls.alias] = connections.configure_settings(
+            {
+                "default": connections.settings["default"],
+                cls.alias: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": os.path.join(cls.directory.name, "replica.sqlite3"),
+                },
+            }
+        )[cls.alias]
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        # the responses are not cached, every request reads the db
+        self.replica_settings = override_settings(DATABASE_REPLICAS=[self.alias], RESPONSE_CACHE_TIMEOUT=0)
+        self.replica_settings.enable()
+        self.addCleanup(self.replica_settings.disable)
+        cache.clear()
+        token_user_cache.clear()
+
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password=None
+        )
+        for title in ("laptop", "phone"):
+            Product.objects.create(title=title, user=self.admin)
+        call_command("sync_replicas", stdout=StringIO())
+        # the replica is behind the primary until the next sync
+        Product.objects.create(title="tablet", user=self.admin)
+
+    def get_client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {Token.objects.create(user=user).key}")
+        return client
+
+    def count_products(self, client):
+        response = client.get(reverse("product-list"))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["count"]
+
+    def test_reads_go_to_the_replica(self):
+        # the token was created after the sync, the authentication reads the primary
+        client = self.get_client(self.admin)
+        self.assertEqual(self.count_products(client), 2)
+        call_command("sync_replicas", stdout=StringIO())
+        self.assertEqual(self.count_products(client), 3)
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        client = self.get_client(self.admin)
+        other = User.objects.create_superuser(email="other@example.com", username="other", password=None)
+        other_client = self.get_client(other)
+
+        response = client.post(reverse("product-list"), {"title": "camera", "price": "1.00"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.count_products(client), 4)
+        # the other users still read the replica
+        self.assertEqual(self.count_products(other_client), 2)
+        # once the pin expires the user reads the replica again
+        cache.delete(get_pin_key(self.admin.pk))
+        self.assertEqual(self.count_products(client), 2)
+
+    def test_responses_are_cached_from_the_primary_after_a_write(self):
+        client = self.get_client(self.admin)
+        other = User.objects.create_superuser(email="other@example.com", username="other", password=None)
+        other_client = self.get_client(other)
+        with self.settings(RESPONSE_CACHE_TIMEOUT=300):
+            self.assertEqual(client.post(reverse("product-list"), {"title": "camera", "price": "1.00"}).status_code, 201)
+            # the other user shares the cached responses of the admin, the one that fills the cache reads the primary
+            response = other_client.get(reverse("product-list"))
+            self.assertEqual((response["X-Cache"], response.json()["count"]), ("MISS", 4))
+            response = other_client.get(reverse("product-list"))
+            self.assertEqual((response["X-Cache"], response.json()["count"]), ("HIT", 4))
+            # once the replicas had the time to catch up the misses read them again
+            cache.delete(response_cache._recent_key("all"))
+            response = other_client.get(reverse("product-list") + "?page=1")
+            self.assertEqual((response["X-Cache"], response.json()["count"]), ("MISS", 2))
+
+    def test_replicas_need_a_shared_cache(self):
+        self.assertEqual([error.id for error in check_replica_caches(None)], ["api.E001", "api.E002"])
+        shared = {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(self.directory.name, "cache"),
+        }
+        with self.settings(
+            CACHES={**settings.CACHES, "shared": shared},
+            REPLICA_PINNING_CACHE_ALIAS="shared",
+            RESPONSE_CACHE_ALIAS="shared",
+        ):
+            self.assertEqual(check_replica_caches(None), [])
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(check_replica_caches(None), [])
+
+    def test_routing_outside_of_requests(self):
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), "default")
+        self.assertEqual(router.db_for_write(Product), "default")
+        self.assertFalse(router.allow_migrate(self.alias, "products"))
+
+
+class RendererTests(TestCase):
+    data = {
+        "price": Decimal("12.50"),
+        "label": gettext_lazy("Products"),
+        "url": Hyperlink("http://testserver/api/products/1/", None),
+        "created": datetime.datetime(2024, 5, 1, 10, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+        "day": datetime.date(2024, 5, 1),
+        "id": uuid.UUID(int=1),
+        "text": "caf\u00e9 \u2028 \u2029",
+        "counts": {1: "one"},
+        "big": 2**70,
+        "rows": [{"title": "laptop", "public": True, "content": None}],
+    }
+
+    def test_same_bytes_as_the_json_renderer(self):
+        self.assertEqual(ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        without_big = {key: value for key, value in self.data.items() if key != "big"}
+        self.assertEqual(ORJSONRenderer().render(without_big), JSONRenderer().render(without_big))
+        indented = "application/json; indent=4"
+        self.assertEqual(
+            ORJSONRenderer().render(self.data, indented), JSONRenderer().render(self.data, indented)
+        )
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+    def test_product_list(self):
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password=None)
+        Product.objects.create(title="laptop", content="caf\u00e9", price="9.99", user=admin)
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.get(reverse("product-list"))
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_message_pack(self):
+        payload = MessagePackRenderer().render({"price": Decimal("1.50"), "title": "laptop"})
+        self.assertEqual(MessagePackParser().parse(BytesIO(payload)), {"price": 1.5, "title": "laptop"})
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_message_pack_endpoints(self):
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password=None)
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post(
+            reverse("product-list"),
+            msgpack.packb({"title": "laptop", "price": "9.99"}),
+            content_type="application/msgpack",
+            HTTP_ACCEPT="application/msgpack",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content)["title"], "laptop")
+        response = client.get(reverse("product-list"), HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content)["count"], 1)
@@ -9,6 +9,8 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     path('', views.api_home),
+    path('cache/stats/', views.cache_stats, name='cache-stats'),
+    path('metrics', views.metrics, name='metrics'),
     path('auth/', obtain_auth_token),
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
@@ -1,6 +1,13 @@
 from django.shortcuts import render
-from rest_framework.decorators import api_view
+from rest_framework import permissions
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.response import Response
+from .authentication import token_user_cache
+from .cache import response_cache
+from .metrics import registry
+from .permissions import permission_cache
+from .renderers import PrometheusRenderer
+from search.cache import search_cache
 
 # Create your views here.
 
@@ -11,3 +18,39 @@ def api_home(request, *args, **kwargs):
     DRF API View
     '''
     return Response({'message': 'This is the api home route'})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats(request, *args, **kwargs):
+    '''
+    Returns the hit/miss counters of the caches of this process
+    '''
+    return Response(
+        {
+            "responses": response_cache.get_stats(),
+            "token_auth": token_user_cache.get_stats(),
+            "permissions": permission_cache.get_stats(),
+            "search": search_cache.get_stats(),
+        }
+    )
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request, *args, **kwargs):
+    '''
+    Returns the request metrics of this process in the Prometheus text format (refer: api/middleware.py)
+    '''
+    counters = {}
+    for name, cache in (
+        ("response_cache", response_cache),
+        ("token_auth_cache", token_user_cache),
+        ("permission_cache", permission_cache),
+        ("search_cache", search_cache),
+    ):
+        stats = cache.get_stats()
+        counters[f"{name}_hits_total"] = (f"Number of hits of the {name}.", stats["hits"])
+        counters[f"{name}_misses_total"] = (f"Number of misses of the {name}.", stats["misses"])
+    return Response(registry.render(counters))
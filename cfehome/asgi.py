@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cfehome.settings')
 
 application = get_asgi_application()
+
+# The autocomplete index is built in the background while the server starts, not by its first request
+# (refer: search/autocomplete.py)
+from search.autocomplete import title_index  # noqa: E402
+
+title_index.start_build()
@@ -0,0 +1,126 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject, empty
+
+# This is the database router that splits the reads and the writes between the primary database (default)
+# and its read replicas (refer: DATABASE_REPLICAS in the settings)
+#   * every write goes to the primary
+#   * the reads of the products and the search go to a random replica, but only for the safe (GET/HEAD/OPTIONS) requests
+#     on the REPLICA_READ_PATHS, everything else (the writes of a request, authentication, management commands) reads the primary
+#   * read your writes: once a request writes, the rest of it reads the primary, and so do the requests of the same user
+#     for REPLICA_PINNING_SECONDS afterwards, so that he never sees a replica that has not caught up with his own write
+#   * the responses that fill the response cache within REPLICA_PINNING_SECONDS of its invalidation read the primary,
+#     the other users of the scope would get the cached data of a replica that is behind (refer: api/mixins.CachedResponseMixin)
+# The users and tokens are always read from the primary, a replica that is behind could still accept a deactivated user.
+# The state of the current request is kept by the ReplicaRoutingMiddleware (refer: api/middleware.py)
+
+# The RoutingState of the request that is being handled
+current_routing_state = ContextVar("current_routing_state", default=None)
+
+
+def get_pin_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+class RoutingState:
+    def __init__(self, request, use_replicas):
+        self.request = request
+        self.use_replicas = use_replicas
+        # True once the request has written to the primary
+        self.wrote = False
+        # True when the reads of the request must go to the primary
+        self.pinned = False
+        self._pin_checked = False
+
+    def get_user_id(self):
+        '''
+        Returns the id of the authenticated user of the request, or None if the user is anonymous or not known yet
+        '''
+        user = self.request.__dict__.get("user")
+        # The user of the AuthenticationMiddleware is lazy, it is only known once something (like the DRF authentication) loaded it
+        if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+            return None
+        return user.pk if user.is_authenticated else None
+
+    def is_pinned(self):
+        if self.pinned or self._pin_checked:
+            return self.pinned
+        user_id = self.get_user_id()
+        if user_id is not None:
+            # the user is checked only once per request
+            self._pin_checked = True
+            self.pinned = bool(get_pin_cache().get(get_pin_key(user_id)))
+        return self.pinned
+
+    def pin_user(self):
+        '''
+        Sends the reads of the user of the request to the primary for the next REPLICA_PINNING_SECONDS
+        '''
+        user_id = self.get_user_id()
+        if user_id is not None:
+            get_pin_cache().set(get_pin_key(user_id), True, get_pinning_seconds())
+
+
+def use_primary():
+    '''
+    Sends the rest of the reads of the current request to the primary
+    '''
+    state = current_routing_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def get_pin_cache():
+    # the pins must be shared by all the processes that serve the users (refer: api/checks.py)
+    return caches[getattr(settings, "REPLICA_PINNING_CACHE_ALIAS", "default")]
+
+
+def get_pinning_seconds():
+    return getattr(settings, "REPLICA_PINNING_SECONDS", 5)
+
+
+def get_replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class PrimaryReplicaRouter:
+    primary = "default"
+    # The apps whose reads can be served by a replica
+    replicated_apps = {"products", "search"}
+
+    def db_for_read(self, model, **hints):
+        state = current_routing_state.get()
+        replicas = get_replicas()
+        if (
+            state is None
+            or not replicas
+            or not state.use_replicas
+            or model._meta.app_label not in self.replicated_apps
+            or state.is_pinned()
+        ):
+            return self.primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = current_routing_state.get()
+        if state is not None:
+            # read your writes: the rest of the request reads the primary
+            state.wrote = True
+            state.pinned = True
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas are copies of the primary, so the objects of all of them can be related
+        databases = {self.primary, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get the schema from the primary with the data (refer: the sync_replicas command)
+        if db in get_replicas():
+            return False
+        return None
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import datetime
+import importlib.util
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,9 +55,15 @@ INSTALLED_APPS = [
     "products",
     "search",
     "accounts",
+    "jobs",
 ]
 
 MIDDLEWARE = [
+    # Records the latency and the SQL queries of every view, exposed at /api/metrics (refer: api/middleware.py)
+    # it is placed first so that the time spent in the other middlewares is also measured
+    "api.middleware.InstrumentationMiddleware",
+    # Sends the reads of the product pages to the read replicas (refer: cfehome/db_routers.py)
+    "api.middleware.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     # When setting up the corsheaders add this middleware above the CommonMiddleware
@@ -111,6 +119,150 @@ DATABASES = {
     }
 }
 
+# These pragmas are run on every new connection of the production profile (refer: https://www.sqlite.org/pragma.html)
+SQLITE_PRODUCTION_PRAGMAS = {
+    # The readers do not wait for the writers (and the writer does not wait for the readers) with the write ahead log
+    "journal_mode": "WAL",
+    # With WAL, NORMAL only syncs at the checkpoints, a power loss can lose the last transactions but never corrupts the db
+    "synchronous": "NORMAL",
+    # 64MB of page cache per connection (a negative value is in KiB)
+    "cache_size": -64000,
+    # Read the db file through a 256MB memory map instead of read() calls
+    "mmap_size": 268435456,
+    # Wait up to 5 seconds for a lock instead of failing at once with "database is locked"
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+
+# The database profiles, choose one with the DJANGO_DATABASE_PROFILE environment variable
+#   * development (default) => the plain SQLite file, a new connection for every request
+#   * production => the pragmas above, persistent connections and write transactions that take the lock at BEGIN
+DATABASE_PROFILES = {
+    "development": {},
+    "production": {
+        # Keep the connection of a worker open for 10 minutes instead of reconnecting on every request,
+        # the health checks replace a connection that stopped working before it is used by a request.
+        # Under ASGI every request runs in a new thread with its own connection, so keep it at 0 there.
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "init_command": ";".join(
+                f"PRAGMA {name} = {value}" for name, value in SQLITE_PRODUCTION_PRAGMAS.items()
+            ),
+            # BEGIN IMMEDIATE takes the write lock at the start of a transaction, with the default DEFERRED
+            # a transaction that reads and then writes can fail with "database is locked" without waiting busy_timeout
+            "transaction_mode": "IMMEDIATE",
+        },
+    },
+}
+DATABASE_PROFILE = os.environ.get("DJANGO_DATABASE_PROFILE", "development")
+DATABASES["default"].update(DATABASE_PROFILES[DATABASE_PROFILE])
+
+# The read replicas of the default database, a comma separated list of SQLite files in DJANGO_DATABASE_REPLICAS
+# they are added as replica_1, replica_2... Locally the replicas are copies of db.sqlite3 that are refreshed
+# with "python manage.py sync_replicas", like a replication that is behind until the next sync.
+# The replicas need a shared cache (refer: CACHES below):
+#   DJANGO_CACHE_DIR=.cache DJANGO_DATABASE_REPLICAS=replica.sqlite3 python manage.py sync_replicas
+DATABASE_REPLICAS = []
+for index, replica_name in enumerate(filter(None, os.environ.get("DJANGO_DATABASE_REPLICAS", "").split(","))):
+    alias = f"replica_{index + 1}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / replica_name.strip(),
+        # the tests run on the test database of the primary only
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["cfehome.db_routers.PrimaryReplicaRouter"]
+# Only the safe requests on these paths read from the replicas
+REPLICA_READ_PATHS = ["/api/products/", "/api/v2/products/"]
+# For how long the reads of a user go to the primary after he wrote something (read your writes)
+REPLICA_PINNING_SECONDS = 5
+REPLICA_PINNING_CACHE_ALIAS = "default"
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The local memory cache is per process, in production point the default cache to a shared backend like redis or memcached
+# Locally DJANGO_CACHE_DIR shares it between the processes of the machine through files, the read replicas need a shared
+# cache (refer: api/checks.py) and so do the run_jobs workers to make the caches of the web processes stale.
+# The ETag/Last-Modified of the product responses are only sent with a shared cache (refer: api/mixins.ConditionalGetMixin).
+
+CACHE_DIR = os.environ.get("DJANGO_CACHE_DIR")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "cfehome",
+    }
+}
+if CACHE_DIR:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / CACHE_DIR,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+
+# The cache used by the response cache of the product read endpoints (refer: api/cache.py)
+# and the number of seconds a cached response is kept
+RESPONSE_CACHE_ALIAS = "default"
+RESPONSE_CACHE_TIMEOUT = 300
+
+# The cache of token key -> user used by the BearerTokenAuthentication (refer: api/authentication.py)
+# set TOKEN_AUTH_CACHE_ALIAS to a shared cache to share the entries between the processes, the versions of the tokens
+# that make the entries of every process stale when a token or its user changes live in TOKEN_AUTH_VERSION_CACHE_ALIAS
+TOKEN_AUTH_CACHE_MAX_SIZE = 10000
+TOKEN_AUTH_CACHE_TTL = 60
+TOKEN_AUTH_CACHE_ALIAS = None
+TOKEN_AUTH_VERSION_CACHE_ALIAS = "default"
+
+# The cache of the user permissions used by the IsStaffEditorPermission (refer: api/permissions.py)
+PERMISSION_CACHE_ALIAS = "default"
+PERMISSION_CACHE_TIMEOUT = 3600
+
+# The cache of the search results (refer: search/cache.py): the number of queries whose results are kept in every process,
+# the results with more products than SEARCH_CACHE_MAX_RESULTS are not cached, and the cache that shares the generation
+# number which makes the results of all the processes stale after a product write. The results also expire after
+# SEARCH_CACHE_TTL seconds (None keeps them until the next write)
+SEARCH_CACHE_MAX_SIZE = 1000
+SEARCH_CACHE_MAX_RESULTS = 5000
+SEARCH_CACHE_ALIAS = "default"
+SEARCH_CACHE_TTL = 300
+
+# The fuzzy search of the product titles (?mode=fuzzy, refer: search/trigram.py): how close a title must be to the query
+# (the share of common trigrams, from 0 to 1) and the most candidates read from the trigram index and scored per search
+SEARCH_FUZZY_THRESHOLD = 0.3
+SEARCH_FUZZY_MAX_CANDIDATES = 200
+
+# The facets of the product search (?facets=true, refer: search/facets.py): the edges of the price buckets
+# (0-10, 10-50, ..., the last one has no max) and the number of owners with the most results that are listed
+SEARCH_FACET_PRICE_BUCKETS = [0, 10, 50, 100, 500]
+SEARCH_FACET_MAX_OWNERS = 10
+
+# The autocomplete of the product titles (refer: search/autocomplete.py): the number of suggestions returned by default
+# and the most a client can ask for with ?limit=, and the seconds after which the index of a process is built again
+# from the db to pick up the writes of the other processes (None keeps it until the process ends)
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_REBUILD_SECONDS = 300
+
+# The background jobs (refer: jobs/worker.py): the number of jobs a run_jobs command runs at the same time,
+# how often it looks for new jobs, how long a running job is owned by its worker without a renewal (the worker renews it
+# every third of that while the job runs, a stopped worker loses its jobs once it expires),
+# and the backoff before a failed job is attempted again (doubled after every attempt, up to the max)
+JOBS_WORKERS = 4
+JOBS_POLL_SECONDS = 1.0
+JOBS_LEASE_SECONDS = 300
+JOBS_RETRY_BACKOFF_SECONDS = 10
+JOBS_RETRY_MAX_BACKOFF_SECONDS = 3600
+
+# Turns the request metrics of the InstrumentationMiddleware on or off
+METRICS_ENABLED = True
+
+# The lists of products are rendered by the compiled read only serializers (refer: api/mixins.CompiledListMixin)
+# set it to False to render them with the DRF serializers again
+COMPILED_SERIALIZERS = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -158,9 +310,11 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
         # Custom authentication class we created
+        # It must come before the JWTAuthentication because both use the Bearer keyword and the JWTAuthentication
+        # rejects every token that is not a JWT, while this one skips the JWTs (refer: api/authentication.py)
         "api.authentication.BearerTokenAuthentication",
+        "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         # Allows only authenticated users to perform a POST, PUT, PATCH or DELETE request
@@ -172,8 +326,23 @@ REST_FRAMEWORK = {
     # offset is more like from which data position we should start if we give offset to 4 it will start fetching from the 4th record and 10 records after that
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 10,
+    # The JSON responses are written with orjson, the bytes are the same as the JSONRenderer of DRF (refer: api/renderers.py)
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
+# The clients can also send and receive MessagePack (Accept/Content-Type: application/msgpack) when msgpack is installed
+if importlib.util.find_spec("msgpack") is not None:
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"].append("api.renderers.MessagePackRenderer")
+    REST_FRAMEWORK["DEFAULT_PARSER_CLASSES"].append("api.renderers.MessagePackParser")
+
 
 # This is how we customize JWT as in saying the app about the lifespan of the access tokens provided by the api
 SIMPLE_JWT = {
@@ -23,6 +23,7 @@ urlpatterns = [
     path("api/", include("api.urls")),
     path("api/products/", include("products.urls")),
     path("api/products/search/", include("search.urls")),
+    path("api/jobs/", include("jobs.urls")),
     # This is where we are calling the new product urls that is created using routers
     path("api/v2/", include("cfehome.routers")),
 ]
@@ -0,0 +1,77 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import is_shared_cache
+from jobs.worker import Worker
+
+
+# This command runs the background jobs of the queue (refer: jobs/worker.py)
+# usage: python manage.py run_jobs [--workers 4] [--processes] [--burst] [--allow-local-caches]
+# Several of these commands can run at the same time on the same database, each one claims its own jobs.
+# SIGTERM/SIGINT stop the claims, the jobs that are already running are finished before it exits.
+# The jobs that write products make the cached responses and search results of the web processes stale through
+# the versions in the django cache, so the worker refuses to start when those caches are not shared with the web
+# processes, unless --allow-local-caches is given (a single process setup, the tests).
+class Command(BaseCommand):
+    help = "Runs the background jobs of the queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=None, help="The number of jobs run at the same time (default JOBS_WORKERS)"
+        )
+        parser.add_argument(
+            "--processes", action="store_true", help="Run the jobs in a pool of processes instead of threads"
+        )
+        parser.add_argument(
+            "--burst", action="store_true", help="Exit once there is no due job left instead of waiting for new ones"
+        )
+        parser.add_argument(
+            "--allow-local-caches",
+            action="store_true",
+            help="Start even if the response and search caches only live in this process",
+        )
+
+    def check_caches(self, allow_local):
+        local = [
+            f"{setting} ({alias!r})"
+            for setting, alias in (
+                ("RESPONSE_CACHE_ALIAS", getattr(settings, "RESPONSE_CACHE_ALIAS", "default")),
+                ("SEARCH_CACHE_ALIAS", getattr(settings, "SEARCH_CACHE_ALIAS", "default")),
+            )
+            if not is_shared_cache(alias)
+        ]
+        if not local:
+            return
+        message = (
+            f"The caches of {', '.join(local)} only live in this process, the writes of the jobs do not make the cached "
+            "responses and search results of the web processes stale. Point them to a shared cache "
+            "(DJANGO_CACHE_DIR locally)"
+        )
+        if not allow_local:
+            raise CommandError(f"{message} or start with --allow-local-caches.")
+        # with a local response cache the web processes send no ETag (refer: api/mixins.ConditionalGetMixin),
+        # so the old data is served until the entries expire and not forever
+        self.stderr.write(
+            self.style.WARNING(
+                f"WARNING: {message}. The web processes serve the old data until the cached responses expire "
+                "(RESPONSE_CACHE_TIMEOUT), the search results expire (SEARCH_CACHE_TTL) and the autocomplete index "
+                "is built again (AUTOCOMPLETE_REBUILD_SECONDS)."
+            )
+        )
+
+    def handle(self, *args, **options):
+        self.check_caches(options["allow_local_caches"])
+        worker = Worker(
+            concurrency=options["workers"],
+            processes=options["processes"],
+            report=lambda pk, status: self.stdout.write(f"job {pk}: {status}"),
+        )
+        if not options["burst"]:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: worker.stop())
+        pool = "processes" if options["processes"] else "threads"
+        self.stdout.write(f"Worker {worker.id} started with {worker.concurrency} {pool}")
+        count = worker.run(burst=options["burst"])
+        self.stdout.write(self.style.SUCCESS(f"{count} jobs run"))
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+# Create your models here.
+
+
+# This is the queue of the background jobs (refer: jobs/worker.py)
+# A job is a row of this table: the views insert it (refer: jobs/registry.enqueue) and answer with a 202 right away,
+# the workers of the run_jobs command claim the rows that are due and run the task registered under their name.
+class Job(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    # The name the task was registered with (refer: jobs/registry.task)
+    name = models.CharField(max_length=100)
+    # The keyword arguments of the task, they must be JSON serializable
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # The user who enqueued the job, he can follow its progress at /api/jobs/<id>/
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name="jobs")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # The job is not run before this time, a failed attempt moves it forward (refer: Job.retry_delay)
+    run_at = models.DateTimeField(default=timezone.now)
+    # The worker that runs the job and until when it owns it, the lease is extended by the worker while the job runs
+    # and by every progress update (refer: jobs/worker.py).
+    # A job whose lease has expired (its worker was killed) is claimed again by the other workers.
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # The progress reported by the task (refer: Job.set_progress), total is None while it is unknown
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    # The return value of the task or the error of the last failed attempt
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The workers look for the due jobs with status = 'queued' AND run_at <= now ORDER BY run_at
+            models.Index(fields=["status", "run_at"], name="job_status_run_at_idx"),
+            # The jobs of a user (refer: api/mixins.UserQuerySetMixin)
+            models.Index(fields=["user", "id"], name="job_user_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    @staticmethod
+    def get_lease():
+        return timedelta(seconds=getattr(settings, "JOBS_LEASE_SECONDS", 300))
+
+    def retry_delay(self):
+        '''
+        Returns the time to wait before the next attempt: the backoff doubles after every failed attempt
+        '''
+        base = getattr(settings, "JOBS_RETRY_BACKOFF_SECONDS", 10)
+        cap = getattr(settings, "JOBS_RETRY_MAX_BACKOFF_SECONDS", 3600)
+        return timedelta(seconds=min(base * 2 ** max(self.attempts - 1, 0), cap))
+
+    def set_progress(self, progress, total=None):
+        '''
+        Saves the progress of a running job and extends the lease of its worker, the tasks call it between their steps
+        '''
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        self.locked_until = timezone.now() + self.get_lease()
+        # only the worker that owns the job can write it
+        Job.objects.filter(pk=self.pk, locked_by=self.locked_by).update(
+            progress=self.progress, total=self.total, locked_until=self.locked_until
+        )
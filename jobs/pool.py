@@ -0,0 +1,15 @@
+# The functions run by the processes of the pool of a worker (refer: Worker.make_executor)
+# The processes are spawned, they unpickle these functions by importing this module before django is set up again,
+# so it must not import the models at the top.
+
+
+def init_process():
+    import django
+
+    django.setup()
+
+
+def run_in_process(pk, worker_id):
+    from .worker import run_in_pool
+
+    return run_in_pool(pk, worker_id)
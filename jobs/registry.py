@@ -0,0 +1,60 @@
+from .models import Job
+
+# This module holds the tasks that can be run in the background (refer: jobs/worker.py)
+# A task is a function registered under a name with the @task decorator, the apps register their tasks
+# in their tasks.py module which is imported when django starts (refer: JobsConfig.ready).
+# The function is called with the job as the first argument and the payload of the job as the keyword arguments,
+# it can report its progress with job.set_progress() and its return value (JSON serializable) is the result of the job.
+# A task can be attempted more than once (a failure is retried, a killed worker leaves the job to the others)
+# so it must be safe to run it again.
+
+_tasks = {}
+
+
+class Task:
+    def __init__(self, name, func, max_attempts=3, concurrency=None):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        # The most jobs of this task that run at the same time over all the workers, None means no limit
+        self.concurrency = concurrency
+
+    def __call__(self, job, **payload):
+        return self.func(job, **payload)
+
+
+def task(name, max_attempts=3, concurrency=None):
+    '''
+    Registers the decorated function as the task with the given name
+    '''
+
+    def decorator(func):
+        if name in _tasks:
+            raise ValueError(f"A task named {name!r} is already registered")
+        _tasks[name] = Task(name, func, max_attempts=max_attempts, concurrency=concurrency)
+        return func
+
+    return decorator
+
+
+def get_task(name):
+    return _tasks.get(name)
+
+
+def get_tasks():
+    return dict(_tasks)
+
+
+def enqueue(name, payload=None, user=None, run_at=None):
+    '''
+    Inserts a job of the task in the queue and returns it, a worker of the run_jobs command will run it
+    '''
+    registered = get_task(name)
+    if registered is None:
+        raise ValueError(f"There is no task named {name!r}")
+    fields = {"name": name, "payload": payload or {}, "max_attempts": registered.max_attempts}
+    if user is not None and user.is_authenticated:
+        fields["user"] = user
+    if run_at is not None:
+        fields["run_at"] = run_at
+    return Job.objects.create(**fields)
@@ -0,0 +1,26 @@
+from rest_framework import serializers
+
+from .models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name="job-detail", lookup_field="pk")
+
+    class Meta:
+        model = Job
+        fields = [
+            "id",
+            "url",
+            "name",
+            "status",
+            "progress",
+            "total",
+            "attempts",
+            "max_attempts",
+            "result",
+            "error",
+            "run_at",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
@@ -0,0 +1,249 @@
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products.models import Product
+from search.cache import SearchResultCache
+
+from . import registry
+from .models import Job
+from .worker import Worker, claim, reap_expired, run_job
+
+User = get_user_model()
+
+calls = []
+
+
+@registry.task("tests.record", max_attempts=2)
+def record(job, value=None):
+    calls.append(value)
+    job.set_progress(1, total=1)
+    return {"value": value}
+
+
+@registry.task("tests.fail", max_attempts=2)
+def fail(job):
+    raise RuntimeError("boom")
+
+
+@registry.task("tests.slow")
+def slow(job):
+    time.sleep(1)
+    calls.append("slow")
+
+
+@registry.task("tests.single", concurrency=1)
+def single(job):
+    return None
+
+
+# Create your tests here.
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.user = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+
+    def test_enqueue(self):
+        job = registry.enqueue("tests.record", {"value": 1}, user=self.user)
+        self.assertEqual((job.status, job.max_attempts, job.user), (Job.QUEUED, 2, self.user))
+        with self.assertRaises(ValueError):
+            registry.enqueue("tests.unknown")
+
+    def test_claim_and_run(self):
+        job = registry.enqueue("tests.record", {"value": 1})
+        self.assertEqual(claim("worker-1", 10), [job.pk])
+        # a claimed job cannot be claimed by another worker
+        self.assertEqual(claim("worker-2", 10), [])
+        self.assertEqual(run_job(job.pk, "worker-1"), Job.SUCCEEDED)
+        job.refresh_from_db()
+        self.assertEqual(calls, [1])
+        self.assertEqual((job.status, job.result, job.progress, job.total, job.attempts), (Job.SUCCEEDED, {"value": 1}, 1, 1, 1))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_future_jobs_wait(self):
+        registry.enqueue("tests.record", run_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(claim("worker-1", 10), [])
+
+    def test_retry_with_backoff(self):
+        job = registry.enqueue("tests.fail")
+        claim("worker-1", 10)
+        self.assertEqual(run_job(job.pk, "worker-1"), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertIn("RuntimeError: boom", job.error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        # not due yet
+        self.assertEqual(claim("worker-1", 10), [])
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        claim("worker-1", 10)
+        self.assertEqual(run_job(job.pk, "worker-1"), Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_backoff_doubles(self):
+        job = Job(attempts=1)
+        with self.settings(JOBS_RETRY_BACKOFF_SECONDS=10, JOBS_RETRY_MAX_BACKOFF_SECONDS=30):
+            self.assertEqual(job.retry_delay(), timedelta(seconds=10))
+            job.attempts = 2
+            self.assertEqual(job.retry_delay(), timedelta(seconds=20))
+            job.attempts = 5
+            self.assertEqual(job.retry_delay(), timedelta(seconds=30))
+
+    def test_expired_lease(self):
+        job = registry.enqueue("tests.record")
+        claim("worker-1", 10)
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        # the job of a worker that stopped is claimed again
+        self.assertEqual(claim("worker-2", 10), [job.pk])
+        # the first worker cannot write the outcome anymore
+        run_job(job.pk, "worker-1")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.RUNNING, "worker-2"))
+        # no attempt left
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reap_expired(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_concurrency_limit(self):
+        first = registry.enqueue("tests.single")
+        second = registry.enqueue("tests.single")
+        other = registry.enqueue("tests.record")
+        self.assertEqual(claim("worker-1", 10), [first.pk, other.pk])
+        self.assertEqual(claim("worker-2", 10), [])
+        run_job(first.pk, "worker-1")
+        self.assertEqual(claim("worker-2", 10), [second.pk])
+
+    def test_claim_limit(self):
+        jobs = [registry.enqueue("tests.record") for _ in range(3)]
+        self.assertEqual(claim("worker-1", 2), [jobs[0].pk, jobs[1].pk])
+
+    def test_unknown_task(self):
+        job = Job.objects.create(name="tests.removed")
+        claim("worker-1", 10)
+        self.assertEqual(run_job(job.pk, "worker-1"), Job.FAILED)
+
+
+class JobViewTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.user = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+        self.client = APIClient()
+
+    def test_job_status(self):
+        job = registry.enqueue("tests.record", user=self.user)
+        other = registry.enqueue("tests.record", user=self.admin)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("job-detail", kwargs={"pk": job.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], Job.QUEUED)
+        self.assertEqual(self.client.get(reverse("job-detail", kwargs={"pk": other.pk})).status_code, 404)
+        self.assertEqual([row["id"] for row in self.client.get(reverse("job-list")).json()["results"]], [job.pk])
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(reverse("job-list")).status_code, (401, 403))
+
+    def test_background_bulk_update(self):
+        laptop = Product.objects.create(title="Laptop", price="10.00", user=self.admin)
+        mouse = Product.objects.create(title="Mouse", price="5.00", user=self.admin)
+        self.client.force_authenticate(self.admin)
+        items = [{"id": laptop.pk, "price": "12.00"}, {"id": mouse.pk, "title": "laptop"}, {"id": 0, "price": "1.00"}]
+        response = self.client.patch(reverse("product-bulk") + "?background=true", items, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], response.json()["url"])
+        # nothing is written before a worker runs the job
+        laptop.refresh_from_db()
+        self.assertEqual(str(laptop.price), "10.00")
+
+        job = Job.objects.get(pk=response.json()["id"])
+        claim("worker-1", 10)
+        self.assertEqual(run_job(job.pk, "worker-1"), Job.SUCCEEDED)
+        laptop.refresh_from_db()
+        self.assertEqual(str(laptop.price), "12.00")
+        data = self.client.get(response.json()["url"]).json()
+        self.assertEqual((data["status"], data["progress"], data["total"]), (Job.SUCCEEDED, 3, 3))
+        self.assertEqual(data["result"]["updated"], 1)
+        self.assertEqual([error["position"] for error in data["result"]["errors"]], [1, 2])
+
+    def test_rebuild_search_index(self):
+        url = reverse("search-index-rebuild")
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.json()["id"])
+        self.assertEqual((job.name, job.user), ("search.rebuild_index", self.admin))
+        claim("worker-1", 10)
+        self.assertEqual(run_job(job.pk, "worker-1"), Job.SUCCEEDED)
+
+
+# The worker runs the jobs in other threads, which only see the rows that were committed
+class RunJobsCommandTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_burst(self):
+        for value in range(5):
+            registry.enqueue("tests.record", {"value": value})
+        registry.enqueue("tests.fail")
+        out = StringIO()
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, "--allow-local-caches"):
+            call_command("run_jobs", "--burst", stdout=out, stderr=err)
+        self.assertEqual(calls, [])
+        call_command("run_jobs", "--burst", "--workers", "3", "--allow-local-caches", stdout=out, stderr=err)
+        self.assertCountEqual(calls, range(5))
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 5)
+        # the failed job waits for its backoff
+        self.assertEqual(Job.objects.get(name="tests.fail").status, Job.QUEUED)
+        self.assertIn("6 jobs run", out.getvalue())
+        # the caches of the tests are local memory caches
+        self.assertIn("RESPONSE_CACHE_ALIAS ('default')", err.getvalue())
+
+    def test_job_writes_reach_the_caches_of_the_web_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        with self.settings(CACHES={"default": shared}):
+            admin = User.objects.create_superuser(email="admin@example.com", username="admin", password=None)
+            laptop = Product.objects.create(title="laptop", price="10.00", user=admin)
+            client = APIClient()
+            client.force_authenticate(admin)
+            client.get(reverse("product-list"))
+            self.assertEqual(client.get(reverse("product-list"))["X-Cache"], "HIT")
+            # the search results cached by a web process
+            web_search = SearchResultCache()
+            self.assertEqual(web_search.get_ids(Product.objects.all(), "laptop", user=admin), (laptop.pk,))
+
+            items = [{"id": laptop.pk, "title": "desk"}]
+            registry.enqueue("products.bulk_update", {"items": items, "partial": True}, user=admin)
+            err = StringIO()
+            # the job runs in a thread of the worker, with its own instance of the cache
+            call_command("run_jobs", "--burst", stdout=StringIO(), stderr=err)
+            self.assertEqual(err.getvalue(), "")
+
+            response = client.get(reverse("product-list"))
+            self.assertEqual((response["X-Cache"], response.json()["results"][0]["title"]), ("MISS", "desk"))
+            self.assertEqual(web_search.get_ids(Product.objects.all(), "laptop", user=admin), ())
+
+    def test_leases_are_renewed(self):
+        # the task runs for longer than the lease without reporting its progress
+        registry.enqueue("tests.slow")
+        with self.settings(JOBS_LEASE_SECONDS=0.3):
+            worker = Worker(concurrency=2, poll_interval=0.02)
+            self.assertEqual(worker.run(burst=True), 1)
+        # it was not claimed and run a second time once its first lease expired
+        self.assertEqual(calls, ["slow"])
+        self.assertEqual(Job.objects.get().attempts, 1)
+
+    def test_stop(self):
+        worker = Worker(concurrency=2, poll_interval=0.01)
+        worker.stop()
+        self.assertEqual(worker.run(), 0)
@@ -0,0 +1,34 @@
+from django.urls import reverse
+from rest_framework import generics, permissions, status
+from rest_framework.response import Response
+
+from api.mixins import UserQuerySetMixin
+
+from .models import Job
+from .serializers import JobSerializer
+
+
+# The jobs enqueued by the user and their status/progress => /api/jobs/ and /api/jobs/<id>/
+# the superusers see the jobs of everyone (refer: api/mixins.UserQuerySetMixin)
+class JobListAPIView(UserQuerySetMixin, generics.ListAPIView):
+    queryset = Job.objects.order_by("-id")
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+
+class JobDetailAPIView(UserQuerySetMixin, generics.RetrieveAPIView):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+
+def accepted_response(request, job):
+    '''
+    The response of a view that enqueued a job: 202 Accepted with the job id and where to follow its progress
+    '''
+    url = request.build_absolute_uri(reverse("job-detail", kwargs={"pk": job.pk}))
+    return Response(
+        {"id": job.pk, "name": job.name, "status": job.status, "url": url},
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": url},
+    )
@@ -0,0 +1,219 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Job
+from .pool import init_process, run_in_process
+from .registry import get_task, get_tasks
+
+# This module runs the jobs of the queue (refer: jobs/models.Job), it is used by the run_jobs command
+# A worker polls the table for the due jobs and runs them in a pool of threads (or processes):
+#   * a job is claimed with a conditional UPDATE (it only succeeds if the job was not claimed by another worker
+#     in the meantime) so the workers of several processes or machines can share the same queue without locks
+#   * the claimed job is leased to the worker for JOBS_LEASE_SECONDS, the worker renews the leases of the jobs it runs
+#     every third of that (and job.set_progress() renews it too). A job whose lease has expired, because its worker
+#     stopped, is claimed again by the other workers.
+#   * a failed attempt is retried after a backoff that doubles every time (refer: Job.retry_delay),
+#     the job fails for good once it has no attempt left
+#   * the pool runs at most JOBS_WORKERS jobs at the same time, and a task can limit how many of its jobs
+#     run at the same time over all the workers (refer: jobs/registry.task). The limit is checked before the claim,
+#     two workers that claim at the same instant can still go over it by one job each.
+
+
+def new_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def due_jobs(now):
+    # the queued jobs whose time has come and the running jobs whose worker stopped (their lease expired)
+    return Q(status=Job.QUEUED, run_at__lte=now) | Q(
+        status=Job.RUNNING, locked_until__lt=now, attempts__lt=F("max_attempts")
+    )
+
+
+def reap_expired():
+    '''
+    Fails the running jobs whose lease has expired and that have no attempt left, returns their number
+    '''
+    now = timezone.now()
+    return Job.objects.filter(status=Job.RUNNING, locked_until__lt=now, attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED,
+        error="The worker running the job stopped before finishing it.",
+        finished_at=now,
+        locked_by="",
+        locked_until=None,
+    )
+
+
+def claim(worker_id, limit):
+    '''
+    Claims up to limit due jobs for the worker and returns their ids, the oldest ones first
+    '''
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    due = due_jobs(now)
+    running = dict(
+        Job.objects.filter(status=Job.RUNNING, locked_until__gte=now)
+        .values_list("name")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    tasks = get_tasks()
+    claimed = []
+    # a few more candidates than needed, some of them can be taken by another worker or held back by their concurrency
+    for job in Job.objects.filter(due).order_by("run_at", "pk").only("pk", "name", "attempts")[: limit * 4]:
+        registered = tasks.get(job.name)
+        if registered is not None and registered.concurrency is not None:
+            if running.get(job.name, 0) >= registered.concurrency:
+                continue
+        # the attempts tell whether another worker claimed the job since it was read
+        won = Job.objects.filter(due, pk=job.pk, attempts=job.attempts).update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            locked_by=worker_id,
+            locked_until=now + Job.get_lease(),
+            started_at=now,
+        )
+        if won:
+            claimed.append(job.pk)
+            running[job.name] = running.get(job.name, 0) + 1
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def renew_leases(worker_id, pks):
+    '''
+    Extends the lease of the running jobs of the worker, returns the number of jobs whose lease was extended
+    '''
+    if not pks:
+        return 0
+    return Job.objects.filter(pk__in=pks, status=Job.RUNNING, locked_by=worker_id).update(
+        locked_until=timezone.now() + Job.get_lease()
+    )
+
+
+def run_job(pk, worker_id):
+    '''
+    Runs a job claimed by the worker and saves its outcome, returns the status of the job
+    '''
+    job = Job.objects.get(pk=pk)
+    # only the worker that owns the job can write its outcome, a lease that expired may have been taken by another one
+    owned = Job.objects.filter(pk=pk, status=Job.RUNNING, locked_by=worker_id)
+    released = {"locked_by": "", "locked_until": None}
+    registered = get_task(job.name)
+    if registered is None:
+        # another attempt would not find it either
+        owned.update(
+            status=Job.FAILED, error=f"There is no task named {job.name!r}", finished_at=timezone.now(), **released
+        )
+        return Job.FAILED
+    try:
+        result = registered(job, **job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            owned.update(status=Job.QUEUED, run_at=now + job.retry_delay(), error=error, **released)
+            return Job.QUEUED
+        owned.update(status=Job.FAILED, error=error, finished_at=now, **released)
+        return Job.FAILED
+    owned.update(
+        status=Job.SUCCEEDED,
+        result=result,
+        error="",
+        progress=Coalesce(F("total"), F("progress")),
+        finished_at=timezone.now(),
+        **released,
+    )
+    return Job.SUCCEEDED
+
+
+def run_in_pool(pk, worker_id):
+    try:
+        return run_job(pk, worker_id)
+    finally:
+        # the threads of the pool open their own connections, they are closed after every job
+        connections.close_all()
+
+
+class Worker:
+    def __init__(self, concurrency=None, processes=False, poll_interval=None, report=None):
+        self.id = new_worker_id()
+        self.concurrency = concurrency or getattr(settings, "JOBS_WORKERS", 4)
+        self.processes = processes
+        self.poll_interval = poll_interval or getattr(settings, "JOBS_POLL_SECONDS", 1.0)
+        # called with (job id, status) when a job ends, the status is "crashed" if the worker could not save it
+        self.report = report or (lambda pk, status: None)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def make_executor(self):
+        if self.processes:
+            return ProcessPoolExecutor(
+                self.concurrency, mp_context=multiprocessing.get_context("spawn"), initializer=init_process
+            )
+        return ThreadPoolExecutor(self.concurrency, thread_name_prefix="job-worker")
+
+    def run(self, burst=False):
+        '''
+        Runs the due jobs until stop() is called, or until there is no due job left if burst is True.
+        The jobs that are running when it stops are finished first. Returns the number of jobs run.
+        '''
+        pending = {}
+        count = 0
+        run = run_in_process if self.processes else run_in_pool
+        self._renew_at = time.monotonic() + self.renew_seconds
+        with self.make_executor() as executor:
+            while not self._stop.is_set():
+                reap_expired()
+                for pk in claim(self.id, self.concurrency - len(pending)):
+                    pending[executor.submit(run, pk, self.id)] = pk
+                if not pending:
+                    if burst:
+                        break
+                    self._stop.wait(self.poll_interval)
+                    continue
+                count += self.wait(pending)
+            while pending:
+                count += self.wait(pending)
+        return count
+
+    @property
+    def renew_seconds(self):
+        # the leases are renewed well before they expire, a task does not have to report its progress to keep its job
+        return Job.get_lease().total_seconds() / 3
+
+    def wait(self, pending):
+        '''
+        Waits up to a poll interval for the pending jobs, renews their leases when it is time, returns the number that ended
+        '''
+        finished, _ = wait(pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+        for future in finished:
+            self.finish(future, pending.pop(future))
+        if pending and time.monotonic() >= self._renew_at:
+            renew_leases(self.id, list(pending.values()))
+            self._renew_at = time.monotonic() + self.renew_seconds
+        return len(finished)
+
+    def finish(self, future, pk):
+        try:
+            status = future.result()
+        except Exception:
+            # the job stays running until its lease expires, then another attempt is made
+            status = "crashed"
+        self.report(pk, status)
@@ -0,0 +1,52 @@
+import csv
+import json
+
+# This module streams the products out as NDJSON (one json object per line) or CSV
+# The rows are read from the db in chunks with QuerySet.iterator() and every line is produced only when it is needed,
+# so the memory used stays the same no matter how many products there are.
+
+EXPORT_FIELDS = ["id", "title", "content", "price", "public", "user"]
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+CHUNK_SIZE = 2000
+
+
+def export_rows(queryset, chunk_size=CHUNK_SIZE):
+    '''
+    Yields every product of the queryset as a dict with the EXPORT_FIELDS
+    '''
+    # values() skips the creation of the model instances and order_by("pk") makes the output stable
+    qs = queryset.order_by("pk").values("id", "title", "content", "price", "public", "user_id")
+    for row in qs.iterator(chunk_size=chunk_size):
+        row["price"] = str(row["price"])
+        row["user"] = row.pop("user_id")
+        yield row
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+# This is a file like object which returns the value that is written to it instead of storing it
+# it lets the csv.writer build a single line that we can yield right away
+# refer: https://docs.djangoproject.com/en/5.1/howto/outputting-csv/#streaming-large-csv-files
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(Echo(), fieldnames=EXPORT_FIELDS)
+    yield writer.writerow(dict(zip(EXPORT_FIELDS, EXPORT_FIELDS)))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def export_lines(queryset, export_format, chunk_size=CHUNK_SIZE):
+    rows = export_rows(queryset, chunk_size=chunk_size)
+    if export_format == "csv":
+        return csv_lines(rows)
+    return ndjson_lines(rows)
@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.exports import CHUNK_SIZE, EXPORT_FORMATS, export_lines
+from products.models import Product
+
+
+# This command streams the products into a file or to the stdout
+# usage: python manage.py export_products --type csv --output products.csv [--user someone@example.com]
+class Command(BaseCommand):
+    help = "Exports the products as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=list(EXPORT_FORMATS), default="ndjson")
+        parser.add_argument("--output", help="The file to write to, the stdout is used if not given")
+        parser.add_argument(
+            "--user",
+            help="Export only the products this user can see (email), all the products are exported if not given",
+        )
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        # The same visibility rules as the UserQuerySetMixin
+        queryset = Product.objects.all()
+        if options["user"]:
+            User = get_user_model()
+            try:
+                user = User.objects.get(email=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+            if not user.is_superuser:
+                queryset = queryset.filter(user=user)
+
+        lines = export_lines(queryset, options["type"], chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+
+# This command fixes the product_count of the users (refer: accounts.models.CustomUser.product_count)
+# when it does not match the real number of their products, like after products were written with raw SQL
+# or with a queryset.update() of their owner which does not send any signal
+# usage: python manage.py reconcile_product_counts [--dry-run]
+class Command(BaseCommand):
+    help = "Sets the product_count of the users to the real number of their products"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only list the users whose count is wrong"
+        )
+
+    def handle(self, *args, **options):
+        drifted = get_user_model().objects.reconcile_product_counts(dry_run=options["dry_run"])
+        for pk, stored, real in drifted:
+            self.stdout.write(f"user {pk}: {stored} -> {real}")
+        verb = "would be fixed" if options["dry_run"] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} product counts {verb}"))
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:30
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+# The products created before this migration can have titles that differ only by case,
+# the duplicates are renamed (the id is appended to the title) so that the unique index can be created
+def rename_duplicate_titles(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    seen = set()
+    qs = Product.objects.annotate(title_lower=Lower('title')).order_by('id')
+    for product in qs.iterator():
+        if product.title_lower in seen:
+            suffix = f" ({product.pk})"
+            product.title = product.title[:120 - len(suffix)] + suffix
+            product.save(update_fields=['title'])
+        seen.add(product.title_lower)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_titles, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('title'), name='product_title_lower_unique'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Case, Q, When
+from django.db.models.functions import Lower
+from search import fts, trigram
 
 # Create your models here.
 # This is how we actually import the user model
@@ -19,24 +21,61 @@ class ProductQuerySet(models.QuerySet):
     def is_public(self):
         return self.filter(public=True)
 
+    # This function returns the products that the user can see: the public ones and his own ones
+    # It is a single OR predicate so that the database can answer it with the (public, id) and (user, id) indexes
+    # (SQLite runs one index search per side of the OR and merges the rowids) and no DISTINCT is needed.
+    # public__in=[True] is used instead of public=True because Django writes public=True as a bare
+    # WHERE "public" which SQLite cannot look up in an index, the IN is written as "public" IN (1)
+    def visible_to(self, user=None):
+        if user is None:
+            return self.filter(public__in=[True])
+        return self.filter(Q(public__in=[True]) | Q(user=user))
+
     # This is the where the search logic is written while querying the products
-    # this function first filters the products based on the public field and then based on the query
-    # and if the user is present it first filters the query based on the user data
-    # and then it filters it based on the query, so now we have two queries one with the is_public and then query
-    # the other with the user-data and the query, finally we combine them both and then select the disticnt of them that is only select the unique ones
-    # common ones are selected only once.
+    # If the database supports it the search is answered by the full text index of the search app (refer: search/fts.py)
+    # which returns the matching products ranked by relevance, the most relevant ones come first.
+    # Otherwise (or if the query is too short for the index) we fallback to the old way of searching:
+    # the products that the user can see (refer: visible_to) whose title or content contains the query.
+    # Earlier this combined two querysets (the public ones and the user's ones) with | and removed the duplicates
+    # with .distinct(), now the visibility is a single predicate so a product can only match once.
     def search(self, query, user=None):
+        expression = fts.match_expression(query) if fts.is_enabled(self.db) else None
+        if expression is not None:
+            # SQLite allows the MATCH operator only once and not inside an OR, so the match is applied a single time
+            # and the visibility of the product (public or owned by the user) is applied as one predicate on top of it
+            return (
+                self.filter(search_entry__document__match=expression)
+                .visible_to(user)
+                .order_by("search_entry__rank")
+            )
+
         # Here Q is used because - It allows you to build complex queries that include logical operations (AND, OR, and NOT) for combining multiple conditions.
         # here we perform an OR operation because, It checks whether the title contains the query (case-insensitive).
         # OR the content contains the query (case-insensitive).
         lookup = Q(title__icontains=query) | Q(content__icontains=query)
-        qs = self.is_public().filter(lookup)
-        if user is not None:
-            # qs_with_user: Filters records specific to the user (self.filter(user=user)) and applies the lookup condition.
-            qs_with_user = self.filter(user=user).filter(lookup)
-            # .distinct(): Ensures no duplicate records in the final result.
-            qs = (qs | qs_with_user).distinct()
-        return qs
+        return self.visible_to(user).filter(lookup)
+
+    # This is the typo tolerant version of the search, "labtop" finds the laptops (refer: search/trigram.py)
+    # The products whose title is close enough to the query are found through the trigram index of the search app,
+    # the closest ones come first. The query is expected to be normalized (refer: search.cache.normalize_query).
+    # If the database has no trigram index (or the query is too short for it) this is the same as the search above.
+    def fuzzy_search(self, query, user=None):
+        ids = trigram.search_ids(self, query, user=user)
+        if ids is None:
+            return self.search(query, user=user)
+        if not ids:
+            return self.none()
+        # the number of ids is bounded by SEARCH_FUZZY_MAX_CANDIDATES so the CASE stays small
+        position = Case(*[When(pk=pk, then=index) for index, pk in enumerate(ids)])
+        return self.filter(pk__in=ids).order_by(position)
+
+    # This function fetches the owner of every product in the same query (select_related does a JOIN on the user table)
+    # Without this a page of 10 products runs 10+ queries (1 for the user per row)
+    # with this the number of queries stays the same no matter how many rows are in the page.
+    # The total number of products of the owner is stored on the user (refer: accounts.models.CustomUser.product_count),
+    # so it comes with the JOIN, earlier it was counted by a correlated subquery for every row.
+    def with_owner(self):
+        return self.select_related("user")
 
 
 # This is the ProductManager class which is actually used in the Product model inorder to implement the search feature
@@ -57,6 +96,18 @@ class ProductManager(models.Manager):
         # Here the self.get_queryset() return the ProductQuerySet instace
         return self.get_queryset().search(query, user=user)
 
+    # This function uses the fuzzy_search function that is defined inside the ProductQuerySet
+    def fuzzy_search(self, query, user=None):
+        return self.get_queryset().fuzzy_search(query, user=user)
+
+    # This function uses the with_owner function that is defined inside the ProductQuerySet
+    def with_owner(self):
+        return self.get_queryset().with_owner()
+
+    # This function uses the visible_to function that is defined inside the ProductQuerySet
+    def visible_to(self, user=None):
+        return self.get_queryset().visible_to(user)
+
 
 class Product(models.Model):
     # pk -> default primary_key which is an integer
@@ -65,11 +116,35 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=15, decimal_places=2, default=00.00)
     public = models.BooleanField(default=True)
     # creating a user field in the products table
-    user = models.ForeignKey(User, default=1, null=True, on_delete=models.SET_NULL)
+    # The index of the foreign key is replaced by the (user, id) index below which also answers the lookups by user
+    user = models.ForeignKey(User, default=1, null=True, on_delete=models.SET_NULL, db_index=False)
+    # The last time the data shown for this product changed. auto_now sets it on every save(), the bulk updates and the
+    # changes of the owner set it themselves (refer: ProductBulkAPIView.update and products/signals.py)
+    # The index finds the products changed since a given time without scanning the table, the ETag and Last-Modified
+    # of the responses do not read it (refer: api/mixins.ConditionalGetMixin)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     # This is how we link the ProductManager with the Product model
     objects = ProductManager()
 
+    class Meta:
+        # These indexes back the keyset pagination (refer: api/pagination.py) which orders the rows by (field, id)
+        # and seeks to the position of the last row of the previous page instead of using OFFSET
+        indexes = [
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["title", "id"], name="product_title_id_idx"),
+            # These indexes back the visibility filters: the public products (refer: ProductQuerySet.visible_to)
+            # and the products of a user (refer: ProductQuerySet.visible_to and api/mixins.UserQuerySetMixin),
+            # the id in them keeps the rows of a user in id order for the pagination
+            models.Index(fields=["public", "id"], name="product_public_id_idx"),
+            models.Index(fields=["user", "id"], name="product_user_id_idx"),
+        ]
+        constraints = [
+            # The titles of the products are unique without considering the case ("Laptop" and "laptop" are the same)
+            # this creates a unique index on LOWER(title) which is also used by the title lookups of the serializers
+            models.UniqueConstraint(Lower("title"), name="product_title_lower_unique"),
+        ]
+
     # the @property creates a new field named sale_price, that returns the operation we have performed in it
     @property
     def sale_price(self):
@@ -1,8 +1,12 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from rest_framework.reverse import reverse
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
 from .models import Product
-from .validators import validate_title, unique_product_title
-from api.serializers import UserPublicSerialzer
+from .validators import lower_in_db, title_exists
+from api.serializers import UserPublicSerialzer, user_public_data
 
 # Here we define a serializer for the Product model that actually serializers and provides validation to the data
 
@@ -31,8 +35,10 @@ class ProductSerializer(serializers.ModelSerializer):
     )
 
     # Other way of adding a custom validation is this
-    # This is how we add multiple validators to a field in the serializer before saving it to DB
-    title = serializers.CharField(validators=[validate_title, unique_product_title])
+    # This is how we add multiple validators to a field in the serializer before saving it to DB => validators=[...]
+    # The uniqueness of the title is checked only once by the validate_title function below,
+    # since it needs to know which product is being updated so that its own title is not treated as a duplicate
+    title = serializers.CharField(max_length=120)
 
     class Meta:
         model = Product
@@ -48,14 +54,38 @@ class ProductSerializer(serializers.ModelSerializer):
             "owner",
         ]
 
+    # The serializer can render only some of its fields (refer: api/mixins.SparseFieldsMixin), the fields that are
+    # not in the fields argument are removed so that their work (the reverse() of the urls, the owner) is never done
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    # Returns the queryset that loads only what the given fields need (all of them when fields is None)
+    # The owner is joined and counted only for the owner field and the content (a TextField) is only loaded for the content field,
+    # the id, title and price are always loaded because the keyset pagination orders by them (refer: api/pagination.py)
+    @classmethod
+    def select_queryset(cls, queryset, fields=None):
+        if fields is None:
+            return queryset.with_owner()
+        columns = ["id", "title", "price"]
+        if "content" in fields:
+            columns.append("content")
+        if "owner" in fields:
+            queryset = queryset.with_owner()
+            # only the columns of the user that the UserPublicSerialzer shows
+            columns += ["user__id", "user__username", "user__product_count"]
+        return queryset.only(*columns)
+
     # Customized validation function for serialzier fields
     # if you need to validate the title field of a serializer before saving it to the DB
     # This is the format of the function validate_<field-name-to-validate>(self, value)
     def validate_title(self, value):
-        # This is a queryset which is used to fetch the products that matches with the title we provided
-        # iexact means it is case insensitive
-        qs = Product.objects.filter(title__iexact=value)
-        if qs.exists():
+        # This runs a single query which looks for the products that matches with the title we provided
+        # without considering the case, using the unique index on LOWER(title) (refer: validators.title_exists)
+        exclude_pk = self.instance.pk if isinstance(self.instance, Product) else None
+        if title_exists(value, exclude_pk=exclude_pk):
             raise serializers.ValidationError(f"{value} is already a product name")
         return value
 
@@ -70,7 +100,13 @@ class ProductSerializer(serializers.ModelSerializer):
         if request is None:
             return None
         validated_data["user"] = request.user
-        return super().create(validated_data)
+        # Two requests with the same title can pass the validation at the same time,
+        # then the unique index rejects the second one and we return the same error as the validation
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise self.duplicate_title_error(title)
 
     # Customized update function
     def update(self, instance, validated_data):
@@ -81,9 +117,16 @@ class ProductSerializer(serializers.ModelSerializer):
         if not instance.content:
             # If the saved data didnt have the content in it then we update the content with the title text
             instance.content = instance.title
-        instance.save()
+        try:
+            with transaction.atomic():
+                instance.save()
+        except IntegrityError:
+            raise self.duplicate_title_error(instance.title)
         return instance
 
+    def duplicate_title_error(self, title):
+        return serializers.ValidationError({"title": [f"{title} is already a product name"]})
+
     # Now define the function that actually decides what value must be returned to the edit_url field
     def get_edit_url(self, obj):
         # this is how you access the request object in a serializer
@@ -108,3 +151,152 @@ class ProductSerializer(serializers.ModelSerializer):
             return None
         # The obj.get_discount() call likely refers to a method defined in the Product model that calculates the discount for the product.
         return obj.get_discount()
+
+
+# This is the compiled read only version of the ProductSerializer that is used to render the lists of products
+# The ProductSerializer runs the whole DRF field machinery for every row: the HyperlinkedIdentityField and get_edit_url
+# call reverse() per row, the SerializerMethodFields are dispatched per row and the nested UserPublicSerialzer
+# is a serializer of its own. This one reads the plain values() rows of ProductQuerySet.with_owner(),
+# the urls are reversed once per request and only the pk is put in them for every row.
+# The output is exactly the same as ProductSerializer(many=True).data, so keep both in sync when a field changes
+# (the tests of products/tests.py compare them).
+# Like the ProductSerializer it can render only some of the fields (refer: api/mixins.SparseFieldsMixin),
+# then only the columns of those fields are read.
+class CompiledProductSerializer:
+    # The columns of the values() rows this serializer reads
+    values_fields = (
+        "id",
+        "title",
+        "content",
+        "price",
+        "user_id",
+        "user__username",
+        "user__product_count",
+    )
+    # The columns that are read only for some of the fields, the others are always read (the keyset pagination orders by them)
+    field_values = {
+        "content": ("content",),
+        "owner": ("user_id", "user__username", "user__product_count"),
+    }
+    # Any pk works here, it is replaced by the pk of every row
+    placeholder_pk = 987654321
+    price_quantum = Decimal("0.01")
+
+    def __init__(self, request, fields=None):
+        self.request = request
+        self.fields = fields
+        if fields is not None:
+            skipped = {
+                column
+                for name, columns in self.field_values.items()
+                if name not in fields
+                for column in columns
+            }
+            self.values_fields = tuple(name for name in self.values_fields if name not in skipped)
+        # the urls are reversed only when they are shown
+        self.url = self.get_url_template("product-detail") if self.shows("url") else None
+        self.edit_url = self.get_url_template("product-edit") if self.shows("edit_url") else None
+        # get_discount() does not depend on the product, so it is computed once instead of once per row
+        self.discount = Product().get_discount()
+
+    def shows(self, name):
+        return self.fields is None or name in self.fields
+
+    # Returns (prefix, suffix) of the absolute url of the given view, the url of a product is prefix + pk + suffix
+    def get_url_template(self, view_name):
+        url = reverse(view_name, kwargs={"pk": self.placeholder_pk}, request=self.request)
+        prefix, _, suffix = url.partition(str(self.placeholder_pk))
+        return prefix, suffix
+
+    def get_rows(self, queryset):
+        return queryset.values(*self.values_fields)
+
+    def to_representation(self, rows):
+        if self.fields is not None:
+            return self.to_sparse_representation(rows)
+        url_prefix, url_suffix = self.url
+        edit_prefix, edit_suffix = self.edit_url
+        discount = self.discount
+        quantum = self.price_quantum
+        data = []
+        for row in rows:
+            pk = row["id"]
+            price = row["price"]
+            data.append(
+                {
+                    "id": pk,
+                    "url": f"{url_prefix}{pk}{url_suffix}",
+                    "edit_url": f"{edit_prefix}{pk}{edit_suffix}",
+                    "title": row["title"],
+                    "content": row["content"],
+                    # the same formatting as the DecimalField of DRF and the Product.sale_price property
+                    "price": "{:f}".format(price.quantize(quantum)),
+                    "sale_price": "%.2f" % (float(price) * 0.6),
+                    "my_discount": discount,
+                    "owner": user_public_data(
+                        row["user_id"], row["user__username"], row["user__product_count"]
+                    ),
+                }
+            )
+        return data
+
+    # The same output as to_representation but only with the selected fields, every field is computed by its own function
+    def to_sparse_representation(self, rows):
+        getters = [(name, self.get_field_getter(name)) for name in self.fields]
+        return [{name: getter(row) for name, getter in getters} for row in rows]
+
+    def get_field_getter(self, name):
+        if name in ("url", "edit_url"):
+            prefix, suffix = getattr(self, name)
+            return lambda row: f"{prefix}{row['id']}{suffix}"
+        if name == "price":
+            quantum = self.price_quantum
+            return lambda row: "{:f}".format(row["price"].quantize(quantum))
+        if name == "sale_price":
+            return lambda row: "%.2f" % (float(row["price"]) * 0.6)
+        if name == "my_discount":
+            discount = self.discount
+            return lambda row: discount
+        if name == "owner":
+            return lambda row: user_public_data(
+                row["user_id"], row["user__username"], row["user__product_count"]
+            )
+        return lambda row: row[name]
+
+
+# This serializer validates a single item of the bulk endpoints (refer: ProductBulkAPIView)
+# Unlike the ProductSerializer it has no validators that hit the db for every item,
+# the uniqueness of the titles is checked once for the whole batch by find_title_conflicts()
+class ProductBulkItemSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = Product
+        fields = ["id", "title", "content", "price", "public"]
+
+
+# This function checks the titles of a whole batch of products against each other and against the db with a query
+# which is answered by the unique index on LOWER(title) (refer: Product.Meta.constraints)
+# titles is a list of (product id or None, title) tuples, the id is given for the products that are being updated
+# returns the positions of the titles which are already used by another product
+def find_title_conflicts(titles):
+    # the titles are lowered by the db like the index does, a title that python lowers differently would pass the check
+    # and then break the write with an IntegrityError
+    lowered = list(zip((pk for pk, _ in titles), lower_in_db([title for _, title in titles])))
+    existing = {}
+    qs = Product.objects.annotate(title_lower=Lower("title")).filter(
+        title_lower__in={title for _, title in lowered}
+    )
+    for pk, title in qs.values_list("pk", "title_lower"):
+        existing.setdefault(title, set()).add(pk)
+
+    conflicts = set()
+    seen = set()
+    for position, (pk, title) in enumerate(lowered):
+        # A product may keep its own title, but it cannot take the current title of another product even if that
+        # product is renamed in the same batch, because the unique index is checked row by row during the update
+        owners = existing.get(title, set()) - {pk}
+        if owners or title in seen:
+            conflicts.add(position)
+        seen.add(title)
+    return conflicts
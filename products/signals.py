@@ -0,0 +1,100 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.cache import response_cache
+from .models import Product
+
+User = get_user_model()
+
+
+# These are the signal receivers that keep the cached product responses fresh (refer: api/cache.py)
+# A product write makes the responses of its owner stale, and also the responses of the superusers who see every product.
+# Admin saves, serializer saves and ProductDeleteAPIView.destroy all go through Model.save()/Model.delete() so they are covered here,
+# bulk operations that skip the signals (queryset.update(), bulk_create()) must call response_cache.invalidate_owners() themselves.
+# The versions are bumped again once the transaction is committed (refer: ResponseCache.invalidate), a read that
+# did not see the write yet could have cached the old data in between.
+# They also keep the product_count of the owners (refer: accounts.models.CustomUser.product_count), the bulk operations
+# must call User.objects.adjust_product_counts() themselves, the reconcile_product_counts command fixes any count they missed.
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_owner(sender, instance, **kwargs):
+    # If the owner of the product is changed, the old owner's responses must also be invalidated
+    instance._previous_user_id = None
+    if not instance._state.adding and instance.pk is not None:
+        instance._previous_user_id = (
+            Product.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def invalidate_on_product_save(sender, instance, **kwargs):
+    response_cache.invalidate_owners(
+        instance.user_id, getattr(instance, "_previous_user_id", None)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_on_product_delete(sender, instance, **kwargs):
+    response_cache.invalidate_owners(instance.user_id)
+
+
+# A new product counts for its owner, and a product that changed hands moves from the count of the old owner to the new one
+# The count is changed by an UPDATE in the db, the owner loaded on the product (like the request.user of the create)
+# is refreshed so that the response shows the new count.
+@receiver(post_save, sender=Product)
+def count_product_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_user_id", None)
+    if created:
+        User.objects.adjust_product_counts({instance.user_id: 1})
+    elif previous != instance.user_id:
+        User.objects.adjust_product_counts({previous: -1, instance.user_id: 1})
+    else:
+        return
+    if instance.user_id is not None and Product.user.is_cached(instance):
+        instance.user.refresh_from_db(fields=["product_count"])
+
+
+# queryset.delete() also sends this signal for every product it deletes
+# The products of a deleted user are not deleted (on_delete=SET_NULL), they stop counting with the user row itself
+@receiver(post_delete, sender=Product)
+def count_product_on_delete(sender, instance, **kwargs):
+    User.objects.adjust_product_counts({instance.user_id: -1})
+
+
+# The owner details (username) are a part of every product response, so a change in the user also makes them stale
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_on_owner_change(sender, instance, update_fields=None, **kwargs):
+    # a login only updates the last_login of the user which is not shown anywhere
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    response_cache.invalidate_owners(instance.pk)
+
+
+# The username of the owner is shown in every product, so the updated_at of the products must change with it
+@receiver(pre_save, sender=User)
+def remember_previous_username(sender, instance, update_fields=None, **kwargs):
+    instance._previous_username = None
+    # a save that does not write the username (like the last_login update of a login) cannot change it
+    if update_fields is not None and "username" not in update_fields:
+        return
+    if not instance._state.adding and instance.pk is not None:
+        instance._previous_username = (
+            User.objects.filter(pk=instance.pk).values_list("username", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=User)
+def touch_products_on_username_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_username", None)
+    if not created and previous is not None and previous != instance.username:
+        Product.objects.filter(user=instance).update(updated_at=timezone.now())
+
+
+# The products of a deleted user lose their owner with an UPDATE that does not touch updated_at
+@receiver(pre_delete, sender=User)
+def touch_products_on_owner_delete(sender, instance, **kwargs):
+    Product.objects.filter(user=instance).update(updated_at=timezone.now())
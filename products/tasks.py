@@ -0,0 +1,31 @@
+from django.http import HttpRequest
+from rest_framework.request import Request
+
+from jobs.registry import task
+
+
+# Runs a bulk update of the products in the background (refer: ProductBulkAPIView.update with ?background=true)
+# The items are written in chunks by the same code as the request, with the user who enqueued the job,
+# and the progress of the job is the number of items done. Writing the same values again does not change anything,
+# so a retried job can safely run the chunks that were already written.
+@task("products.bulk_update")
+def bulk_update(job, items, partial=False, chunk_size=500):
+    from .views import ProductBulkAPIView
+
+    if job.user is None:
+        raise ValueError("The user who enqueued the bulk update does not exist anymore")
+    request = Request(HttpRequest())
+    request.user = job.user
+    view = ProductBulkAPIView(request=request, format_kwarg=None, args=(), kwargs={})
+
+    updated = 0
+    errors = []
+    job.set_progress(0, total=len(items))
+    for start in range(0, len(items), chunk_size):
+        results, _, products = view.update_items(items[start : start + chunk_size], partial)
+        updated += len(products)
+        for position, result in enumerate(results, start):
+            if result is not None and result["status"] == "error":
+                errors.append({"position": position, "errors": result["errors"]})
+        job.set_progress(min(start + chunk_size, len(items)))
+    return {"updated": updated, "errors": errors}
@@ -1,3 +1,913 @@
+import base64
+import csv
+import json
+import tempfile
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpRequest
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import token_user_cache
+
+from .models import Product
+from .serializers import CompiledProductSerializer, ProductSerializer
+from .validators import title_exists
+from .views import ProductBulkAPIView
+
+User = get_user_model()
+
 
 # Create your tests here.
+class ProductQueryBudgetTests(TestCase):
+    '''
+    The number of queries needed to render a page of products must not grow with the page size
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.other = User.objects.create_user(
+            email="other@example.com", username="other", password="pass12345"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_products(self, count):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            Product.objects.create(
+                title=f"product {i}",
+                content="some content",
+                price="10.00",
+                user=self.admin if i % 2 else self.other,
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_constant_queries(self, url):
+        self.create_products(2)
+        small_page = self.count_queries(url)
+        self.create_products(8)
+        large_page = self.count_queries(url)
+        self.assertEqual(small_page, large_page)
+        # one query for the count of the pagination and one for the page itself
+        self.assertLessEqual(large_page, 2)
+
+    def test_product_list_query_budget(self):
+        self.assert_constant_queries(reverse("product-list"))
+
+    def test_product_viewset_list_query_budget(self):
+        self.assert_constant_queries(reverse("products-list"))
+
+    def test_search_query_budget(self):
+        self.assert_constant_queries(reverse("product-search") + "?query=product")
+
+    def test_owner_total_products(self):
+        self.create_products(5)
+        response = self.client.get(reverse("product-list"))
+        totals = {
+            row["owner"]["username"]: row["owner"]["total_products"]
+            for row in response.json()["results"]
+        }
+        self.assertEqual(totals, {"admin": 2, "other": 3})
+
+    def test_product_detail_query_budget(self):
+        self.create_products(1)
+        product = Product.objects.get()
+        url = reverse("product-detail", kwargs={"pk": product.pk})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()["owner"]["total_products"], 1)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        # a lot of products share the same price so that the id is needed to break the ties
+        for i in range(25):
+            Product.objects.create(title=f"product {i:02d}", price=i % 3, user=self.admin)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            # a single query for the page, no COUNT(*) query like the LimitOffsetPagination
+            self.assertEqual(len(ctx.captured_queries), 1)
+            data = response.json()
+            ids += [row["id"] for row in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_limit_offset_is_still_the_default(self):
+        response = self.client.get(reverse("product-list"))
+        self.assertEqual(response.json()["count"], 25)
+
+    def test_walk_by_price(self):
+        ids = self.walk(reverse("product-list") + "?pagination=keyset&ordering=price")
+        expected = list(
+            Product.objects.order_by("price", "id").values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_walk_default_ordering(self):
+        ids = self.walk(reverse("products-list") + "?pagination=keyset&limit=7")
+        expected = list(Product.objects.order_by("-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_page(self):
+        url = reverse("product-list") + "?pagination=keyset&ordering=-price"
+        first = self.client.get(url).json()
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("product-list") + "?cursor=garbage")
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_value_must_fit_the_ordering(self):
+        for ordering, value in (("price", "cheap"), ("price", None), ("price", [1]), ("id", "abc"), ("title", {"a": 1})):
+            data = {"o": ordering, "v": value, "i": 1, "r": False}
+            cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+            response = self.client.get(reverse("product-list") + f"?cursor={cursor}")
+            self.assertEqual(response.status_code, 404, data)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.staff = User.objects.create_user(
+            email="staff@example.com", username="staff", password="pass12345", is_staff=True
+        )
+        self.staff.user_permissions.set(
+            Permission.objects.filter(content_type__app_label="products")
+        )
+        self.product = Product.objects.create(title="admin product", user=self.admin)
+        Product.objects.create(title="staff product", user=self.staff)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.list_url = reverse("product-list")
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.client.get(self.list_url)
+        self.assertEqual(first["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            second = self.client.get(self.list_url)
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.json(), second.json())
+
+    def test_scopes_are_separate(self):
+        self.assertEqual(self.client.get(self.list_url).json()["count"], 2)
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(self.list_url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["count"], 1)
+
+    def test_create_invalidates(self):
+        self.client.get(self.list_url)
+        self.client.post(self.list_url, {"title": "new product", "price": "1.00"})
+        response = self.client.get(self.list_url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_update_and_delete_invalidate_detail(self):
+        detail_url = reverse("product-detail", kwargs={"pk": self.product.pk})
+        self.client.get(detail_url)
+        self.client.put(
+            reverse("product-edit", kwargs={"pk": self.product.pk}),
+            {"title": "renamed product", "price": "1.00"},
+        )
+        self.assertEqual(self.client.get(detail_url).json()["title"], "renamed product")
+        self.client.delete(reverse("product-delete", kwargs={"pk": self.product.pk}))
+        self.assertEqual(self.client.get(detail_url).status_code, 404)
+
+    def test_reads_before_the_commit_are_invalidated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = "renamed product"
+            self.product.save()
+            # stands for a read of another connection that does not see the write yet, it is cached with the new version
+            self.client.get(self.list_url)
+            self.assertEqual(self.client.get(self.list_url)["X-Cache"], "HIT")
+        self.assertEqual(self.client.get(self.list_url)["X-Cache"], "MISS")
+
+    def test_other_owners_write_keeps_cache(self):
+        self.client.force_authenticate(self.staff)
+        self.client.get(self.list_url)
+        Product.objects.create(title="another admin product", user=self.admin)
+        self.assertEqual(self.client.get(self.list_url)["X-Cache"], "HIT")
+
+    def test_owner_reassignment_invalidates_old_owner(self):
+        self.client.force_authenticate(self.staff)
+        self.client.get(self.list_url)
+        staff_product = Product.objects.get(user=self.staff)
+        staff_product.user = self.admin
+        staff_product.save()
+        self.assertEqual(self.client.get(self.list_url).json()["count"], 0)
+
+    def test_cache_stats(self):
+        self.client.get(self.list_url)
+        self.client.get(self.list_url)
+        stats = self.client.get(reverse("cache-stats")).json()["responses"]
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["misses"], 1)
+
+
+class ProductBulkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse("product-bulk")
+
+    def test_bulk_create(self):
+        Product.objects.create(title="Existing", user=self.admin)
+        response = self.client.post(
+            self.url,
+            [
+                {"title": "first", "price": "1.00"},
+                {"title": "FIRST", "price": "2.00"},
+                {"title": "existing", "price": "3.00"},
+                {"price": "4.00"},
+                {"title": "second", "content": "text"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 207)
+        statuses = [result["status"] for result in response.json()]
+        self.assertEqual(statuses, ["created", "error", "error", "error", "created"])
+        first = response.json()[0]["data"]
+        self.assertEqual(first["content"], "first")
+        self.assertEqual(first["owner"]["total_products"], 3)
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_bulk_create_query_count_does_not_grow(self):
+        def create(prefix, count):
+            items = [{"title": f"{prefix} {i}", "price": "1.00"} for i in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.url, items, format="json")
+            self.assertEqual(response.status_code, 201)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(create("small", 5), create("large", 50))
+
+    def test_bulk_update(self):
+        one = Product.objects.create(title="one", user=self.admin)
+        two = Product.objects.create(title="two", user=self.admin)
+        Product.objects.create(title="three", user=self.admin)
+        response = self.client.patch(
+            self.url,
+            [
+                {"id": one.pk, "title": "ONE", "content": "renamed"},
+                {"id": two.pk, "price": "9.99"},
+                {"id": one.pk + 1000, "title": "missing"},
+                {"id": two.pk, "title": "three"},
+                {"id": two.pk, "title": "one"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 207)
+        statuses = [result["status"] for result in response.json()]
+        self.assertEqual(statuses, ["updated", "updated", "error", "error", "error"])
+        one.refresh_from_db()
+        two.refresh_from_db()
+        self.assertEqual((one.title, one.content), ("ONE", "renamed"))
+        self.assertEqual((two.title, str(two.price)), ("two", "9.99"))
+
+    def test_bulk_update_only_own_products(self):
+        other = User.objects.create_user(
+            email="staff@example.com", username="staff", password="pass12345", is_staff=True
+        )
+        other.user_permissions.set(Permission.objects.filter(content_type__app_label="products"))
+        product = Product.objects.create(title="admin product", user=self.admin)
+        self.client.force_authenticate(other)
+        response = self.client.put(
+            self.url, [{"id": product.pk, "title": "stolen"}], format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        product.refresh_from_db()
+        self.assertEqual(product.title, "admin product")
+
+    def test_bulk_delete(self):
+        one = Product.objects.create(title="one", user=self.admin)
+        two = Product.objects.create(title="two", user=self.admin)
+        response = self.client.delete(self.url, [one.pk, two.pk, 0, "x"], format="json")
+        self.assertEqual(response.status_code, 207)
+        statuses = [result["status"] for result in response.json()]
+        self.assertEqual(statuses, ["deleted", "deleted", "error", "error"])
+        self.assertFalse(Product.objects.exists())
+
+    def test_update_fields_limit_the_bulk_update(self):
+        product = Product.objects.create(title="one", price="1.00", user=self.admin)
+        request = Request(HttpRequest())
+        request.user = self.admin
+        view = ProductBulkAPIView(request=request, format_kwarg=None, args=(), kwargs={}, update_fields=["price"])
+        view.update_items([{"id": product.pk, "title": "two", "price": "2.00"}], partial=True)
+        product.refresh_from_db()
+        self.assertEqual((product.title, str(product.price)), ("one", "2.00"))
+
+    def test_not_a_list(self):
+        response = self.client.post(self.url, {"title": "one"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductTitleUniquenessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.product = Product.objects.create(title="Laptop", user=self.admin)
+
+    def test_duplicate_title_is_rejected_with_one_lookup(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("product-list"), {"title": "LAPTOP"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("title", response.json())
+        title_lookups = [q for q in ctx.captured_queries if "LOWER" in q["sql"]]
+        self.assertEqual(len(title_lookups), 1)
+
+    def test_title_lookup_uses_the_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            title_exists("laptop")
+        sql = ctx.captured_queries[0]["sql"]
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("product_title_lower_unique", plan)
+
+    def test_bulk_titles_are_lowered_like_the_index(self):
+        Product.objects.create(title="Écran", user=self.admin)
+        url = reverse("product-bulk")
+        response = self.client.post(url, [{"title": "Écran"}, {"title": "LAPTOP"}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result["status"] for result in response.json()], ["error", "error"])
+        # the LOWER() of SQLite only lowers the ASCII letters, so the index sees two different titles
+        response = self.client.post(url, [{"title": "écran"}], format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_update_keeps_own_title(self):
+        response = self.client.put(
+            reverse("product-edit", kwargs={"pk": self.product.pk}),
+            {"title": "laptop", "content": "new content"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_constraint_error_is_a_clean_400(self):
+        request = APIRequestFactory().post(reverse("product-list"))
+        request.user = self.admin
+        serializer = ProductSerializer(data={"title": "Phone"}, context={"request": request})
+        self.assertTrue(serializer.is_valid())
+        # another request creates the same title after the validation has passed
+        Product.objects.create(title="phone", user=self.admin)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+
+    def test_database_rejects_duplicates(self):
+        with self.assertRaises(IntegrityError):
+            Product.objects.create(title="LAPTOP", user=self.admin)
+
+
+class ProductExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass12345"
+        )
+        self.staff = User.objects.create_user(
+            email="staff@example.com", username="staff", password="pass12345", is_staff=True
+        )
+        self.staff.user_permissions.set(
+            Permission.objects.filter(content_type__app_label="products")
+        )
+        Product.objects.create(title="admin product", price="1.50", user=self.admin)
+        Product.objects.create(title="staff, product", content='say "hi"', user=self.staff)
+        self.client = APIClient()
+        self.url = reverse("product-export")
+
+    def test_ndjson_export(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row["title"] for row in rows], ["admin product", "staff, product"])
+        self.assertEqual(rows[0]["price"], "1.50")
+
+    def test_csv_export_is_limited_to_own_products(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(self.url + "?type=csv")
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["title"], "staff, product")
+        self.assertEqual(rows[0]["content"], 'say "hi"')
+
+    def test_unknown_type(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(self.url + "?type=xml").status_code, 400)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command("export_products", "--user", "staff@example.com", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+
+class AsyncProductViewTests(TestCase):
+    '''
+    The async views must return exactly the same responses as their DRF versions
+    '''
+
+    def setUp(self):
+        cache.clear()
+        token_user_cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password=None
+        )
+        self.staff = User.objects.create_user(
+            email="staff@example.com", username="staff", password=None, is_staff=True
+        )
+        # the IsStaffEditorPermission needs the add permission for a GET request
+        self.staff.user_permissions.add(Permission.objects.get(codename="add_product"))
+        for i in range(15):
+            Product.objects.create(
+                title=f"product {i}",
+                content="some content",
+                price="10.00",
+                user=self.admin if i % 3 else self.staff,
+            )
+        self.headers = {"Authorization": f"Bearer {Token.objects.create(user=self.admin).key}"}
+
+    def assert_same_response(self, sync_url, async_url, headers=None):
+        headers = self.headers if headers is None else headers
+        expected = self.client.get(sync_url, headers=headers)
+        response = async_to_sync(self.async_client.get)(async_url, headers=headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        # only the path of the next/previous links is different
+        content = response.content.decode().replace("/async/", "/")
+        self.assertEqual(json.loads(content), expected.json())
+        return response
+
+    def test_list(self):
+        self.assert_same_response(reverse("product-list"), reverse("product-list-async"))
+        query = "?limit=5&offset=5"
+        response = self.assert_same_response(
+            reverse("product-list") + query, reverse("product-list-async") + query
+        )
+        self.assertEqual(len(response.json()["results"]), 5)
+
+    def test_detail(self):
+        pk = Product.objects.first().pk
+        self.assert_same_response(
+            reverse("product-detail", args=[pk]), reverse("product-detail-async", args=[pk])
+        )
+        self.assert_same_response(
+            reverse("product-detail", args=[0]), reverse("product-detail-async", args=[0])
+        )
+
+    def test_staff_only_sees_his_products(self):
+        headers = {"Authorization": f"Bearer {Token.objects.create(user=self.staff).key}"}
+        response = self.assert_same_response(
+            reverse("product-list"), reverse("product-list-async"), headers=headers
+        )
+        self.assertEqual(response.json()["count"], 5)
+        other = Product.objects.filter(user=self.admin).first().pk
+        self.assert_same_response(
+            reverse("product-detail", args=[other]),
+            reverse("product-detail-async", args=[other]),
+            headers=headers,
+        )
+
+    def test_jwt(self):
+        self.admin.set_password("pass12345")
+        self.admin.save()
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"email": "admin@example.com", "password": "pass12345"}
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access']}"}
+        self.assert_same_response(
+            reverse("product-list"), reverse("product-list-async"), headers=headers
+        )
+
+    def test_session(self):
+        self.client.force_login(self.admin)
+        self.async_client.cookies = self.client.cookies
+        self.assert_same_response(reverse("product-list"), reverse("product-list-async"), headers={})
+
+    def test_rejected_requests(self):
+        self.assert_same_response(reverse("product-list"), reverse("product-list-async"), headers={})
+        self.assert_same_response(
+            reverse("product-list"),
+            reverse("product-list-async"),
+            headers={"Authorization": "Bearer invalid"},
+        )
+        no_perms = User.objects.create_user(
+            email="noperms@example.com", username="noperms", password=None, is_staff=True
+        )
+        headers = {"Authorization": f"Bearer {Token.objects.create(user=no_perms).key}"}
+        self.assert_same_response(
+            reverse("product-list"), reverse("product-list-async"), headers=headers
+        )
+
+
+class CompiledSerializerTests(TestCase):
+    '''
+    The CompiledProductSerializer must render exactly the same json as the ProductSerializer
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password=None
+        )
+        prices = ["0.00", "0.10", "9.99", "12345.50", "1000000.01"]
+        for i, price in enumerate(prices):
+            Product.objects.create(title=f"laptop {i}", content=f"content {i}", price=price, user=self.admin)
+        Product.objects.create(title="laptop without content", content=None, price="3.33", user=self.admin)
+        Product.objects.create(title="laptop without owner", content="", price="1.00", user=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_same_data_as_product_serializer(self):
+        request = Request(APIRequestFactory().get("/api/products/"))
+        qs = Product.objects.with_owner().order_by("pk")
+        compiled = CompiledProductSerializer(request)
+        expected = ProductSerializer(qs, many=True, context={"request": request}).data
+        self.assertEqual(
+            JSONRenderer().render(compiled.to_representation(compiled.get_rows(qs))),
+            JSONRenderer().render(expected),
+        )
+
+    def assert_same_content(self, url):
+        cache.clear()
+        with self.settings(COMPILED_SERIALIZERS=False):
+            expected = self.client.get(url)
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+
+    def test_list_endpoints(self):
+        self.assert_same_content(reverse("product-list"))
+        self.assert_same_content(reverse("product-list") + "?limit=3&offset=2")
+        self.assert_same_content(reverse("products-list"))
+        self.assert_same_content(reverse("product-search") + "?query=laptop")
+
+    def test_keyset_pagination(self):
+        url = reverse("product-list") + "?pagination=keyset&ordering=price&limit=2"
+        self.assert_same_content(url)
+        next_url = self.client.get(url).json()["next"]
+        self.assertIsNotNone(next_url)
+        self.assert_same_content(next_url)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        # the validators are only sent with a cache shared by the processes
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        shared_cache = override_settings(CACHES={"default": shared})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password=None
+        )
+        self.product = Product.objects.create(title="laptop", content="fast", user=self.admin)
+        Product.objects.create(title="phone", content="small", user=self.admin)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assert_not_modified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        # the products are not loaded, the validators need no query
+        self.assertEqual(len(ctx.captured_queries), 0)
+        return etag
+
+    def test_no_validators_with_a_local_cache(self):
+        with self.settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            response = self.client.get(reverse("product-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+    def test_not_modified(self):
+        self.assert_not_modified(reverse("product-list"))
+        self.assert_not_modified(reverse("product-detail", args=[self.product.pk]))
+        self.assert_not_modified(reverse("products-list"))
+        self.assert_not_modified(reverse("product-search") + "?query=laptop")
+
+    def test_if_modified_since(self):
+        url = reverse("product-detail", args=[self.product.pk])
+        last_modified = self.client.get(url)["Last-Modified"]
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_changes_make_a_new_etag(self):
+        url = reverse("product-list")
+        etag = self.assert_not_modified(url)
+        changes = [
+            lambda: self.client.put(
+                reverse("product-edit", args=[self.product.pk]), {"title": "new laptop"}
+            ),
+            lambda: self.client.patch(
+                reverse("product-bulk"), [{"id": self.product.pk, "price": "1.00"}], format="json"
+            ),
+            lambda: Product.objects.create(title="tablet", user=self.admin),
+            lambda: Product.objects.filter(title="tablet").delete(),
+            self.rename_admin,
+        ]
+        for change in changes:
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+    def rename_admin(self):
+        self.admin.username = "renamed"
+        self.admin.save()
+
+    def test_missing_product(self):
+        response = self.client.get(reverse("product-detail", args=[0]), HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 404)
+        url = reverse("product-detail", args=[self.product.pk])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH="*").status_code, 304)
+
+    def test_validators_per_user_and_renderer(self):
+        url = reverse("product-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertNotEqual(self.client.get(url, HTTP_ACCEPT="text/html")["ETag"], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT="text/html").status_code, 200)
+        other = User.objects.create_superuser(email="other@example.com", username="other", password=None)
+        self.client.force_authenticate(other)
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+
+
+# The query plans of the visibility filters, the test database has no statistics (no ANALYZE)
+# so SQLite picks the plan from the indexes alone
+class VisibilityQueryPlanTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email="owner@example.com", username="owner", password=None)
+        self.other = User.objects.create_user(email="other@example.com", username="other", password=None)
+        Product.objects.create(title="laptop", content="fast", user=self.owner, public=False)
+        Product.objects.create(title="phone", content="small", user=self.other)
+        Product.objects.create(title="tablet", content="flat", user=self.other, public=False)
+
+    def test_visible_products(self):
+        titles = lambda qs: sorted(qs.values_list("title", flat=True))
+        self.assertEqual(titles(Product.objects.visible_to()), ["phone"])
+        self.assertEqual(titles(Product.objects.visible_to(self.owner)), ["laptop", "phone"])
+        # a public product of the user matches both sides of the OR but it is returned once
+        Product.objects.create(title="camera", user=self.owner)
+        self.assertEqual(titles(Product.objects.search("a", user=self.owner)), ["camera", "laptop", "phone"])
+
+    def test_visibility_uses_the_indexes(self):
+        plan = Product.objects.visible_to(self.owner).explain()
+        self.assertIn("product_public_id_idx", plan)
+        self.assertIn("product_user_id_idx", plan)
+        self.assertIn("product_public_id_idx", Product.objects.visible_to().explain())
+
+    def test_search_needs_no_distinct(self):
+        # a query that is too short for the full text index is answered by the icontains fallback
+        qs = Product.objects.search("la", user=self.owner)
+        self.assertFalse(qs.query.distinct)
+        plan = qs.explain()
+        self.assertIn("product_user_id_idx", plan)
+        self.assertNotIn("DISTINCT", plan)
+
+    def test_owner_listing_uses_the_user_index(self):
+        plan = Product.objects.filter(user=self.owner).order_by("id").explain()
+        self.assertIn("product_user_id_idx", plan)
+        # the id in the index keeps the rows in order, no sort is needed
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password=None
+        )
+        for i in range(3):
+            Product.objects.create(title=f"laptop {i}", content=f"content {i}", price="9.99", user=self.admin)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url, compiled=True):
+        cache.clear()
+        with self.settings(COMPILED_SERIALIZERS=compiled):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # the last query loads the rows
+        return response.json(), ctx.captured_queries[-1]["sql"]
+
+    def test_fields(self):
+        for compiled in (True, False):
+            data, sql = self.get(reverse("product-list") + "?fields=id,title,price", compiled=compiled)
+            self.assertEqual(list(data["results"][0]), ["id", "title", "price"])
+            self.assertNotIn('"content"', sql)
+            self.assertNotIn("JOIN", sql)
+            self.assertNotIn("COUNT", sql)
+
+    def test_omit(self):
+        for compiled in (True, False):
+            data, sql = self.get(reverse("product-list") + "?omit=content,owner,url", compiled=compiled)
+            self.assertEqual(
+                list(data["results"][0]),
+                ["id", "edit_url", "title", "price", "sale_price", "my_discount"],
+            )
+            self.assertNotIn('"content"', sql)
+
+    def test_same_data_as_the_full_response(self):
+        full, _ = self.get(reverse("product-list"))
+        for url in (
+            reverse("product-list"),
+            reverse("products-list"),
+            reverse("product-search") + "?query=laptop",
+        ):
+            for compiled in (True, False):
+                data, _ = self.get(url + ("&" if "?" in url else "?") + "fields=title,owner,url", compiled=compiled)
+                expected = [
+                    {name: row[name] for name in ("url", "title", "owner")} for row in full["results"]
+                ]
+                self.assertEqual(data["results"], expected, url)
+
+    def test_detail(self):
+        product = Product.objects.first()
+        data, sql = self.get(reverse("product-detail", args=[product.pk]) + "?fields=id,owner")
+        self.assertEqual(data, {"id": product.pk, "owner": {"id": self.admin.pk, "username": "admin", "total_products": 3}})
+        self.assertNotIn('"content"', sql)
+        self.assertNotIn('"password"', sql)
+
+    def test_keyset_pagination(self):
+        url = reverse("product-list") + "?pagination=keyset&ordering=price&limit=2&fields=id"
+        data, _ = self.get(url)
+        self.assertEqual(len(data["results"]), 2)
+        data, _ = self.get(data["next"])
+        self.assertEqual(list(data["results"][0]), ["id"])
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse("product-list") + "?fields=id,secret&omit=nothing")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"fields", "omit"})
+        response = self.client.get(reverse("product-list") + "?fields=id&omit=id")
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_views(self):
+        # the async views run the real authentications, force_authenticate does not reach them
+        token = Token.objects.create(user=self.admin)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+        for name, async_name, query in (
+            ("product-list", "product-list-async", "?fields=id,title"),
+            ("product-search", "product-search-async", "?query=laptop&omit=owner"),
+            ("product-list", "product-list-async", "?fields=id,secret"),
+        ):
+            cache.clear()
+            expected = self.client.get(reverse(name) + query)
+            response = self.client.get(reverse(async_name) + query)
+            self.assertEqual(response.status_code, expected.status_code, query)
+            if response.status_code == 200:
+                self.assertEqual(response.json()["results"], expected.json()["results"], query)
+            else:
+                self.assertEqual(response.json(), expected.json(), query)
+
+    def test_writes_use_all_the_fields(self):
+        response = self.client.post(reverse("product-list") + "?fields=id", {"title": "phone", "price": "1.00"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["title"], "phone")
+
+
+class ProductCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password=None
+        )
+        self.other = User.objects.create_user(email="other@example.com", username="other", password=None)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assert_counts(self, admin, other):
+        self.assertEqual(
+            dict(User.objects.values_list("username", "product_count")), {"admin": admin, "other": other}
+        )
+
+    def test_create_reassign_delete(self):
+        product = Product.objects.create(title="laptop", user=self.admin)
+        Product.objects.create(title="phone", user=self.admin)
+        Product.objects.create(title="orphan", user=None)
+        self.assert_counts(2, 0)
+        product.user = self.other
+        product.save()
+        self.assert_counts(1, 1)
+        # a save that does not change the owner does not change the counts
+        product.title = "renamed"
+        product.save()
+        self.assert_counts(1, 1)
+        product.delete()
+        self.assert_counts(1, 0)
+        Product.objects.filter(user=self.admin).delete()
+        self.assert_counts(0, 0)
+
+    def test_api_and_bulk_endpoints(self):
+        self.client.post(reverse("product-list"), {"title": "laptop", "price": "1.00"})
+        response = self.client.post(
+            reverse("product-bulk"), [{"title": "phone"}, {"title": "tablet"}], format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assert_counts(3, 0)
+        ids = list(Product.objects.values_list("pk", flat=True)[:2])
+        self.client.delete(reverse("product-bulk"), ids, format="json")
+        self.assert_counts(1, 0)
+
+    def test_delete_with_a_drifted_count(self):
+        product = Product.objects.create(title="laptop", user=self.admin)
+        Product.objects.create(title="phone", user=self.admin)
+        User.objects.filter(pk=self.admin.pk).update(product_count=0)
+        product.delete()
+        self.assert_counts(0, 0)
+        ids = list(Product.objects.values_list("pk", flat=True))
+        self.assertEqual(self.client.delete(reverse("product-bulk"), ids, format="json").status_code, 200)
+        self.assertFalse(Product.objects.exists())
+        self.assert_counts(0, 0)
+
+    def test_owner_delete(self):
+        Product.objects.create(title="laptop", user=self.other)
+        self.other.delete()
+        # the product is kept without an owner (on_delete=SET_NULL) and counts for nobody
+        self.assertIsNone(Product.objects.get().user_id)
+        self.assertEqual(User.objects.get().product_count, 0)
+
+    def test_owner_is_rendered_without_counting(self):
+        Product.objects.create(title="laptop", user=self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("product-list"))
+        self.assertEqual(response.json()["results"][0]["owner"]["total_products"], 1)
+        # the page is loaded without the correlated subquery that counted the products of every owner
+        self.assertNotIn("COUNT", ctx.captured_queries[-1]["sql"])
+        self.assertIn('"product_count"', ctx.captured_queries[-1]["sql"])
+
+    def test_reconcile(self):
+        Product.objects.create(title="laptop", user=self.admin)
+        # a write that skips the signals
+        Product.objects.update(user=self.other)
+        out = StringIO()
+        call_command("reconcile_product_counts", "--dry-run", stdout=out)
+        self.assertIn("2 product counts would be fixed", out.getvalue())
+        self.assert_counts(1, 0)
+        self.client.get(reverse("product-list"))
+        call_command("reconcile_product_counts", stdout=StringIO())
+        self.assert_counts(0, 1)
+        self.assertEqual(User.objects.reconcile_product_counts(), [])
+        # the cached responses showed the old counts
+        response = self.client.get(reverse("product-list"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["results"][0]["owner"]["total_products"], 1)
+
+    def test_create_response_shows_the_new_count(self):
+        for position, title in enumerate(("laptop", "phone"), 1):
+            response = self.client.post(reverse("product-list"), {"title": title, "price": "1.00"})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()["owner"]["total_products"], position)
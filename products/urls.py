@@ -3,6 +3,11 @@ from . import views
 
 urlpatterns = [
     path('', views.ProductListCreateAPIView.as_view(), name='product-list'),
+    path('bulk/', views.ProductBulkAPIView.as_view(), name='product-bulk'),
+    path('export/', views.ProductExportAPIView.as_view(), name='product-export'),
+    # The async versions of the list and detail endpoints for ASGI deployments
+    path('async/', views.async_product_list, name='product-list-async'),
+    path('async/<int:pk>/', views.async_product_detail, name='product-detail-async'),
     # The lookup_field should be the same as the keyword argument put here, 'pk'
     path('<int:pk>/', views.ProductDetailAPIView.as_view(), name='product-detail'),
     path('<int:pk>/update/', views.ProductUpdateAPIView.as_view(), name='product-edit'),
@@ -1,13 +1,26 @@
+from django.db import connections
+from django.db.models import Value
+from django.db.models.functions import Lower
 from .models import Product
-from rest_framework import serializers
-from rest_framework.validators import UniqueValidator
 
 
-def validate_title(value):
-    qs = Product.objects.filter(title__iexact=value)
-    if qs.exists():
-        raise serializers.ValidationError(f"{value} is already a product name")
-    return value
+# Checks whether another product already has this title, the case of the title is not considered
+# Both the sides are lowered by the db itself so that the lookup is answered by the unique index on LOWER(title)
+# (refer: Product.Meta.constraints) instead of scanning the whole table
+def title_exists(value, exclude_pk=None):
+    qs = Product.objects.annotate(title_lower=Lower("title")).filter(
+        title_lower=Lower(Value(value))
+    )
+    if exclude_pk is not None:
+        qs = qs.exclude(pk=exclude_pk)
+    return qs.exists()
 
 
-unique_product_title = UniqueValidator(queryset=Product.objects.all())
+# Lowers the values with the LOWER() of the db in a single query, which is what the unique index on LOWER(title) compares.
+# It is not the same as str.lower(): the LOWER() of SQLite only changes the ASCII letters ("É" stays "É").
+def lower_in_db(values, using=None):
+    if not values:
+        return []
+    with connections[using or Product.objects.db].cursor() as cursor:
+        cursor.execute("SELECT " + ", ".join(["LOWER(%s)"] * len(values)), list(values))
+        return list(cursor.fetchone())
@@ -1,14 +1,59 @@
-from .serializers import ProductSerializer  # relative imports
+from .serializers import (  # relative imports
+    CompiledProductSerializer,
+    ProductBulkItemSerializer,
+    ProductSerializer,
+    find_title_conflicts,
+)
+from contextlib import contextmanager
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework import generics, mixins
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
+from .exports import EXPORT_FORMATS, export_lines
 from .models import Product
-from api.mixins import StaffEditorPermissionMixin, UserQuerySetMixin  # absolute imports
+from api.mixins import (  # absolute imports
+    CachedResponseMixin,
+    CompiledListMixin,
+    ConditionalGetMixin,
+    SparseFieldsMixin,
+    StaffEditorPermissionMixin,
+    UserQuerySetMixin,
+    get_selected_fields,
+)
+from api.async_utils import (
+    AsyncLimitOffsetPagination,
+    error_response,
+    json_response,
+    method_not_allowed,
+    permission_denied,
+)
+from api.authentication import aauthenticate
+from api.cache import response_cache
+from api.permissions import ahas_staff_editor_permission
+from api.pagination import SelectablePagination
+from jobs.registry import enqueue
+from jobs.views import accepted_response
+from search.autocomplete import title_index
+from search.cache import search_cache
+
+User = get_user_model()
 
 
 # Remember to add the permission mixin before the generics API view while inheriting in the class else it wont work
 class ProductDetailAPIView(
-    StaffEditorPermissionMixin, UserQuerySetMixin, generics.RetrieveAPIView
+    StaffEditorPermissionMixin,
+    UserQuerySetMixin,
+    # Lets the client choose the fields with ?fields= or ?omit=
+    SparseFieldsMixin,
+    # Answers If-None-Match/If-Modified-Since with a 304
+    ConditionalGetMixin,
+    CachedResponseMixin,
+    generics.RetrieveAPIView,
 ):
     """
     * DetailView actually gets the detail of one single item
@@ -16,6 +61,8 @@ class ProductDetailAPIView(
 
     # queryset is actually the query that we write to retrieve the data, here we can write
     # custom queryset by actually overriding the get_queryset() function
+    # ProductSerializer.select_queryset() fetches the owner and the owner's product count along with the product
+    # in a single query (refer: ProductQuerySet.with_owner), unless the client left the owner out of the fields
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     # The authentication class is already provided in the settings of the project by default if we need to add extra authentication then fill the list with that
@@ -33,6 +80,14 @@ class ProductListCreateAPIView(
     # Always place the mixins before the generics view
     StaffEditorPermissionMixin,
     UserQuerySetMixin,
+    # Lets the client choose the fields with ?fields= or ?omit=
+    SparseFieldsMixin,
+    # Answers If-None-Match/If-Modified-Since with a 304
+    ConditionalGetMixin,
+    # Caches the GET responses, the POST requests are not affected by it
+    CachedResponseMixin,
+    # Renders the list with the CompiledProductSerializer
+    CompiledListMixin,
     generics.ListCreateAPIView,
 ):
     """
@@ -40,8 +95,13 @@ class ProductListCreateAPIView(
     * POST - Used to create a product
     """
 
+    # ProductSerializer.select_queryset() adds with_owner() which avoids the N+1 queries caused by the owner field
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    # The GET requests are rendered by this serializer, the POST requests still use the serializer_class
+    compiled_serializer_class = CompiledProductSerializer
+    # Clients can switch to the keyset pagination with ?pagination=keyset (refer: api/pagination.py)
+    pagination_class = SelectablePagination
 
     # Traditional Approach =>
     # -------------------------
@@ -134,3 +194,271 @@ class ProductMixinView(
         if content is None:
             content = title
         serializer.save(content=content)
+
+
+# This view is used by the ingestion jobs to create, update and delete a lot of products with a single request
+# All the items are validated together (the title uniqueness is checked with one query for the whole batch),
+# the valid items are written with bulk_create/bulk_update inside a single transaction
+# and the response contains the result or the errors of every item in the same order they were sent.
+class ProductBulkAPIView(
+    StaffEditorPermissionMixin, UserQuerySetMixin, generics.GenericAPIView
+):
+    """
+    * POST - Creates a list of products => [{"title": ..., "price": ...}, ...]
+    * PUT/PATCH - Updates a list of products => [{"id": 1, "title": ...}, ...]
+    * DELETE - Deletes a list of products => [1, 2, 3]
+    """
+
+    queryset = Product.objects.all()
+    serializer_class = ProductBulkItemSerializer
+    max_batch_size = 5000
+    # The fields that a bulk update is allowed to change
+    update_fields = ["title", "content", "price", "public"]
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items(request)
+        results, valid = self.validate_items(items)
+        products = []
+        for position, data in valid:
+            data.pop("id", None)
+            # If the content is not given then the title is used as the content, same as the ProductSerializer.create
+            if not data.get("content"):
+                data["content"] = data["title"]
+            products.append(Product(user=request.user, **data))
+
+        with self.atomic():
+            created = Product.objects.bulk_create(products)
+            # bulk_create does not send the post_save signals so the product count of the owner is kept here
+            User.objects.adjust_product_counts({request.user.pk: len(created)})
+        # and the caches are invalidated here
+        response_cache.invalidate_owners(request.user.pk)
+        search_cache.invalidate()
+        for obj in created:
+            title_index.update(obj.pk, obj.title, obj.public, obj.user_id)
+
+        self.add_results(results, valid, [obj.pk for obj in created], "created")
+        return self.get_bulk_response(results, status.HTTP_201_CREATED)
+
+    def put(self, request, *args, **kwargs):
+        return self.update(request, partial=False)
+
+    def patch(self, request, *args, **kwargs):
+        return self.update(request, partial=True)
+
+    def update(self, request, partial):
+        items = self.get_items(request)
+        # With ?background=true the batch is updated by a job (refer: products/tasks.py) and the response is a 202
+        # with the url where the progress and the outcome of the job can be followed
+        if request.query_params.get("background") in ("true", "1"):
+            job = enqueue("products.bulk_update", {"items": items, "partial": partial}, user=request.user)
+            return accepted_response(request, job)
+        results, valid, products = self.update_items(items, partial)
+        self.add_results(results, valid, [obj.pk for obj in products], "updated")
+        return self.get_bulk_response(results, status.HTTP_200_OK)
+
+    # Validates and writes the items of a bulk update, returns the results (errors are filled in),
+    # the (position, validated_data) of the valid items and the updated products
+    def update_items(self, items, partial):
+        ids = [item.get("id") for item in items if isinstance(item, dict)]
+        # Only the products that the user can see can be updated, all of them are fetched with one query
+        instances = self.get_queryset().in_bulk([pk for pk in ids if type(pk) is int])
+        results, valid = self.validate_items(items, instances=instances, partial=partial)
+
+        products = []
+        # bulk_update does not run the auto_now of updated_at so it is set here
+        now = timezone.now()
+        fields = {"updated_at"}
+        for position, data in valid:
+            instance = instances[data.pop("id")]
+            for field, value in data.items():
+                # only the update_fields are written, whatever else the serializer accepts
+                if field not in self.update_fields:
+                    continue
+                setattr(instance, field, value)
+                fields.add(field)
+            # If the content is empty then the title is used as the content, same as the ProductSerializer.update
+            if not instance.content:
+                instance.content = instance.title
+                fields.add("content")
+            instance.updated_at = now
+            products.append(instance)
+
+        with self.atomic():
+            if products:
+                Product.objects.bulk_update(products, sorted(fields))
+        # bulk_update does not send the post_save signals so the caches are invalidated here
+        response_cache.invalidate_owners(*{obj.user_id for obj in products})
+        search_cache.invalidate()
+        for obj in products:
+            title_index.update(obj.pk, obj.title, obj.public, obj.user_id)
+        return results, valid, products
+
+    def delete(self, request, *args, **kwargs):
+        ids = self.get_items(request)
+        results = [None] * len(ids)
+        valid_ids = [pk for pk in ids if type(pk) is int]
+        with transaction.atomic():
+            qs = self.get_queryset().filter(pk__in=valid_ids)
+            existing = set(qs.values_list("pk", flat=True))
+            # The delete of a queryset sends the post_delete signal for every product, so the cache is invalidated by them
+            qs.delete()
+        for position, pk in enumerate(ids):
+            if type(pk) is int and pk in existing:
+                results[position] = {"id": pk, "status": "deleted"}
+            else:
+                results[position] = {"status": "error", "errors": {"id": ["Not found."]}}
+        return self.get_bulk_response(results, status.HTTP_200_OK)
+
+    # A transaction for writing the batch, if the unique index on the titles still rejects the batch
+    # (a concurrent request created the same title after our validation) then nothing is written and a 400 is returned
+    @contextmanager
+    def atomic(self):
+        try:
+            with transaction.atomic():
+                yield
+        except IntegrityError:
+            raise ValidationError(
+                {"non_field_errors": ["A title of this batch is already a product name."]}
+            )
+
+    # Returns the list of items sent in the request body
+    def get_items(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({"non_field_errors": ["Expected a list of items."]})
+        if len(items) > self.max_batch_size:
+            raise ValidationError(
+                {"non_field_errors": [f"A batch can have at most {self.max_batch_size} items."]}
+            )
+        return items
+
+    # Validates every item of the batch and returns the list of results (errors are filled in)
+    # and the list of (position, validated_data) of the valid items
+    def validate_items(self, items, instances=None, partial=False):
+        results = [None] * len(items)
+        valid = []
+        for position, item in enumerate(items):
+            instance = None
+            if instances is not None:
+                pk = item.get("id") if isinstance(item, dict) else None
+                instance = instances.get(pk) if type(pk) is int else None
+                if instance is None:
+                    results[position] = {"status": "error", "errors": {"id": ["Not found."]}}
+                    continue
+            serializer = self.get_serializer(instance, data=item, partial=partial)
+            if not serializer.is_valid():
+                results[position] = {"status": "error", "errors": serializer.errors}
+                continue
+            data = dict(serializer.validated_data)
+            if instance is not None:
+                data["id"] = instance.pk
+            valid.append((position, data))
+
+        # The titles of the whole batch are checked for uniqueness with a single query
+        titles = [
+            (data.get("id"), data.get("title") or instances[data["id"]].title)
+            for _, data in valid
+        ]
+        conflicts = find_title_conflicts(titles)
+        for index in sorted(conflicts, reverse=True):
+            position, data = valid.pop(index)
+            results[position] = {
+                "status": "error",
+                "errors": {"title": [f"{titles[index][1]} is already a product name"]},
+            }
+        return results, valid
+
+    # Fills in the results of the items that were written
+    def add_results(self, results, valid, ids, result_status):
+        products = Product.objects.with_owner().in_bulk(ids)
+        serializer = ProductSerializer(
+            [products[pk] for pk in ids], many=True, context=self.get_serializer_context()
+        )
+        for (position, _), data in zip(valid, serializer.data):
+            results[position] = {"status": result_status, "data": data}
+
+    # 200/201 if every item succeeded, 207 if some of them failed and 400 if all of them failed
+    def get_bulk_response(self, results, success_status):
+        failed = sum(1 for result in results if result["status"] == "error")
+        if not failed:
+            response_status = success_status
+        elif failed == len(results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response(results, status=response_status)
+
+
+# This view streams all the products that the user can see as NDJSON (default) or CSV
+# instead of paging through the list endpoint 10 products at a time => /api/products/export/?type=csv
+# The type query param is used because the format query param is already used by DRF to choose the renderer
+class ProductExportAPIView(
+    StaffEditorPermissionMixin, UserQuerySetMixin, generics.GenericAPIView
+):
+    queryset = Product.objects.all()
+    export_type_query_param = "type"
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get(self.export_type_query_param, "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError(
+                {self.export_type_query_param: [f"Choose one of {', '.join(EXPORT_FORMATS)}."]}
+            )
+        lines = export_lines(self.get_queryset(), export_format)
+        response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+        response["Content-Disposition"] = f'attachment; filename="products.{export_format}"'
+        return response
+
+
+# Async versions of the ProductListCreateAPIView (GET) and ProductDetailAPIView for ASGI deployments
+# => /api/products/async/ and /api/products/async/<pk>/
+# DRF views cannot be async, so these are plain django async views that do the same checks as the DRF views:
+# the same three authentications (refer: api/authentication.aauthenticate), the same StaffEditorPermissionMixin permissions,
+# the same UserQuerySetMixin filter and the same ProductSerializer, so the json is exactly the same.
+# While the db works the event loop keeps serving the other requests instead of blocking a thread per request.
+# The ?fields= and ?omit= of the SparseFieldsMixin work the same way.
+async def get_async_queryset(request):
+    """
+    Runs the authentication and the permission checks of the DRF views
+    returns (queryset, selected fields, None) or (None, None, error response)
+    """
+    if request.method != "GET":
+        return None, None, method_not_allowed(request)
+    try:
+        user = await aauthenticate(request)
+    except AuthenticationFailed as exc:
+        return None, None, error_response(exc)
+    if not await ahas_staff_editor_permission(user, request.method, Product):
+        return None, None, permission_denied(user)
+    request.user = user
+    try:
+        fields = get_selected_fields(request.GET, ProductSerializer.Meta.fields)
+    except ValidationError as exc:
+        return None, None, error_response(exc)
+    qs = ProductSerializer.select_queryset(Product.objects.all(), fields)
+    if not user.is_superuser:
+        qs = qs.filter(user=user)
+    return qs, fields, None
+
+
+async def async_product_list(request):
+    qs, fields, error = await get_async_queryset(request)
+    if error is not None:
+        return error
+    # the same default ordering as the DRF view, the queryset is not ordered so the db order is kept
+    serializer = CompiledProductSerializer(request, fields=fields)
+    paginator = AsyncLimitOffsetPagination()
+    page = await paginator.apaginate_queryset(serializer.get_rows(qs), request)
+    return json_response(paginator.get_paginated_data(serializer.to_representation(page)))
+
+
+async def async_product_detail(request, pk):
+    qs, fields, error = await get_async_queryset(request)
+    if error is not None:
+        return error
+    try:
+        instance = await qs.aget(pk=pk)
+    except Product.DoesNotExist:
+        return error_response(NotFound("No Product matches the given query."))
+    serializer = ProductSerializer(instance, context={"request": request}, fields=fields)
+    return json_response(serializer.data)
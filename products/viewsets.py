@@ -1,6 +1,13 @@
 from rest_framework import mixins, viewsets
 from .models import Product
-from .serializers import ProductSerializer
+from .serializers import CompiledProductSerializer, ProductSerializer
+from api.mixins import (
+    CachedResponseMixin,
+    CompiledListMixin,
+    ConditionalGetMixin,
+    SparseFieldsMixin,
+)
+from api.pagination import SelectablePagination
 
 
 # Viewsets are actually same as views but we just have to inherit a viewset and we
@@ -27,7 +34,13 @@ class ProductViewSet(viewsets.ModelViewSet):
 # the ListModelMixin and RetrieveModelMixin are provided by the mixins module by rest_framework
 # that tells the viewset that thsese are the REST apis we need to use.
 class ProductGenericViewSet(
-    mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
+    SparseFieldsMixin,
+    ConditionalGetMixin,
+    CachedResponseMixin,
+    CompiledListMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
 ):
     """
     This generic viewset is created only for listing and retrieving a product item:
@@ -35,6 +48,14 @@ class ProductGenericViewSet(
      * get -> retrieve -> Product instance detail view
     """
 
+    # ProductSerializer.select_queryset() adds with_owner() which avoids the N+1 queries caused by the owner field
+    # (refer: api/mixins.SparseFieldsMixin)
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    # The list is rendered by this serializer (refer: api/mixins.CompiledListMixin)
+    compiled_serializer_class = CompiledProductSerializer
     lookup_field = "pk"
+    # Clients can switch to the keyset pagination with ?pagination=keyset (refer: api/pagination.py)
+    pagination_class = SelectablePagination
+    # This viewset shows the same products to every user so the cached responses are shared by all of them
+    cache_user_scoped = False
@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    # On SQLite altering the products table makes Django rebuild it (create a new table, copy and drop the old one)
+    # which silently drops the triggers that keep the full text and the trigram indexes in sync,
+    # so we recreate them after every migrate
+    from django.db import connections
+    from . import fts, trigram
+
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    if fts.FTS_TABLE in tables:
+        fts.install(connection)
+    if trigram.TRIGRAM_TABLE in tables:
+        trigram.install(connection)
 
 
 class SearchConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'search'
+
+    def ready(self):
+        post_migrate.connect(install_search_index, sender=self)
+        # Importing the signals module registers the signal receivers
+        from . import signals  # noqa: F401
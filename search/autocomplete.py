@@ -0,0 +1,218 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from heapq import merge
+
+from django.conf import settings
+from django.db import connections
+
+from .cache import normalize_query
+
+# This module holds the in memory index of the product titles used by the autocomplete endpoint
+# (refer: search/views.autocomplete). The search box asks for suggestions on every keystroke, and the full search
+# (refer: SearchListView) is far too heavy for that, so the titles are kept in sorted lists in the process
+# and a prefix is found with a binary search: O(log n) to find the first match and then one step per suggestion.
+#   * every word of a title is a starting point, so "lap" suggests "Laptop stand" and also "Gaming laptop"
+#   * the public titles are in one list and the private ones in a list per owner, a user gets both merged
+#     (the same visibility as the search: the public products and his own ones)
+#   * the index is built from the db in a background thread when the server starts (refer: cfehome/wsgi.py and asgi.py),
+#     then kept up to date by the product signals (refer: search/signals.py) once the writes are committed.
+#     Only a request that comes before the first build is done waits for it (or builds it, outside of a server).
+#   * the signals only reach the index of the process that wrote the product, so with several processes the index
+#     is built again after AUTOCOMPLETE_REBUILD_SECONDS to pick up the writes of the other processes. That build runs
+#     in a background thread too, the requests keep using the old index until the new one is swapped in.
+
+
+class TitleIndex:
+    # Only the first words of a title are starting points, this bounds the memory used by very long titles
+    max_words = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held by the build that is running, in the thread of a request or in a background thread
+        self._build_lock = threading.Lock()
+        self._build_thread = None
+        self._clear()
+
+    def _clear(self):
+        # sorted lists of (key, product id), a key is the normalized title from one of its words to the end
+        self._public = []
+        self._private = {}
+        # product id -> (title, owner id of a private product or None, keys)
+        self._products = {}
+        self._built_at = None
+        # the updates that happen while the index is being built, they are applied on the new index
+        self._pending = None
+
+    @property
+    def rebuild_seconds(self):
+        return getattr(settings, "AUTOCOMPLETE_REBUILD_SECONDS", 300)
+
+    def clear(self):
+        '''
+        Drops the index, it is built again on the next use
+        '''
+        with self._lock:
+            self._clear()
+
+    def is_built(self):
+        return self._built_at is not None
+
+    def ensure_built(self):
+        if not self.is_built():
+            # waits for the build in progress (the one started with the server), or builds it
+            with self._build_lock:
+                if not self.is_built():
+                    self.build()
+            return
+        if self.rebuild_seconds is not None and time.monotonic() - self._built_at > self.rebuild_seconds:
+            # the old index keeps answering while the new one is built
+            self.start_build()
+
+    def start_build(self):
+        '''
+        Builds the index from the db in a background thread, returns False if a build is already running
+        '''
+        if not self._build_lock.acquire(blocking=False):
+            return False
+        try:
+            self._build_thread = threading.Thread(target=self._build_in_background, name="title-index-build", daemon=True)
+            self._build_thread.start()
+        except BaseException:
+            self._build_lock.release()
+            raise
+        return True
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        finally:
+            self._build_lock.release()
+            # the thread opened its own connection
+            connections.close_all()
+
+    def wait_for_build(self, timeout=None):
+        thread = self._build_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def build(self, rows=None):
+        '''
+        Builds the index from rows of (product id, title, public, owner id), or from the db if no rows are given
+        '''
+        from products.models import Product
+
+        with self._lock:
+            self._pending = []
+        if rows is None:
+            rows = Product.objects.filter(title__isnull=False).values_list("pk", "title", "public", "user_id").iterator()
+        public, private, products = [], {}, {}
+        for pk, title, is_public, user_id in rows:
+            entry = self._make_entry(pk, title, is_public, user_id)
+            if entry is None:
+                continue
+            products[pk] = entry
+            target = public if entry[1] is None else private.setdefault(entry[1], [])
+            target.extend((key, pk) for key in entry[2])
+        # sorting once is much faster than inserting the keys one by one
+        public.sort()
+        for entries in private.values():
+            entries.sort()
+
+        with self._lock:
+            pending = self._pending
+            self._public, self._private, self._products = public, private, products
+            self._pending = None
+            self._built_at = time.monotonic()
+            for update in pending:
+                self._apply(*update)
+
+    def _make_entry(self, pk, title, is_public, user_id):
+        if not title:
+            return None
+        # the private products without an owner are not visible to anyone
+        if not is_public and user_id is None:
+            return None
+        words = normalize_query(title).split(" ")[: self.max_words]
+        keys = {" ".join(words[position:]) for position in range(len(words))}
+        return title, None if is_public else user_id, keys
+
+    def update(self, pk, title, is_public, user_id):
+        '''
+        Adds the product to the index or replaces its previous title/visibility
+        '''
+        self._update(("update", pk, title, is_public, user_id))
+
+    def remove(self, pk):
+        self._update(("remove", pk, None, None, None))
+
+    def remove_owner(self, user_id):
+        '''
+        Drops the private titles of a deleted user, nobody else can see them
+        '''
+        self._update(("remove_owner", user_id, None, None, None))
+
+    def _update(self, update):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(update)
+            # an index that was not built yet will read the product from the db
+            if self._built_at is not None:
+                self._apply(*update)
+
+    def _apply(self, operation, pk, title, is_public, user_id):
+        if operation == "remove_owner":
+            for _, product_pk in self._private.pop(pk, []):
+                self._products.pop(product_pk, None)
+            return
+        previous = self._products.pop(pk, None)
+        if previous is not None:
+            entries = self._public if previous[1] is None else self._private.get(previous[1], [])
+            for key in previous[2]:
+                position = bisect_left(entries, (key, pk))
+                if position < len(entries) and entries[position] == (key, pk):
+                    del entries[position]
+        if operation == "update":
+            entry = self._make_entry(pk, title, is_public, user_id)
+            if entry is None:
+                return
+            self._products[pk] = entry
+            entries = self._public if entry[1] is None else self._private.setdefault(entry[1], [])
+            for key in entry[2]:
+                insort(entries, (key, pk))
+
+    def suggest(self, query, user=None, limit=10):
+        '''
+        Returns up to limit products (id and title) whose title has a word starting with the query,
+        in the alphabetical order of the matching part of the title
+        '''
+        prefix = normalize_query(query)
+        if not prefix or limit <= 0:
+            return []
+        self.ensure_built()
+        with self._lock:
+            scans = [self._scan(self._public, prefix)]
+            if user is not None and user.is_authenticated and user.pk in self._private:
+                scans.append(self._scan(self._private[user.pk], prefix))
+            results = []
+            seen = set()
+            for _, pk in merge(*scans):
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                results.append({"id": pk, "title": self._products[pk][0]})
+                if len(results) == limit:
+                    break
+        return results
+
+    def _scan(self, entries, prefix):
+        position = bisect_left(entries, (prefix,))
+        while position < len(entries) and entries[position][0].startswith(prefix):
+            yield entries[position]
+            position += 1
+
+    def __len__(self):
+        return len(self._products)
+
+
+title_index = TitleIndex()
@@ -0,0 +1,172 @@
+import threading
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from api.cache import LRUCache, bump_version, get_version
+
+
+# This module caches the results of the product search (refer: SearchListView)
+# The same popular queries are searched again and again, every search runs the full text MATCH (or scans the table)
+# only to find the same products. So the ids of the matching products are cached in order (the most relevant first)
+# per (normalized query, visibility scope, search mode, facet filters), and the pages are served from the cached ids:
+# a page only loads its own 10 products by their primary key.
+#   * the query is normalized (refer: normalize_query) so "Laptop", " laptop " and "ＬＡＰＴＯＰ" share one entry
+#   * the scope is "public" for the anonymous users and "user:<id>" for the others, who also see their own products
+#   * the entries live in a LRU cache in the process (SEARCH_CACHE_MAX_SIZE entries), the results with more than
+#     SEARCH_CACHE_MAX_RESULTS products are not cached
+#   * every product write bumps a generation number which is a part of the keys (refer: search/signals.py),
+#     it is stored in the django cache (SEARCH_CACHE_ALIAS) so that a write in one process makes the entries
+#     of all the processes stale, the stale entries are evicted by the LRU
+#   * the entries also expire after SEARCH_CACHE_TTL seconds, in case a write could not reach the shared generation
+#     (like a run_jobs worker whose SEARCH_CACHE_ALIAS is a cache of its own process)
+
+
+def normalize_query(query):
+    '''
+    Returns the query in the form it is searched and cached with:
+    the unicode compatibility form (NFKC, like the full width letters), lower case and single spaces,
+    without the control characters (like NUL) that a title cannot contain
+    '''
+    query = unicodedata.normalize("NFKC", query)
+    query = "".join(char for char in query if char.isspace() or unicodedata.category(char) != "Cc")
+    return " ".join(query.lower().split())
+
+
+class SearchResultCache:
+    generation_key = "search-cache:generation"
+
+    def __init__(self):
+        self.local = LRUCache(
+            max_size=getattr(settings, "SEARCH_CACHE_MAX_SIZE", 1000), ttl=getattr(settings, "SEARCH_CACHE_TTL", 300)
+        )
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "SEARCH_CACHE_ALIAS", "default")]
+
+    @property
+    def max_results(self):
+        return getattr(settings, "SEARCH_CACHE_MAX_RESULTS", 5000)
+
+    def get_scope(self, user):
+        if user is None or not user.is_authenticated:
+            return "public"
+        return f"user:{user.pk}"
+
+    def get_generation(self):
+        return get_version(self.cache, self.generation_key)
+
+    def get_ids(self, queryset, query, user=None, fuzzy=False, filters=()):
+        '''
+        Returns the ids of the products of the queryset that match the (normalized) query in the order of the search
+        (or of the fuzzy search), from the cache if they are there, or None if there are too many of them to be cached.
+        filters is the key of the facet filters applied to the queryset (refer: search/facets.py)
+        '''
+        key = (self.get_generation(), self.get_scope(user), "fuzzy" if fuzzy else "exact", filters, query)
+        ids = self.local.get(key)
+        if ids is not None:
+            self._count("hits")
+            return ids
+        self._count("misses")
+        # one more than the limit tells whether the results are too many
+        search = queryset.fuzzy_search if fuzzy else queryset.search
+        ids = list(search(query, user=user).values_list("pk", flat=True)[: self.max_results + 1])
+        if len(ids) > self.max_results:
+            return None
+        # a tuple so that the cached list cannot be changed by its users
+        ids = tuple(ids)
+        self.local.set(key, ids)
+        return ids
+
+    # Makes all the cached results stale, it is called for every product write
+    def invalidate(self):
+        self._bump()
+        # a search that ran before the write was committed could have cached the old results with the new generation,
+        # so the generation is bumped once again after the commit (right away when there is no transaction)
+        transaction.on_commit(self._bump)
+
+    def _bump(self):
+        bump_version(self.cache, self.generation_key)
+        self._count("invalidations")
+
+    def clear(self):
+        self.local.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["size"] = len(self.local)
+        stats["evictions"] = self.local.get_stats()["evictions"]
+        return stats
+
+
+search_cache = SearchResultCache()
+
+
+# These are the results of a search served from the cached ids, they behave like the queryset of the search
+# for the paginations and the serializers: the LimitOffsetPagination counts them with count() and slices a page,
+# only the products of that page are loaded (WHERE id IN (...)) and they are returned in the order of the ids.
+# values() gives the same results as values() rows for the compiled serializers, and order_by() (used by the keyset
+# pagination and the ETag of the ConditionalGetMixin) returns a real queryset of the products with these ids.
+class SearchResults:
+    def __init__(self, ids, queryset):
+        self.ids = ids
+        self.queryset = queryset
+
+    @property
+    def model(self):
+        return self.queryset.model
+
+    def count(self):
+        return len(self.ids)
+
+    async def acount(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SearchResults(self.ids[index], self.queryset)
+        return list(SearchResults(self.ids[index : index + 1], self.queryset))[0]
+
+    def values(self, *fields):
+        return SearchResults(self.ids, self.queryset.values(*fields))
+
+    def order_by(self, *fields):
+        return self.queryset.filter(pk__in=self.ids).order_by(*fields)
+
+    def none(self):
+        return SearchResults((), self.queryset)
+
+    def get_rows_queryset(self):
+        # the order of the ids is restored in python, the db does not have to sort them
+        return self.queryset.filter(pk__in=self.ids).order_by()
+
+    def sort_rows(self, rows):
+        position = {pk: index for index, pk in enumerate(self.ids)}
+        return sorted(rows, key=lambda row: position[row["id"] if isinstance(row, dict) else row.pk])
+
+    def __iter__(self):
+        if not self.ids:
+            return iter(())
+        return iter(self.sort_rows(self.get_rows_queryset()))
+
+    async def __aiter__(self):
+        if not self.ids:
+            return
+        rows = [row async for row in self.get_rows_queryset()]
+        for row in self.sort_rows(rows):
+            yield row
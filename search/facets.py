@@ -0,0 +1,116 @@
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count, Q
+from rest_framework.exceptions import ValidationError
+
+# This module holds the facets of the product search (refer: SearchListView)
+# With ?facets=true the search response also has the counts shown next to the results:
+#   * price: the number of results in every price bucket, the buckets are set by SEARCH_FACET_PRICE_BUCKETS
+#   * owner: the owners with the most results (at most SEARCH_FACET_MAX_OWNERS of them)
+#   * visibility: the number of public and private results
+# They take two aggregate queries over the results (refer: get_facets): the price buckets and the visibility are
+# conditional counts of a single row, and the top owners are grouped, ordered and limited by the db, so a search
+# whose results have thousands of owners still only sends SEARCH_FACET_MAX_OWNERS rows back.
+# The facets can also be used as filters: ?price=10-50, ?owner=<id> and ?visibility=public|private,
+# they are applied to the products before the search as plain predicates on the indexed columns
+# (the (price, id), (user, id) and (public, id) indexes of the Product model).
+
+FILTER_PARAMS = ("price", "owner", "visibility")
+
+
+def get_price_buckets():
+    '''
+    Returns the (key, min, max) of the price buckets, the max of the last bucket is None
+    '''
+    edges = [Decimal(str(edge)) for edge in getattr(settings, "SEARCH_FACET_PRICE_BUCKETS", [0, 10, 50, 100, 500])]
+    buckets = []
+    for position, low in enumerate(edges):
+        high = edges[position + 1] if position + 1 < len(edges) else None
+        buckets.append((f"{low}-{high if high is not None else ''}", low, high))
+    return buckets
+
+
+def parse_price(value):
+    # "10-50", "10-" or "-50", the min is included and the max is not, like the buckets
+    low, separator, high = value.partition("-")
+    if not separator or not (low or high):
+        raise ValidationError({"price": ['Must be a range like "10-50", "10-" or "-50".']})
+    try:
+        low, high = (Decimal(low) if low else None, Decimal(high) if high else None)
+    except InvalidOperation:
+        raise ValidationError({"price": ["The range must be made of numbers."]})
+    # "nan" and "inf" are numbers for Decimal but not for the price column
+    if any(value is not None and not value.is_finite() for value in (low, high)):
+        raise ValidationError({"price": ["The range must be made of finite numbers."]})
+    return low, high
+
+
+def get_filters(params):
+    '''
+    Returns the lookups of the facet filters given in the query params, and a hashable form of them
+    which is a part of the key of the cached search results (refer: search/cache.py)
+    '''
+    lookups = {}
+    price = params.get("price")
+    if price:
+        low, high = parse_price(price)
+        if low is not None:
+            lookups["price__gte"] = low
+        if high is not None:
+            lookups["price__lt"] = high
+    owner = params.get("owner")
+    if owner:
+        try:
+            lookups["user_id"] = int(owner)
+        except ValueError:
+            raise ValidationError({"owner": ["A valid integer is required."]})
+        # the ids are 64 bit integers in the db, a larger one would overflow the query parameter
+        if not -(2**63) <= lookups["user_id"] < 2**63:
+            raise ValidationError({"owner": ["Ensure this value is a valid id."]})
+    visibility = params.get("visibility")
+    if visibility:
+        if visibility not in ("public", "private"):
+            raise ValidationError({"visibility": ['Must be "public" or "private".']})
+        # public__in is written as "public" IN (...) which SQLite can look up in the (public, id) index
+        # (refer: ProductQuerySet.visible_to)
+        lookups["public__in"] = [visibility == "public"]
+    key = tuple(sorted((name, str(value)) for name, value in lookups.items()))
+    return lookups, key
+
+
+def get_facets(queryset):
+    '''
+    Returns the facet counts of the products of the queryset (or of the cached search results) with two aggregate queries
+    '''
+    # order_by() drops the ordering of the search, it does not change the counts
+    queryset = queryset.order_by()
+    buckets = get_price_buckets()
+    counts = {"total": Count("pk"), "public": Count("pk", filter=Q(public=True))}
+    for position, (_, low, high) in enumerate(buckets):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        counts[f"price_{position}"] = Count("pk", filter=condition)
+    totals = queryset.aggregate(**counts)
+    owners = (
+        queryset.filter(user__isnull=False)
+        .values("user_id", "user__username")
+        .annotate(total=Count("pk"))
+        .order_by("-total", "user_id")[: getattr(settings, "SEARCH_FACET_MAX_OWNERS", 10)]
+    )
+    return {
+        "price": [
+            {
+                "key": key,
+                "min": str(low),
+                "max": str(high) if high is not None else None,
+                "count": totals[f"price_{position}"],
+            }
+            for position, (key, low, high) in enumerate(buckets)
+        ],
+        "owner": [
+            {"id": group["user_id"], "username": group["user__username"], "count": group["total"]} for group in owners
+        ],
+        "visibility": {"public": totals["public"], "private": totals["total"] - totals["public"]},
+    }
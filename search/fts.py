@@ -0,0 +1,93 @@
+import sqlite3
+
+from django.db import connections
+
+# This module holds everything related to the SQLite FTS5 full text index of the products
+# The index is an "external content" FTS5 table, which means it does not store a copy of the product data,
+# it only stores the inverted index and reads the title/content back from the products_product table.
+# refer: https://www.sqlite.org/fts5.html#external_content_tables
+
+FTS_TABLE = "search_productfts"
+PRODUCT_TABLE = "products_product"
+
+# The trigram tokenizer indexes every 3 character sequence of the text, this lets a MATCH query find any substring
+# of the title/content exactly like the old title__icontains lookup did, but using the index instead of a full table scan.
+# Because of this a query shorter than 3 characters cannot be answered by the index.
+MIN_QUERY_LENGTH = 3
+
+# The trigram tokenizer is available from SQLite 3.34.0 onwards
+MIN_SQLITE_VERSION = (3, 34, 0)
+
+CREATE_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    title, content, content='{PRODUCT_TABLE}', content_rowid='id', tokenize='trigram'
+)
+"""
+
+# The triggers keep the index in sync with every insert, update and delete on the products table
+# this also covers the bulk operations (bulk_create, queryset.update() and queryset.delete()) which do not send signals
+CREATE_TRIGGERS_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, content ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+
+def is_supported(connection):
+    '''
+    Returns True if the database of the given connection can hold the FTS5 trigram index
+    '''
+    return connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= MIN_SQLITE_VERSION
+
+
+def is_enabled(using="default"):
+    return is_supported(connections[using])
+
+
+def install(connection):
+    '''
+    Creates the FTS5 table and the triggers that keep it in sync, it is safe to call this multiple times
+    '''
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        for sql in CREATE_TRIGGERS_SQL:
+            cursor.execute(sql)
+
+
+def rebuild(using="default"):
+    '''
+    Rebuilds the whole index from the products table and then merges the index segments
+    '''
+    connection = connections[using]
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def match_expression(query):
+    '''
+    Converts the search query into an FTS5 MATCH expression
+    returns None if the query cannot be answered by the index
+    '''
+    # FTS5 reads a NUL as the end of the expression and fails with "unterminated string", the LIKE can search it
+    if query is None or len(query) < MIN_QUERY_LENGTH or "\x00" in query:
+        return None
+    # The whole query is matched as a single phrase (a substring for the trigram tokenizer)
+    # double quotes inside the phrase are escaped by doubling them
+    return '"%s"' % query.replace('"', '""')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from search import fts, trigram
+
+
+# This command rebuilds the full text index and the trigram index of the products from scratch
+# usage: python manage.py rebuild_search_index [--database default]
+class Command(BaseCommand):
+    help = "Rebuilds the full text and trigram search indexes of the products"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="The database whose search index must be rebuilt",
+        )
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        if not fts.is_supported(connections[using]):
+            raise CommandError(
+                "The full text search index needs SQLite %s or newer"
+                % ".".join(str(part) for part in fts.MIN_SQLITE_VERSION)
+            )
+        fts.rebuild(using=using)
+        trigram.rebuild(using=using)
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt successfully"))
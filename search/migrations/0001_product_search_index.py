@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:24
+
+import django.db.models.deletion
+import search.models
+from django.db import migrations, models
+from search import fts
+
+
+def create_search_index(apps, schema_editor):
+    if not fts.is_supported(schema_editor.connection):
+        return
+    fts.install(schema_editor.connection)
+    # index the products that already exist in the database
+    schema_editor.execute(f"INSERT INTO {fts.FTS_TABLE}({fts.FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    if not fts.is_supported(schema_editor.connection):
+        return
+    for suffix in ("ai", "ad", "au"):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts.FTS_TABLE}_{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {fts.FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='products.product')),
+                ('title', models.TextField()),
+                ('content', models.TextField(null=True)),
+                ('document', search.models.FullTextField(db_column='search_productfts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'search_productfts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from search import trigram
+
+
+def create_trigram_index(apps, schema_editor):
+    if not trigram.is_supported(schema_editor.connection):
+        return
+    # index the products that already exist in the database
+    trigram.rebuild(using=schema_editor.connection.alias)
+
+
+def drop_trigram_index(apps, schema_editor):
+    if not trigram.is_supported(schema_editor.connection):
+        return
+    for suffix in ("ai", "ad", "au"):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {trigram.TRIGRAM_TABLE}_{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {trigram.TRIGRAM_TABLE}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {trigram.POSITION_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_visibility_indexes'),
+        ('search', '0001_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductTrigram',
+            fields=[
+                ('pk', models.CompositePrimaryKey('trigram', 'product', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('trigram', models.TextField()),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='trigrams', to='products.product')),
+            ],
+            options={
+                'db_table': 'search_producttrigram',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
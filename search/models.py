@@ -1,3 +1,71 @@
 from django.db import models
+from django.db.models import Lookup
+
+from .fts import FTS_TABLE
+from .trigram import TRIGRAM_TABLE
 
 # Create your models here.
+
+
+# This is a field that represents the hidden column of the FTS5 table which has the same name as the table itself
+# it is the column we run the MATCH operator against
+class FullTextField(models.TextField):
+    pass
+
+
+# This is a custom lookup which lets us write queries like filter(search_entry__document__match="...")
+# which generates the SQL => "search_productfts"."search_productfts" MATCH '...'
+@FullTextField.register_lookup
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class ProductSearchEntry(models.Model):
+    '''
+    Unmanaged model mapped on the FTS5 full text index of the products (refer: search/fts.py)
+    The table and the triggers that keep it in sync are created by the migrations of this app and not by Django
+    '''
+
+    # The rowid of the FTS5 table is the id of the product it indexes
+    product = models.OneToOneField(
+        "products.Product",
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        related_name="search_entry",
+    )
+    title = models.TextField()
+    content = models.TextField(null=True)
+    document = FullTextField(db_column=FTS_TABLE)
+    # rank is the bm25 relevance score given by FTS5, the lower the value the more relevant the row is
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
+
+class ProductTrigram(models.Model):
+    '''
+    Unmanaged model mapped on the trigram index of the product titles (refer: search/trigram.py)
+    The table and the triggers that keep it in sync are created by the migrations of this app and not by Django
+    '''
+
+    pk = models.CompositePrimaryKey("trigram", "product")
+    trigram = models.TextField()
+    product = models.ForeignKey(
+        "products.Product",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="trigrams",
+    )
+
+    class Meta:
+        managed = False
+        db_table = TRIGRAM_TABLE
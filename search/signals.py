@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import Product
+
+from .autocomplete import title_index
+from .cache import search_cache
+
+User = get_user_model()
+
+
+# Every product write can change the results of any search (a new title, a product made public, a new owner)
+# so it makes all the cached search results stale (refer: search/cache.py)
+# The bulk operations that skip the signals (bulk_create(), bulk_update()) must call search_cache.invalidate() themselves.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_search_cache(sender, instance, **kwargs):
+    search_cache.invalidate()
+
+
+# The autocomplete index (refer: search/autocomplete.py) is updated with the product once the write is committed,
+# a rolled back write never reaches it. The values are read now, the instance can change before the commit.
+# The bulk operations must call title_index.update() for their products themselves.
+@receiver(post_save, sender=Product)
+def update_title_index(sender, instance, **kwargs):
+    values = (instance.pk, instance.title, instance.public, instance.user_id)
+    transaction.on_commit(lambda: title_index.update(*values))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_title_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: title_index.remove(pk))
+
+
+# The products of a deleted user lose their owner with an UPDATE (on_delete=SET_NULL) that sends no product signals,
+# his private products are not visible to anyone anymore
+@receiver(post_delete, sender=User)
+def remove_owner_from_title_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: title_index.remove_owner(pk))
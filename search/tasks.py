@@ -0,0 +1,20 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from jobs.registry import task
+
+from . import fts, trigram
+from .cache import search_cache
+
+
+# Rebuilds the full text and the trigram indexes of the products in the background (refer: search/views.rebuild_index)
+# the same work as the rebuild_search_index command, a single rebuild runs at a time
+@task("search.rebuild_index", concurrency=1)
+def rebuild_index(job, using=DEFAULT_DB_ALIAS):
+    job.set_progress(0, total=2)
+    if fts.is_enabled(using):
+        fts.rebuild(using=using)
+    job.set_progress(1)
+    trigram.rebuild(using=using)
+    job.set_progress(2)
+    search_cache.invalidate()
+    return {"database": using}
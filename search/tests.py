@@ -1,3 +1,554 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from products.models import Product
+
+from . import facets, fts, trigram
+from .autocomplete import TitleIndex, title_index
+from .cache import SearchResultCache, normalize_query, search_cache
+
+User = get_user_model()
+
 
 # Create your tests here.
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", username="owner", password="pass12345"
+        )
+        self.other = User.objects.create_user(
+            email="other@example.com", username="other", password="pass12345"
+        )
+        self.laptop = Product.objects.create(
+            title="Gaming Laptop", content="fast laptop", user=self.owner
+        )
+        self.mouse = Product.objects.create(
+            title="Mouse", content="works with any laptop", user=self.owner
+        )
+        self.secret = Product.objects.create(
+            title="Secret laptop", content="", public=False, user=self.owner
+        )
+        self.hidden = Product.objects.create(
+            title="Hidden laptop", content="", public=False, user=self.other
+        )
+
+    def search_ids(self, query, user=None):
+        return list(Product.objects.search(query, user=user).values_list("id", flat=True))
+
+    def test_index_is_used(self):
+        self.assertTrue(fts.is_enabled())
+        self.assertIn("MATCH", str(Product.objects.search("laptop").query))
+
+    def test_substring_case_insensitive(self):
+        self.assertCountEqual(self.search_ids("APTO"), [self.laptop.id, self.mouse.id])
+
+    def test_visibility(self):
+        self.assertCountEqual(
+            self.search_ids("laptop", user=self.owner),
+            [self.laptop.id, self.mouse.id, self.secret.id],
+        )
+
+    def test_ranked_by_relevance(self):
+        # the laptop mentions the query twice so it must come before the mouse
+        self.assertEqual(self.search_ids("laptop")[0], self.laptop.id)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.mouse.title = "Keyboard"
+        self.mouse.content = "mechanical"
+        self.mouse.save()
+        self.assertEqual(self.search_ids("keyboard"), [self.mouse.id])
+        self.assertEqual(self.search_ids("laptop"), [self.laptop.id])
+        self.laptop.delete()
+        self.assertEqual(self.search_ids("laptop"), [])
+
+    def test_short_query_falls_back(self):
+        self.assertCountEqual(self.search_ids("ga"), [self.laptop.id])
+
+    def test_quotes_in_query(self):
+        self.assertEqual(self.search_ids('lap"top'), [])
+
+    def test_control_characters_in_query(self):
+        # a NUL ends the FTS5 expression, the query falls back to the LIKE instead
+        self.assertIsNone(fts.match_expression("lap\x00top"))
+        self.assertEqual(self.search_ids("lap\x00top"), [])
+        self.assertEqual(normalize_query("lap\x00top\x07"), "laptop")
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.get(reverse("product-search") + "?query=lap%00top")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {fts.FTS_TABLE}({fts.FTS_TABLE}) VALUES ('delete-all')")
+        self.assertEqual(self.search_ids("laptop"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.search_ids("laptop")), 2)
+
+    def test_search_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.get(reverse("product-search") + "?query=laptop")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 3)
+
+
+class FuzzySearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+        self.laptop = Product.objects.create(title="Gaming Laptop", user=self.owner)
+        self.stand = Product.objects.create(title="Laptop Stand", user=self.owner)
+        self.mouse = Product.objects.create(title="Wireless Mouse", user=self.owner)
+        self.secret = Product.objects.create(title="Secret Labtop", public=False, user=self.owner)
+
+    def search_ids(self, query, user=None):
+        return list(Product.objects.fuzzy_search(normalize_query(query), user=user).values_list("id", flat=True))
+
+    def test_misspelled_queries(self):
+        self.assertCountEqual(self.search_ids("labtop"), [self.laptop.id, self.stand.id])
+        self.assertEqual(self.search_ids("wirless mose"), [self.mouse.id])
+        self.assertEqual(self.search_ids("keyboard"), [])
+        # the exact search finds nothing
+        self.assertEqual(list(Product.objects.search("labtop")), [])
+
+    def test_closest_first(self):
+        self.assertEqual(self.search_ids("gaming laptp")[0], self.laptop.id)
+        self.assertEqual(self.search_ids("laptop stnd")[0], self.stand.id)
+
+    def test_visibility(self):
+        self.assertNotIn(self.secret.id, self.search_ids("labtop"))
+        self.assertEqual(self.search_ids("secret", user=self.owner), [self.secret.id])
+
+    def test_short_query_falls_back(self):
+        self.assertEqual(self.search_ids("mo"), [self.mouse.id])
+
+    def test_index_follows_writes(self):
+        self.mouse.title = "Mechanical Keyboard"
+        self.mouse.save()
+        self.assertEqual(self.search_ids("keybord"), [self.mouse.id])
+        self.assertEqual(self.search_ids("wirless mose"), [])
+        Product.objects.filter(pk=self.laptop.pk).update(title="Gaming Chair")
+        self.assertEqual(self.search_ids("gamng chair"), [self.laptop.id])
+        Product.objects.filter(pk=self.mouse.pk).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {trigram.TRIGRAM_TABLE} WHERE product_id = %s", [self.mouse.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {trigram.TRIGRAM_TABLE}")
+        self.assertEqual(self.search_ids("labtop"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.search_ids("labtop")), 2)
+
+    def test_candidates_come_from_the_index(self):
+        Product.objects.bulk_create(Product(title=f"Product {n}", user=self.owner) for n in range(200))
+        with CaptureQueriesContext(connection) as ctx:
+            self.search_ids("labtop")
+        self.assertIn(trigram.TRIGRAM_TABLE, ctx.captured_queries[0]["sql"])
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + ctx.captured_queries[0]["sql"])
+            plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+        self.assertNotIn(f"SCAN {trigram.TRIGRAM_TABLE}", plan)
+
+    def test_search_endpoint(self):
+        client = APIClient()
+        response = client.get(reverse("product-search") + "?query=labtop&mode=fuzzy")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(client.get(reverse("product-search") + "?query=labtop").json()["count"], 0)
+        self.assertEqual(client.get(reverse("product-search") + "?query=labtop&mode=other").status_code, 400)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        search_cache.clear()
+        self.owner = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+        self.other = User.objects.create_user(email="other@example.com", username="other", password="pass12345")
+        self.cheap = Product.objects.create(title="Cheap laptop", price="5.00", user=self.owner)
+        self.gaming = Product.objects.create(title="Gaming laptop", price="60.00", user=self.owner)
+        self.secret = Product.objects.create(title="Secret laptop", price="20.00", public=False, user=self.owner)
+        self.used = Product.objects.create(title="Used laptop", price="600.00", user=self.other)
+        Product.objects.create(title="Mouse", price="10.00", user=self.other)
+        self.client = APIClient()
+        self.url = reverse("product-search")
+
+    def get(self, query):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_facets_of_all_the_results(self):
+        self.client.force_authenticate(self.owner)
+        data = self.get("?query=laptop&facets=true&limit=1")
+        self.assertEqual(len(data["results"]), 1)
+        counts = data["facets"]
+        self.assertEqual(
+            [(bucket["key"], bucket["count"]) for bucket in counts["price"]],
+            [("0-10", 1), ("10-50", 1), ("50-100", 1), ("100-500", 0), ("500-", 1)],
+        )
+        self.assertEqual(
+            counts["owner"],
+            [{"id": self.owner.pk, "username": "owner", "count": 3}, {"id": self.other.pk, "username": "other", "count": 1}],
+        )
+        self.assertEqual(counts["visibility"], {"public": 3, "private": 1})
+        self.assertNotIn("facets", self.get("?query=laptop"))
+
+    def test_aggregate_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            counts = facets.get_facets(Product.objects.search("laptop"))
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(counts["visibility"], {"public": 3, "private": 0})
+        # the top owners are picked by the db
+        with self.settings(SEARCH_FACET_MAX_OWNERS=1), CaptureQueriesContext(connection) as ctx:
+            counts = facets.get_facets(Product.objects.search("laptop"))
+        self.assertEqual([owner["id"] for owner in counts["owner"]], [self.owner.pk])
+        self.assertIn("LIMIT 1", ctx.captured_queries[-1]["sql"])
+
+    def test_facets_reuse_the_search(self):
+        self.client.force_authenticate(self.owner)
+        with mock.patch.object(search_cache, "get_ids", wraps=search_cache.get_ids) as get_ids:
+            self.get("?query=laptop&facets=true")
+        self.assertEqual(get_ids.call_count, 1)
+        # the results that are too many to be cached are counted by the queries of the search
+        with self.settings(SEARCH_CACHE_MAX_RESULTS=1):
+            data = self.get("?query=laptop&facets=true")
+        self.assertEqual(data["facets"]["visibility"], {"public": 3, "private": 1})
+
+    def test_filters(self):
+        self.client.force_authenticate(self.owner)
+        ids = lambda data: sorted(row["id"] for row in data["results"])
+        self.assertEqual(ids(self.get("?query=laptop&price=10-100")), sorted([self.gaming.id, self.secret.id]))
+        self.assertEqual(ids(self.get("?query=laptop&price=500-")), [self.used.id])
+        self.assertEqual(ids(self.get("?query=laptop&price=-10")), [self.cheap.id])
+        self.assertEqual(ids(self.get(f"?query=laptop&owner={self.other.pk}")), [self.used.id])
+        self.assertEqual(ids(self.get("?query=laptop&visibility=private")), [self.secret.id])
+        data = self.get("?query=laptop&visibility=public&facets=true")
+        self.assertEqual(data["facets"]["visibility"], {"public": 3, "private": 0})
+        # the filters are a part of the key of the cached results
+        self.assertEqual(len(self.get("?query=laptop")["results"]), 4)
+
+    def test_invalid_filters(self):
+        for query in (
+            "price=cheap",
+            "price=10",
+            "price=a-b",
+            "price=nan-",
+            "price=inf-",
+            "price=-Infinity",
+            "owner=me",
+            "owner=99999999999999999999999",
+            "visibility=all",
+        ):
+            response = self.client.get(self.url + "?query=laptop&" + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_filters_use_the_indexes(self):
+        lookups, _ = facets.get_filters({"price": "10-50", "visibility": "public"})
+        with CaptureQueriesContext(connection) as ctx:
+            list(Product.objects.filter(**lookups))
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + ctx.captured_queries[0]["sql"])
+            plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn("INDEX", plan)
+
+
+class AsyncSearchViewTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            email="owner@example.com", username="owner", password=None, is_staff=True
+        )
+        Product.objects.create(title="Gaming Laptop", content="fast laptop", user=self.owner)
+        Product.objects.create(title="Secret laptop", content="", public=False, user=self.owner)
+        Product.objects.create(title="Mouse", content="", user=self.owner)
+
+    def assert_same_response(self, query, headers=None):
+        headers = headers or {}
+        expected = self.client.get(reverse("product-search") + query, headers=headers)
+        response = async_to_sync(self.async_client.get)(
+            reverse("product-search-async") + query, headers=headers
+        )
+        self.assertEqual(response.status_code, expected.status_code)
+        content = response.content.decode().replace("/search/async/", "/search/")
+        self.assertEqual(json.loads(content), expected.json())
+        return response.json()
+
+    def test_anonymous_search(self):
+        self.assertEqual(self.assert_same_response("?query=laptop")["count"], 1)
+        self.assertEqual(self.assert_same_response("")["count"], 0)
+        self.assertEqual(self.assert_same_response("?query=labtop&mode=fuzzy")["count"], 1)
+
+    def test_owner_sees_private_products(self):
+        headers = {"Authorization": f"Bearer {Token.objects.create(user=self.owner).key}"}
+        self.assertEqual(self.assert_same_response("?query=laptop", headers)["count"], 2)
+
+
+class SearchResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        search_cache.clear()
+        self.owner = User.objects.create_superuser(
+            email="owner@example.com", username="owner", password=None
+        )
+        self.gaming = Product.objects.create(title="Gaming Laptop", content="laptop laptop", price="30.00", user=self.owner)
+        self.mouse = Product.objects.create(title="Mouse", content="for any laptop", price="10.00", user=self.owner)
+        self.secret = Product.objects.create(title="Secret laptop", content="", public=False, price="20.00", user=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = reverse("product-search")
+
+    def search(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        searches = [q for q in ctx.captured_queries if "MATCH" in q["sql"] or "LIKE" in q["sql"]]
+        return response.json(), len(searches)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  ＬＡＰＴＯＰ   Pro "), "laptop pro")
+
+    def test_normalized_queries_share_the_results(self):
+        data, searches = self.search("?query=laptop")
+        self.assertEqual(searches, 1)
+        self.assertEqual(data["count"], 3)
+        for query in ("?query=LAPTOP", "?query=%20laptop%20", "?query=ｌａｐｔｏｐ"):
+            cached, searches = self.search(query)
+            self.assertEqual(searches, 0, query)
+            self.assertEqual(cached["results"], data["results"])
+
+    def test_pages_keep_the_order_of_the_search(self):
+        expected = [row["id"] for row in self.search("?query=laptop")[0]["results"]]
+        self.assertEqual(expected[0], self.gaming.pk)
+        pages = [self.search(f"?query=laptop&limit=1&offset={offset}")[0] for offset in range(3)]
+        self.assertEqual([page["results"][0]["id"] for page in pages], expected)
+        self.assertEqual(pages[0]["count"], 3)
+        # the keyset pagination orders the cached results by price
+        data, _ = self.search("?query=laptop&pagination=keyset&ordering=price")
+        self.assertEqual([row["id"] for row in data["results"]], [self.mouse.pk, self.secret.pk, self.gaming.pk])
+
+    def test_scopes(self):
+        self.search("?query=laptop")
+        self.client.force_authenticate(None)
+        data, searches = self.search("?query=laptop")
+        self.assertEqual(searches, 1)
+        self.assertEqual(data["count"], 2)
+
+    def test_product_writes_invalidate(self):
+        self.search("?query=laptop")
+        Product.objects.create(title="laptop bag", user=self.owner)
+        data, searches = self.search("?query=laptop")
+        self.assertEqual((data["count"], searches), (4, 1))
+        response = self.client.post(reverse("product-bulk"), [{"title": "laptop stand"}], format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.search("?query=laptop")[0]["count"], 5)
+        self.mouse.delete()
+        self.assertEqual(self.search("?query=laptop")[0]["count"], 4)
+
+    def test_size_bound(self):
+        with self.settings(SEARCH_CACHE_MAX_SIZE=2):
+            bounded = SearchResultCache()
+        for query in ("laptop", "mouse", "secret"):
+            bounded.get_ids(Product.objects.all(), query)
+        self.assertEqual(len(bounded.local), 2)
+        self.assertEqual(bounded.get_stats()["evictions"], 1)
+        # the least recently used query was evicted
+        bounded.get_ids(Product.objects.all(), "laptop")
+        self.assertEqual(bounded.get_stats()["hits"], 0)
+
+    def test_results_expire(self):
+        with self.settings(SEARCH_CACHE_TTL=0):
+            expiring = SearchResultCache()
+        expiring.get_ids(Product.objects.all(), "laptop")
+        time.sleep(0.01)
+        expiring.get_ids(Product.objects.all(), "laptop")
+        self.assertEqual(expiring.get_stats()["hits"], 0)
+
+    def test_too_many_results_are_not_cached(self):
+        with self.settings(SEARCH_CACHE_MAX_RESULTS=2):
+            self.assertIsNone(search_cache.get_ids(Product.objects.all(), "laptop", user=self.owner))
+            data, first = self.search("?query=laptop")
+            _, second = self.search("?query=laptop")
+        self.assertEqual(data["count"], 3)
+        # the second request searched as much as the first one
+        self.assertEqual(first, second)
+        self.assertEqual(len(search_cache.local), 0)
+
+
+class TitleIndexTests(TestCase):
+    def setUp(self):
+        self.index = TitleIndex()
+        self.owner = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+        self.other = User.objects.create_user(email="other@example.com", username="other", password="pass12345")
+        self.index.build(
+            [
+                (1, "Laptop Stand", True, self.owner.pk),
+                (2, "Gaming  LAPTOP", True, self.owner.pk),
+                (3, "Secret laptop bag", False, self.owner.pk),
+                (4, "Mouse", True, None),
+                (5, "Orphan laptop", False, None),
+            ]
+        )
+
+    def titles(self, query, user=None, limit=10):
+        return [result["title"] for result in self.index.suggest(query, user=user, limit=limit)]
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(self.titles(" LAP"), ["Gaming  LAPTOP", "Laptop Stand"])
+        self.assertEqual(self.titles("gaming l"), ["Gaming  LAPTOP"])
+        self.assertEqual(self.titles("stand"), ["Laptop Stand"])
+        self.assertEqual(self.titles("keyboard"), [])
+        self.assertEqual(self.titles(""), [])
+
+    def test_private_titles_only_for_their_owner(self):
+        self.assertEqual(self.titles("secret", user=self.owner), ["Secret laptop bag"])
+        self.assertEqual(self.titles("secret", user=self.other), [])
+        self.assertEqual(len(self.titles("laptop", user=self.owner)), 3)
+        # the private products without an owner are not indexed
+        self.assertEqual(len(self.index), 4)
+
+    def test_limit_and_one_result_per_product(self):
+        self.index.update(6, "Laptop laptop laptop", True, None)
+        self.assertEqual(self.titles("laptop", limit=2), ["Gaming  LAPTOP", "Laptop laptop laptop"])
+        self.assertEqual(len(self.titles("laptop")), 3)
+
+    def test_updates(self):
+        # made private, renamed and deleted
+        self.index.update(1, "Laptop Stand", False, self.owner.pk)
+        self.assertEqual(self.titles("stand"), [])
+        self.assertEqual(self.titles("stand", user=self.owner), ["Laptop Stand"])
+        self.index.update(2, "Keyboard", True, self.owner.pk)
+        self.assertEqual(self.titles("gaming"), [])
+        self.assertEqual(self.titles("key"), ["Keyboard"])
+        self.index.remove(4)
+        self.assertEqual(self.titles("mouse"), [])
+        self.index.remove_owner(self.owner.pk)
+        self.assertEqual(self.titles("laptop", user=self.owner), [])
+
+    def test_built_from_the_db_on_first_use(self):
+        Product.objects.create(title="Desk Lamp", user=self.owner)
+        index = TitleIndex()
+        # the updates of an index that is not built yet are ignored, the build reads them from the db
+        index.update(99, "Desk Chair", True, None)
+        self.assertFalse(index.is_built())
+        self.assertEqual([r["title"] for r in index.suggest("desk")], ["Desk Lamp"])
+        self.assertTrue(index.is_built())
+
+    def test_suggest_is_fast_on_a_large_index(self):
+        index = TitleIndex()
+        index.build((pk, f"Product {pk} laptop model {pk % 97}", pk % 5 != 0, pk % 50 + 1) for pk in range(1, 50001))
+        start = time.perf_counter()
+        for _ in range(100):
+            results = index.suggest("product 12", limit=10)
+        elapsed = (time.perf_counter() - start) / 100
+        self.assertEqual(len(results), 10)
+        # a generous bound, a lookup takes a few microseconds
+        self.assertLess(elapsed, 0.005)
+
+
+# The index is built again in a background thread, which only sees the committed rows
+class TitleIndexRebuildTests(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+
+    def test_built_in_the_background(self):
+        Product.objects.create(title="Desk Lamp", user=self.owner)
+        index = TitleIndex()
+        self.assertTrue(index.start_build())
+        index.wait_for_build()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual([r["title"] for r in index.suggest("desk")], ["Desk Lamp"])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_rebuilt_after_the_configured_time(self):
+        index = TitleIndex()
+        index.suggest("desk")
+        Product.objects.create(title="Desk Lamp", user=self.owner)
+        self.assertEqual(index.suggest("desk"), [])
+        release = threading.Event()
+        build = index.build
+
+        def slow_build(rows=None):
+            release.wait(5)
+            build(rows)
+
+        with self.settings(AUTOCOMPLETE_REBUILD_SECONDS=0), mock.patch.object(index, "build", slow_build):
+            time.sleep(0.001)
+            # the request is answered by the old index while the new one is built
+            self.assertEqual(index.suggest("desk"), [])
+            release.set()
+            index.wait_for_build()
+        self.assertEqual([r["title"] for r in index.suggest("desk")], ["Desk Lamp"])
+
+
+class AutocompleteViewTests(TestCase):
+    def setUp(self):
+        title_index.clear()
+        self.addCleanup(title_index.clear)
+        self.owner = User.objects.create_user(email="owner@example.com", username="owner", password="pass12345")
+        self.laptop = Product.objects.create(title="Gaming Laptop", user=self.owner)
+        self.secret = Product.objects.create(title="Secret laptop", public=False, user=self.owner)
+        self.client = APIClient()
+        self.url = reverse("product-autocomplete")
+
+    def test_anonymous_users_get_the_public_titles(self):
+        response = self.client.get(self.url + "?query=lap")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"results": [{"id": self.laptop.pk, "title": "Gaming Laptop"}]})
+
+    def test_owner_gets_his_private_titles(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(self.url + "?query=lap")
+        self.assertEqual([r["id"] for r in response.json()["results"]], [self.laptop.pk, self.secret.pk])
+
+    def test_served_without_queries_once_built(self):
+        self.client.get(self.url + "?query=lap")
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url + "?query=gam")
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_limit(self):
+        Product.objects.create(title="Laptop Stand", user=self.owner)
+        response = self.client.get(self.url + "?query=lap&limit=1")
+        self.assertEqual(len(response.json()["results"]), 1)
+        with self.settings(AUTOCOMPLETE_MAX_LIMIT=1):
+            response = self.client.get(self.url + "?query=lap&limit=50")
+        self.assertEqual(len(response.json()["results"]), 1)
+        for limit in ("0", "many"):
+            response = self.client.get(self.url + f"?query=lap&limit={limit}")
+            self.assertEqual(response.status_code, 400)
+
+    def test_updated_by_the_writes_once_committed(self):
+        self.client.get(self.url + "?query=lap")
+        with self.captureOnCommitCallbacks(execute=True):
+            keyboard = Product.objects.create(title="Keyboard", user=self.owner)
+            self.laptop.title = "Gaming Mouse"
+            self.laptop.save()
+        response = self.client.get(self.url + "?query=key")
+        self.assertEqual(response.json()["results"], [{"id": keyboard.pk, "title": "Keyboard"}])
+        self.assertEqual(self.client.get(self.url + "?query=lap").json()["results"], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            keyboard.delete()
+        self.assertEqual(self.client.get(self.url + "?query=key").json()["results"], [])
+
+    def test_bulk_create_updates_the_index(self):
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client.force_authenticate(admin)
+        self.client.get(self.url + "?query=lap")
+        response = self.client.post(reverse("product-bulk"), [{"title": "Laptop Stand", "price": "1.00"}], format="json")
+        self.assertEqual(response.status_code, 201)
+        titles = [r["title"] for r in self.client.get(self.url + "?query=lap").json()["results"]]
+        self.assertEqual(titles, ["Gaming Laptop", "Laptop Stand"])
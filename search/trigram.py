@@ -0,0 +1,172 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+
+from .cache import normalize_query
+from .fts import PRODUCT_TABLE
+
+# This module holds the trigram index of the product titles used by the fuzzy search (refer: ProductQuerySet.fuzzy_search)
+# The full text index (refer: search/fts.py) only finds the exact substrings, so "labtop" finds nothing.
+# SQLite has no pg_trgm, so the trigrams of every title are kept in a side table of (trigram, product id) rows:
+#   * the trigrams of a title are its 3 character sequences once lower cased and padded with a space on both sides,
+#     " gaming laptop " gives " ga", "gam", ..., "op " (the spaces mark the start and the end of the words)
+#   * the table is kept in sync by triggers on the products table like the full text index, this also covers the
+#     bulk operations that do not send signals. SQLite does not allow a WITH RECURSIVE inside a trigger, so the
+#     positions of the trigrams are read from a small table of the numbers 1..MAX_INDEXED_LENGTH
+#   * a search looks up the trigrams of the query in the primary key of the table, which gives the products that
+#     share enough of them, only these candidates are scored in python (refer: similarity)
+# The triggers lower case with the lower() of SQLite which only knows the ASCII letters, so a title with upper case
+# accented letters shares fewer trigrams with the query, it can still be found by the exact search.
+
+TRIGRAM_TABLE = "search_producttrigram"
+POSITION_TABLE = "search_trigramposition"
+
+# The titles are indexed up to this length (the titles of the products are at most 120 characters long)
+MAX_INDEXED_LENGTH = 255
+
+# A query shorter than this has too few trigrams to tell the products apart, it is answered by the exact search
+MIN_QUERY_LENGTH = 3
+
+CREATE_TABLES_SQL = [
+    # WITHOUT ROWID stores the rows in the primary key itself, a lookup by trigram reads a single b-tree
+    f"""
+    CREATE TABLE IF NOT EXISTS {TRIGRAM_TABLE} (
+        trigram TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        PRIMARY KEY (trigram, product_id)
+    ) WITHOUT ROWID
+    """,
+    # used by the triggers to remove the trigrams of an updated or deleted product
+    f"CREATE INDEX IF NOT EXISTS {TRIGRAM_TABLE}_product_idx ON {TRIGRAM_TABLE}(product_id)",
+    f"CREATE TABLE IF NOT EXISTS {POSITION_TABLE} (n INTEGER PRIMARY KEY)",
+]
+
+
+def insert_sql(row):
+    # The trigrams of the title of the given row (new inside a trigger), the duplicates are stored once
+    return f"""
+        INSERT OR IGNORE INTO {TRIGRAM_TABLE}(trigram, product_id)
+        SELECT substr(' ' || lower({row}.title) || ' ', n, 3), {row}.id FROM {POSITION_TABLE}
+        WHERE n <= length({row}.title)
+    """
+
+
+CREATE_TRIGGERS_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+        {insert_sql("new")};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+        DELETE FROM {TRIGRAM_TABLE} WHERE product_id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_au AFTER UPDATE OF title ON {PRODUCT_TABLE} BEGIN
+        DELETE FROM {TRIGRAM_TABLE} WHERE product_id = old.id;
+        {insert_sql("new")};
+    END
+    """,
+]
+
+
+def is_supported(connection):
+    '''
+    Returns True if the database of the given connection can hold the trigram index
+    '''
+    return connection.vendor == "sqlite"
+
+
+def is_enabled(using="default"):
+    return is_supported(connections[using])
+
+
+def install(connection):
+    '''
+    Creates the trigram table and the triggers that keep it in sync, it is safe to call this multiple times
+    '''
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in CREATE_TABLES_SQL:
+            cursor.execute(sql)
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {POSITION_TABLE}(n) VALUES (%s)",
+            [(n,) for n in range(1, MAX_INDEXED_LENGTH + 1)],
+        )
+        for sql in CREATE_TRIGGERS_SQL:
+            cursor.execute(sql)
+
+
+def rebuild(using="default"):
+    '''
+    Rebuilds the whole trigram index from the products table
+    '''
+    connection = connections[using]
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TRIGRAM_TABLE}")
+        cursor.execute(
+            f"""
+            INSERT OR IGNORE INTO {TRIGRAM_TABLE}(trigram, product_id)
+            SELECT substr(' ' || lower(p.title) || ' ', n, 3), p.id
+            FROM {PRODUCT_TABLE} AS p JOIN {POSITION_TABLE} ON n <= length(p.title)
+            """
+        )
+
+
+def trigrams(text):
+    '''
+    Returns the set of trigrams of an already normalized text (refer: search.cache.normalize_query)
+    '''
+    padded = f" {text[:MAX_INDEXED_LENGTH]} "
+    return {padded[position : position + 3] for position in range(len(padded) - 2)}
+
+
+def similarity(query, title):
+    '''
+    Returns how close the title is to the query, from 0 to 1: the share of the trigrams that the query has in common
+    with the closest run of words of the title (as many words as the query has), or with the whole title.
+    A short query is compared to the words it can match, "labtop" is close to "Gaming Laptop" because it is close to "laptop".
+    '''
+    query_trigrams = trigrams(query)
+    words = normalize_query(title).split(" ")
+    size = len(query.split(" "))
+    texts = {" ".join(words[position : position + size]) for position in range(max(len(words) - size + 1, 1))}
+    texts.add(" ".join(words))
+    best = 0.0
+    for text in texts:
+        text_trigrams = trigrams(text)
+        best = max(best, len(query_trigrams & text_trigrams) / len(query_trigrams | text_trigrams))
+    return best
+
+
+def search_ids(queryset, query, user=None):
+    '''
+    Returns the ids of the products of the queryset visible to the user whose title is close to the (normalized) query,
+    the closest ones first, or None if the query cannot be answered by the trigram index
+    '''
+    if not is_enabled(queryset.db) or len(query) < MIN_QUERY_LENGTH:
+        return None
+    threshold = getattr(settings, "SEARCH_FUZZY_THRESHOLD", 0.3)
+    max_candidates = getattr(settings, "SEARCH_FUZZY_MAX_CANDIDATES", 200)
+    query_trigrams = trigrams(query)
+    # A title as close as the threshold shares at least this many trigrams with the query (the union of the trigrams
+    # is never smaller than the trigrams of the query), the others are left out by the db
+    min_shared = max(int(threshold * len(query_trigrams) + 0.999), 1)
+    candidates = (
+        queryset.visible_to(user)
+        .filter(trigrams__trigram__in=query_trigrams)
+        .values("pk", "title")
+        .annotate(shared=Count("trigrams"))
+        .filter(shared__gte=min_shared)
+        .order_by("-shared", "pk")[:max_candidates]
+    )
+    scored = []
+    for row in candidates:
+        score = similarity(query, row["title"])
+        if score >= threshold:
+            scored.append((-score, -row["shared"], row["pk"]))
+    scored.sort()
+    return [pk for _, _, pk in scored]
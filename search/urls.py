@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path("", views.SearchListView.as_view(), name="product-search"),
+    path("async/", views.async_search, name="product-search-async"),
+    path("autocomplete/", views.autocomplete, name="product-autocomplete"),
+    path("index/rebuild/", views.rebuild_index, name="search-index-rebuild"),
 ]
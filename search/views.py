@@ -1,22 +1,146 @@
-from rest_framework import generics
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import generics, permissions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
 from products.models import Product
-from products.serializers import ProductSerializer
+from products.serializers import CompiledProductSerializer, ProductSerializer
+from api.mixins import CompiledListMixin, ConditionalGetMixin, SparseFieldsMixin, get_selected_fields
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from api.async_utils import AsyncLimitOffsetPagination, error_response, json_response, method_not_allowed
+from api.authentication import aauthenticate
+from api.pagination import SelectablePagination
+from jobs.registry import enqueue
+from jobs.views import accepted_response
+from . import facets
+from .autocomplete import title_index
+from .cache import SearchResults, normalize_query, search_cache
+
+
+# ?mode=fuzzy switches to the typo tolerant search (refer: ProductQuerySet.fuzzy_search), the default is the exact one
+def is_fuzzy(params):
+    mode = params.get("mode", "exact")
+    if mode not in ("exact", "fuzzy"):
+        raise ValidationError({"mode": ['Must be "exact" or "fuzzy".']})
+    return mode == "fuzzy"
+
+
+def run_search(queryset, query, user, fuzzy):
+    if fuzzy:
+        return queryset.fuzzy_search(query, user=user)
+    return queryset.search(query, user=user)
 
 
 # Create your views here.
-class SearchListView(generics.ListAPIView):
+class SearchListView(SparseFieldsMixin, ConditionalGetMixin, CompiledListMixin, generics.ListAPIView):
+    # ProductSerializer.select_queryset() adds with_owner() which avoids the N+1 queries caused by the owner field
+    # (refer: api/mixins.SparseFieldsMixin)
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    # The results are rendered by this serializer (refer: api/mixins.CompiledListMixin)
+    compiled_serializer_class = CompiledProductSerializer
+    # Clients can switch to the keyset pagination with ?pagination=keyset (refer: api/pagination.py)
+    # The keyset pages are in the order of ?ordering= (the newest first by default) and not in the order of
+    # the relevance or of the similarity of the fuzzy search, the keyset pagination has no position for them.
+    pagination_class = SelectablePagination
 
     def get_queryset(self, *args, **kwargs):
         # This returns a ProductQuerySet instance, which means when you call the get_queryset()
         # it calls the get_queryset that is defined inside the ProductManager which returns an instance of ProductQuerySet
         qs = super().get_queryset(*args, **kwargs)
         q = self.request.GET.get("query")
-        results = Product.objects.none()
+        # qs.none() keeps the columns of with_owner() that the compiled serializer reads
+        results = qs.none()
         if q is not None:
             user = None
             if self.request.user.is_authenticated:
                 user = self.request.user
-            results = qs.search(q, user=user)
+            # The facet filters (?price=, ?owner=, ?visibility=) narrow the products before the search (refer: search/facets.py)
+            lookups, filters = facets.get_filters(self.request.GET)
+            qs = qs.filter(**lookups)
+            # The ids of the results are cached per normalized query, the pages are loaded by their ids (refer: search/cache.py)
+            query = normalize_query(q)
+            fuzzy = is_fuzzy(self.request.GET)
+            ids = search_cache.get_ids(qs, query, user=user, fuzzy=fuzzy, filters=filters)
+            results = SearchResults(ids, qs) if ids is not None else run_search(qs, query, user, fuzzy)
         return results
+
+    def filter_queryset(self, queryset):
+        # the results of the page are kept for the facets, the search is not run a second time for them
+        self.results = super().filter_queryset(queryset)
+        return self.results
+
+    # With ?facets=true the response also has the facet counts of all the results, not only of the page
+    # (refer: search/facets.py). A 304 has no body so the facets are only computed for a full response.
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200 and request.GET.get("facets") in ("true", "1"):
+            response.data["facets"] = facets.get_facets(self.results)
+        return response
+
+
+# The async version of the SearchListView for ASGI deployments => /api/products/search/async/?query=...
+# (refer: the async views in products/views.py)
+async def async_search(request):
+    if request.method != "GET":
+        return method_not_allowed(request)
+    try:
+        user = await aauthenticate(request)
+    except AuthenticationFailed as exc:
+        return error_response(exc)
+    request.user = user
+    try:
+        fields = get_selected_fields(request.GET, ProductSerializer.Meta.fields)
+        fuzzy = is_fuzzy(request.GET)
+    except ValidationError as exc:
+        return error_response(exc)
+    q = request.GET.get("query")
+    qs = ProductSerializer.select_queryset(Product.objects.all(), fields)
+    results = qs.none()
+    if q is not None:
+        # the same cached results as the SearchListView
+        user = user if user.is_authenticated else None
+        query = normalize_query(q)
+        ids = await sync_to_async(search_cache.get_ids)(qs, query, user=user, fuzzy=fuzzy)
+        if ids is not None:
+            results = SearchResults(ids, qs)
+        else:
+            # the fuzzy search scores its candidates in python before it returns the queryset
+            results = await sync_to_async(run_search)(qs, query, user, fuzzy)
+    serializer = CompiledProductSerializer(request, fields=fields)
+    paginator = AsyncLimitOffsetPagination()
+    page = await paginator.apaginate_queryset(serializer.get_rows(results), request)
+    return json_response(paginator.get_paginated_data(serializer.to_representation(page)))
+
+
+# The suggestions for the search box => /api/products/search/autocomplete/?query=lap&limit=10
+# They come from the in memory index of the titles (refer: search/autocomplete.py), not from the db,
+# so a keystroke costs a binary search instead of a full text search. Anonymous users get the public titles,
+# the others also get the titles of their own private products.
+@api_view(["GET"])
+def autocomplete(request, *args, **kwargs):
+    '''
+    Returns the products (id and title) whose title has a word starting with the query
+    '''
+    limit = request.query_params.get("limit", settings.AUTOCOMPLETE_DEFAULT_LIMIT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValidationError({"limit": ["A valid integer is required."]})
+    if limit < 1:
+        raise ValidationError({"limit": ["Ensure this value is greater than or equal to 1."]})
+    limit = min(limit, settings.AUTOCOMPLETE_MAX_LIMIT)
+    query = request.query_params.get("query", "")
+    return Response({"results": title_index.suggest(query, user=request.user, limit=limit)})
+
+
+# Rebuilds the search indexes in the background => POST /api/products/search/index/rebuild/
+# the rebuild reads the whole products table, so it runs in a job (refer: search/tasks.py) and this answers
+# with a 202 and the url of the job right away
+@api_view(["POST"])
+@permission_classes([permissions.IsAdminUser])
+def rebuild_index(request, *args, **kwargs):
+    '''
+    Enqueues a rebuild of the full text and trigram indexes of the products
+    '''
+    return accepted_response(request, enqueue("search.rebuild_index", user=request.user))